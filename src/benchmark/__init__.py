@@ -0,0 +1,11 @@
+import os
+
+
+def load_pixivbot():
+    # 与tests/conftest.py一致，基准测试不需要真实的token
+    os.environ.setdefault("PIXIV_REFRESH_TOKEN", "benchmark")
+
+    import nonebot
+
+    nonebot.init()
+    return nonebot.load_plugin("nonebot_plugin_pixivbot")
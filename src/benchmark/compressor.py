@@ -0,0 +1,79 @@
+"""
+Compressor后端基准测试：线程池 vs 进程池
+
+用法（在src目录下执行）：python -m benchmark.compressor [--workers 4] [--concurrency 8] [--rounds 3]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from . import load_pixivbot
+
+CASES = [("small", 800, 600), ("large", 4000, 3000)]
+FORMATS = ["PNG", "JPEG"]
+
+
+def make_image(w: int, h: int, fmt: str) -> bytes:
+    # 渐变叠加噪声，可压缩程度接近一般插画
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, w, dtype=np.float32)
+    y = np.linspace(0, 255, h, dtype=np.float32)
+    base = (x[None, :, None] + y[:, None, None]) / 2
+    noise = rng.normal(0, 16, (h, w, 3))
+    arr = np.clip(base + noise, 0, 255).astype(np.uint8)
+
+    with BytesIO() as bio:
+        Image.fromarray(arr, "RGB").save(bio, format=fmt)
+        return bio.getvalue()
+
+
+async def run_case(backend, content: bytes, concurrency: int, rounds: int, max_size: int) -> float:
+    begin = time.perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*[backend.compress(content, max_size, 0.8) for _ in range(concurrency)])
+    return time.perf_counter() - begin
+
+
+async def main(args):
+    load_pixivbot()
+    from nonebot_plugin_pixivbot.data.pixiv_repo.compressor import ThreadCompressorBackend, \
+        ProcessCompressorBackend
+
+    backends = {"thread": ThreadCompressorBackend(args.workers)}
+    if ProcessCompressorBackend.is_supported():
+        backends["process"] = ProcessCompressorBackend(args.workers)
+    else:
+        print("process backend is not supported on this platform")
+
+    print(f"workers={args.workers} concurrency={args.concurrency} rounds={args.rounds} max_size={args.max_size}")
+    print(f"{'format':<7}{'case':<7}{'size':>10}  {'backend':<9}{'elapsed':>9}{'throughput':>14}")
+
+    try:
+        for fmt in FORMATS:
+            for name, w, h in CASES:
+                content = make_image(w, h, fmt)
+                for backend_name, backend in backends.items():
+                    # 预热（进程池在首次提交时才创建子进程）
+                    await run_case(backend, content, args.workers, 1, args.max_size)
+                    elapsed = await run_case(backend, content, args.concurrency, args.rounds, args.max_size)
+                    n = args.concurrency * args.rounds
+                    print(f"{fmt:<7}{name:<7}{len(content) / 1024 / 1024:>8.2f}MB  {backend_name:<9}"
+                          f"{elapsed:>8.2f}s{n / elapsed:>9.2f} img/s")
+    finally:
+        for backend in backends.values():
+            backend.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--max-size", type=int, default=1200)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,136 @@
+"""
+SharedAsyncGeneratorManager扇出基准测试：逐项加锁（旧实现） vs Condition广播 vs Condition广播+bounded
+
+用法（在src目录下执行）：python -m benchmark.shared_agen_fanout [--items 20000] [--consumers 1 10 100]
+"""
+
+import argparse
+import asyncio
+import time
+from asyncio import Lock
+
+from . import load_pixivbot
+
+
+class Item:
+    # 模拟一个带完整信息的列表元素
+    __slots__ = ("id", "payload")
+
+    def __init__(self, id: int):
+        self.id = id
+        self.payload = bytes(256)
+
+
+class CompactItem:
+    __slots__ = ("id",)
+
+    def __init__(self, id: int):
+        self.id = id
+
+
+def make_manager(impl: str, n_items: int):
+    from nonebot_plugin_pixivbot.data.pixiv_repo.enums import CacheStrategy
+    from nonebot_plugin_pixivbot.utils.shared_agen import SharedAsyncGeneratorManager
+
+    class LegacyHolder(SharedAsyncGeneratorManager._AgenHolder):
+        # 改为Condition广播前的实现：每取一项都要获取一次锁，并保留所有原始项
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._got_items = []
+            self._mutex = Lock()
+
+        @property
+        def buffered(self) -> int:
+            return len(self._got_items)
+
+        async def _generator(self):
+            cur = 0
+            while True:
+                if cur < self._got:
+                    yield self._got_items[cur]
+                    cur += 1
+                else:
+                    if self._stopped:
+                        break
+
+                    async with self._mutex:
+                        if self._stopped:
+                            break
+
+                        if cur == self._got:
+                            try:
+                                new_data = await self._origin.__anext__()
+                            except StopAsyncIteration:
+                                self._stopped = True
+                                await self._manager.on_agen_stop(self._identifier, self._got_items)
+                                break
+
+                            await self._manager.on_agen_next(self._identifier, new_data)
+
+                            self._got_items.append(new_data)
+                            self._got += 1
+
+                        yield self._got_items[cur]
+                        cur += 1
+
+    class Manager(SharedAsyncGeneratorManager[int, Item]):
+        log_tag = "benchmark"
+
+        if impl == "legacy":
+            _AgenHolder = LegacyHolder
+
+        def __init__(self):
+            super().__init__()
+            self.peak_buffered = 0
+
+        def bounded(self, identifier: int) -> bool:
+            return impl == "bounded"
+
+        def snapshot_item(self, identifier: int, item: Item) -> CompactItem:
+            return CompactItem(item.id)
+
+        async def agen(self, identifier: int, cache_strategy: CacheStrategy, **kwargs):
+            holder = self._running_holders[identifier]
+            for i in range(n_items):
+                if i % 30 == 0:
+                    # 模拟逐页加载
+                    await asyncio.sleep(0)
+                self.peak_buffered = max(self.peak_buffered, holder.buffered)
+                yield Item(i)
+
+    return Manager()
+
+
+async def run(impl: str, n_items: int, n_consumers: int):
+    mgr = make_manager(impl, n_items)
+
+    async def consumer():
+        cnt = 0
+        async with mgr.get(0) as gen:
+            async for _ in gen:
+                cnt += 1
+        assert cnt == n_items
+
+    begin = time.perf_counter()
+    await asyncio.gather(*[consumer() for _ in range(n_consumers)])
+    return time.perf_counter() - begin, mgr.peak_buffered
+
+
+async def main(args):
+    load_pixivbot()
+
+    print(f"items={args.items}")
+    print(f"{'impl':<9}{'consumers':>10}{'elapsed':>10}{'items/s':>14}{'peak buffered':>15}")
+
+    for n_consumers in args.consumers:
+        for impl in ["legacy", "cond", "bounded"]:
+            elapsed, peak = await run(impl, args.items, n_consumers)
+            throughput = args.items * n_consumers / elapsed
+            print(f"{impl:<9}{n_consumers:>10}{elapsed:>9.3f}s{throughput:>14.0f}{peak:>15}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=20000)
+    parser.add_argument("--consumers", type=int, nargs="+", default=[1, 10, 100])
+    asyncio.run(main(parser.parse_args()))
@@ -1,4 +1,5 @@
 from collections.abc import Sequence
+from datetime import time
 from functools import partial
 from pathlib import Path
 from typing import Optional, List, Literal, Any, Dict
@@ -26,6 +27,7 @@ def _get_default_sql_conn_url():
 
 class Config(BaseModel):
     pixiv_refresh_token: str
+    pixiv_extra_refresh_tokens: List[str] = []
 
     pixiv_sql_conn_url: str = _get_default_sql_conn_url()
 
@@ -40,16 +42,29 @@ class Config(BaseModel):
 
     pixiv_use_local_cache: bool = True
     pixiv_local_cache_type: Literal["sql", "file"] = "file"
+    pixiv_hot_cache_size: int = 4096
+    pixiv_image_memory_budget: int = 64 * 1024 * 1024
+    pixiv_compact_illust_list: bool = True
+    pixiv_bounded_replay_buffer: bool = True
 
     pixiv_proxy: Optional[str] = None
     pixiv_query_timeout: float = 60.0
     pixiv_loading_prompt_delayed_time: float = 5.0
     pixiv_simultaneous_query: int = 8
+    pixiv_simultaneous_download: int = 8
+    pixiv_download_timeout: float = 180.0
+    pixiv_rate_limit_initial_rate: Optional[float] = None
+    pixiv_rate_limit_min_rate: float = 0.1
+    pixiv_rate_limit_max_rate: float = 10.0
+    pixiv_rate_limit_wait_timeout: float = 30.0
+    pixiv_background_priority_aging: float = 10.0
+    pixiv_illust_detail_batch_window: float = 0.01
+    pixiv_following_merge_concurrency: int = 4
+    pixiv_page_prefetch: bool = True
 
     pixiv_download_cache_expires_in: int = 3600 * 24 * 7
     pixiv_illust_detail_cache_expires_in: int = 3600 * 24 * 7
     pixiv_user_detail_cache_expires_in: int = 3600 * 24 * 7
-    pixiv_illust_ranking_cache_expires_in: int = 3600 * 6
     pixiv_search_illust_cache_expires_in: int = 3600 * 24
     pixiv_search_illust_cache_delete_in: int = 3600 * 24 * 30
     pixiv_search_user_cache_expires_in: int = 3600 * 24
@@ -61,16 +76,26 @@ class Config(BaseModel):
     pixiv_related_illusts_cache_expires_in: int = 3600 * 24
     pixiv_other_cache_expires_in: int = 3600 * 6
 
+    pixiv_illust_detail_cache_stale_in: int = 3600 * 24
+    pixiv_user_detail_cache_stale_in: int = 3600 * 24
+    pixiv_related_illusts_cache_stale_in: int = 3600 * 24
+    pixiv_other_cache_stale_in: int = 3600 * 6
+
     pixiv_block_tags: List[str] = []
     pixiv_block_action: BlockAction = BlockAction.no_image
 
     pixiv_exclude_ai_illusts: bool = False
 
     pixiv_download_custom_domain: Optional[str] = None
+    pixiv_download_streaming: bool = True
 
     pixiv_compression_enabled: bool = False
     pixiv_compression_max_size: int = 1200
     pixiv_compression_quantity: float = 0.8
+    pixiv_compression_backend: Literal["thread", "process"] = "thread"
+    pixiv_compression_process_threshold: int = 4 * 1024 * 1024
+    pixiv_thumbnail_max_size: int = 400
+    pixiv_download_cache_original: bool = False
 
     pixiv_query_to_me_only: bool = False
     pixiv_command_to_me_only: bool = False
@@ -80,6 +105,7 @@ class Config(BaseModel):
 
     pixiv_send_illust_link: bool = False
     pixiv_send_forward_message: Literal['always', 'auto', 'never'] = 'auto'
+    pixiv_forward_message_thumbnail: bool = False
 
     pixiv_max_item_per_query: int = 10
     pixiv_max_page_per_illust: int = 10
@@ -97,6 +123,9 @@ class Config(BaseModel):
     pixiv_ranking_default_range: Sequence[int] = [1, 3]
     pixiv_ranking_fetch_item: int = 150
     pixiv_ranking_max_item_per_query: int = 10
+    pixiv_ranking_rollover_time: time = time(12, 30)
+    pixiv_ranking_rollover_fetch: bool = True
+    pixiv_ranking_cache_retention_days: int = 30
 
     @field_validator('pixiv_ranking_default_range', mode="after")
     def ranking_default_range_validator(cls, v):
@@ -147,7 +176,12 @@ class Config(BaseModel):
     pixiv_random_following_illust_max_page: int = 2 ** 31
     pixiv_random_following_illust_max_item: int = 2 ** 31
 
+    pixiv_random_progressive_pages: int = 10
+    pixiv_random_streaming_sampling: bool = False
+
     pixiv_watch_interval: int = 600
+    pixiv_watch_max_interval: int = 3600 * 2
+    pixiv_schedule_prewarm_lead_time: int = 60
 
     access_control_reply_on_permission_denied: Optional[str] = None
     access_control_reply_on_rate_limited: Optional[str] = None
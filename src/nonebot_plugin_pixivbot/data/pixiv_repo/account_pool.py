@@ -0,0 +1,181 @@
+import asyncio
+from asyncio import sleep, create_task, gather, wait_for, CancelledError, Event, Task
+from contextlib import asynccontextmanager
+from typing import List, Optional, AsyncIterator
+
+import aiohttp
+from nonebot import logger
+from pixivpy_async import AppPixivAPI
+from pixivpy_async.error import TokenError
+
+from nonebot_plugin_pixivbot.config import Config
+from nonebot_plugin_pixivbot.global_context import context
+from nonebot_plugin_pixivbot.utils.rate_limiter import AdaptiveRateLimiter
+
+_conf = context.require(Config)
+
+
+class PixivAccount:
+    """
+    一个Pixiv账号，拥有独立的AppPixivAPI、token刷新循环与限流状态
+    """
+
+    def __init__(self, index: int, refresh_token: str, session: aiohttp.ClientSession):
+        self.index = index
+        self.refresh_token = refresh_token
+        self.user_id = 0
+        self.ready = False  # 是否已成功刷新过access token
+        self._ready_event = Event()
+
+        self.papi = AppPixivAPI(client=session)
+        self.papi.set_additional_headers({'Accept-Language': 'zh-CN'})
+        self.rate_limiter = AdaptiveRateLimiter(initial_rate=_conf.pixiv_rate_limit_initial_rate,
+                                                min_rate=_conf.pixiv_rate_limit_min_rate,
+                                                max_rate=_conf.pixiv_rate_limit_max_rate,
+                                                capacity=_conf.pixiv_simultaneous_query,
+                                                max_concurrency=_conf.pixiv_simultaneous_query,
+                                                aging=_conf.pixiv_background_priority_aging)
+
+        self._refresh_daemon: Optional[Task] = None
+
+    def __repr__(self):
+        return f"account#{self.index}({self.user_id})"
+
+    @property
+    def load(self) -> float:
+        """
+        负载：排队与进行中的请求数按当前速率折算成的等待时间
+        """
+        metrics = self.rate_limiter.metrics
+        return (metrics.queue_depth + metrics.in_flight + 1) / metrics.rate
+
+    async def _refresh(self):
+        # Latest app version can be found using GET /old/application-info/android
+        USER_AGENT = "PixivAndroidApp/5.0.234 (Android 11; Pixel 5)"
+        # REDIRECT_URI = "https://app-api.pixiv.net/web/v1/users/auth/pixiv/callback"
+        # LOGIN_URL = "https://app-api.pixiv.net/web/v1/login"
+        AUTH_TOKEN_URL = "https://oauth.secure.pixiv.net/auth/token"
+        CLIENT_ID = "MOBrBDS8blbauoSck0ZfDbtuzpyT"
+        CLIENT_SECRET = "lsACyCD94FhDUtGTXi3QzcFE2uU1hqtDaKeqrdwj"
+
+        data = {
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+            "grant_type": "refresh_token",
+            "include_policy": "true",
+            "refresh_token": self.refresh_token,
+        }
+        result = await self.papi.requests_(method="POST", url=AUTH_TOKEN_URL, data=data,
+                                           headers={"User-Agent": USER_AGENT},
+                                           auth=False)
+        if result.has_error:
+            raise TokenError(None, result)
+        else:
+            self.papi.set_auth(result.access_token, result.refresh_token)
+            self.user_id = result["user"]["id"]
+            self.ready = True
+            self._ready_event.set()
+
+            logger.success(
+                f"[{self}] refresh access token successfully. new token expires in {result.expires_in} seconds.")
+            logger.debug(f"[{self}] access_token: {result.access_token}")
+            logger.debug(f"[{self}] refresh_token: {result.refresh_token}")
+
+            # maybe the refresh token will be changed (even thought i haven't seen it yet)
+            if result.refresh_token != self.refresh_token:
+                self.refresh_token = result.refresh_token
+                logger.warning(
+                    f"[{self}] refresh token has been changed: {result.refresh_token}")
+
+            return result
+
+    async def _refresh_daemon_worker(self):
+        while True:
+            try:
+                result = await self._refresh()
+                await sleep(result.expires_in * 0.8)
+            except CancelledError as e:
+                raise e
+            except (ConnectionError, aiohttp.ServerConnectionError, asyncio.TimeoutError):
+                logger.warning(f"[{self}] failed to refresh access token, will retry after 60s.")
+                await sleep(60)
+            except Exception as e:
+                logger.opt(exception=e).error(f"[{self}] failed to refresh access token, will retry after 60s.")
+                await sleep(60)
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待首次成功刷新access token（启动时的登录）
+
+        :param timeout: 最长等待时间（单位：秒），为None时一直等待
+        :return: 是否已就绪
+        """
+        if not self.ready:
+            try:
+                await wait_for(self._ready_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"[{self}] not ready after waiting {timeout}s")
+        return self.ready
+
+    def start(self):
+        self._refresh_daemon = create_task(self._refresh_daemon_worker())
+
+    def stop(self):
+        if self._refresh_daemon is not None:
+            self._refresh_daemon.cancel()
+
+
+class PixivAccountPool:
+    """
+    多个Pixiv账号组成的池。第一个账号（pixiv_refresh_token）为主账号，
+    与账号相关的查询（如user_bookmarks(0)、推荐）固定由主账号发出，其余公开查询分配给负载最低的账号
+    """
+
+    def __init__(self, refresh_tokens: List[str], session: aiohttp.ClientSession):
+        self.accounts = [PixivAccount(i, token, session) for i, token in enumerate(refresh_tokens)]
+
+    @property
+    def primary(self) -> PixivAccount:
+        return self.accounts[0]
+
+    async def owner_of(self, user_id: int) -> Optional[PixivAccount]:
+        """
+        账号的user_id在登录后才知道，因此先等待各账号登录（最多pixiv_query_timeout秒，
+        仍未登录的账号视为不在池中）
+
+        :return: user_id对应的池中账号，不在池中时返回None
+        """
+        await gather(*[x.wait_ready(_conf.pixiv_query_timeout) for x in self.accounts])
+        for account in self.accounts:
+            if account.ready and account.user_id == user_id:
+                return account
+        return None
+
+    def least_loaded(self) -> PixivAccount:
+        # 尚未刷新到access token的账号无法查询，除非所有账号都未就绪
+        candidates = [x for x in self.accounts if x.ready] or self.accounts
+        return min(candidates, key=lambda x: x.load)
+
+    @asynccontextmanager
+    async def query(self, account: Optional[PixivAccount] = None) -> AsyncIterator[PixivAccount]:
+        """
+        获得账号的配额后执行，超时仍未获得则抛出RateLimitError
+
+        :param account: 指定的账号，为None时选择负载最低的账号
+        """
+        if account is None:
+            account = self.least_loaded()
+
+        async with account.rate_limiter.limit(timeout=_conf.pixiv_rate_limit_wait_timeout):
+            yield account
+
+    def start(self):
+        for account in self.accounts:
+            account.start()
+
+    def stop(self):
+        for account in self.accounts:
+            account.stop()
+
+
+__all__ = ("PixivAccount", "PixivAccountPool")
@@ -1,7 +1,8 @@
-from typing import Union, AsyncGenerator, Protocol
+from typing import Union, AsyncGenerator, Protocol, Sequence
 
 from nonebot_plugin_pixivbot.enums import RankingMode
 from nonebot_plugin_pixivbot.model import Illust, User
+from .enums import ImageVariant
 from .lazy_illust import LazyIllust
 from .models import PixivRepoMetadata
 
@@ -10,6 +11,9 @@ class PixivRepo(Protocol):
     def illust_detail(self, illust_id: int) -> AsyncGenerator[Union[Illust, PixivRepoMetadata], None]:
         ...
 
+    def illust_details(self, illust_ids: Sequence[int]) -> AsyncGenerator[Illust, None]:
+        ...
+
     def user_detail(self, user_id: int) -> AsyncGenerator[Union[User, PixivRepoMetadata], None]:
         ...
 
@@ -31,11 +35,12 @@ class PixivRepo(Protocol):
     def related_illusts(self, illust_id: int) -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
         ...
 
-    def illust_ranking(self, mode: Union[str, RankingMode]) \
+    def illust_ranking(self, mode: Union[str, RankingMode], date: str) \
             -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
         ...
 
-    def image(self, illust: Illust, page: int = 0) -> AsyncGenerator[Union[bytes, PixivRepoMetadata], None]:
+    def image(self, illust: Illust, page: int = 0, variant: ImageVariant = ImageVariant.large) \
+            -> AsyncGenerator[Union[bytes, PixivRepoMetadata], None]:
         ...
 
 
@@ -1,16 +1,117 @@
 import asyncio
 import functools
 import multiprocessing
+from concurrent.futures.process import ProcessPoolExecutor
 from concurrent.futures.thread import ThreadPoolExecutor
 from io import BytesIO
+from multiprocessing.shared_memory import SharedMemory
+from typing import AsyncIterable, List, Optional, Union
 
 from PIL import Image, ImageFile
+from nonebot import logger
 
 from nonebot_plugin_pixivbot.config import Config
 from nonebot_plugin_pixivbot.global_context import context
+from nonebot_plugin_pixivbot.utils.lifecycler import on_shutdown
+from .enums import ImageVariant
 
 conf = context.require(Config)
 
+# 流式解码时每攒够这么多字节才喂给解码器一次，避免每个chunk都切换一次线程
+_FEED_SIZE = 1024 * 1024
+
+
+def _encode(img: Image.Image, max_size: int, quantity: float) -> bytes:
+    w, h = img.size
+    if w > max_size or h > max_size:
+        ratio = min(max_size / w,
+                    max_size / h)
+        img = img.resize(
+            (int(ratio * w), int(ratio * h)), Image.LANCZOS)
+    # 不需要缩放时直接编码原图，不再copy一份
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    with BytesIO() as bio:
+        img.save(bio, format="JPEG", optimize=True,
+                 quantity=quantity)
+        return bio.getvalue()
+
+
+def _compress(content: bytes, max_size: int, quantity: float) -> bytes:
+    p = ImageFile.Parser()
+    p.feed(content)
+    img = p.close()
+    return _encode(img, max_size, quantity)
+
+
+def _compress_shared(name: str, size: int, max_size: int, quantity: float) -> bytes:
+    # 在子进程中执行：原图经共享内存传入，不经过pickle
+    shm = SharedMemory(name=name)
+    try:
+        content = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+    return _compress(content, max_size, quantity)
+
+
+class ThreadCompressorBackend:
+    def __init__(self, workers: int):
+        self.executor = ThreadPoolExecutor(workers, "compressor")
+
+    async def compress(self, content: bytes, max_size: int, quantity: float) -> bytes:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, _compress, content, max_size, quantity)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class ProcessCompressorBackend:
+    def __init__(self, workers: int):
+        # 子进程需要直接继承已导入的插件模块，因此只支持fork
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"))
+
+    @staticmethod
+    def is_supported() -> bool:
+        return "fork" in multiprocessing.get_all_start_methods()
+
+    async def _compress_shared(self, shm: SharedMemory, size: int, max_size: int, quantity: float) -> bytes:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, _compress_shared, shm.name, size, max_size, quantity)
+
+    async def compress(self, content: bytes, max_size: int, quantity: float) -> bytes:
+        shm = SharedMemory(create=True, size=max(len(content), 1))
+        try:
+            shm.buf[:len(content)] = content
+            return await self._compress_shared(shm, len(content), max_size, quantity)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    async def compress_stream(self, chunks: AsyncIterable[bytes], size: int,
+                              max_size: int, quantity: float) -> bytes:
+        """
+        把数据块直接写入共享内存，不在本进程中拼接完整的原图
+        :param chunks: 原图数据块
+        :param size: 原图大小（Content-Length）
+        """
+        shm = SharedMemory(create=True, size=max(size, 1))
+        try:
+            offset = 0
+            async for chunk in chunks:
+                if offset + len(chunk) > size:
+                    raise ValueError("content is longer than the given size")
+                shm.buf[offset:offset + len(chunk)] = chunk
+                offset += len(chunk)
+            return await self._compress_shared(shm, offset, max_size, quantity)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
 
 @context.register_singleton()
 class Compressor:
@@ -18,38 +119,98 @@ class Compressor:
     def __init__(self) -> None:
         self.enabled = conf.pixiv_compression_enabled
         self.max_size = conf.pixiv_compression_max_size
+        self.thumbnail_max_size = conf.pixiv_thumbnail_max_size
         self.quantity = conf.pixiv_compression_quantity
+        self.process_threshold = conf.pixiv_compression_process_threshold
+
+        # 缩略图不受pixiv_compression_enabled影响，因此线程池总是需要的
+        cpu_count = multiprocessing.cpu_count()
+        self._thread_backend = ThreadCompressorBackend(cpu_count)
+        # logger.info(f"A ThreadPool with {cpu_count} worker(s) was created for compression")
 
-        if self.enabled:
-            cpu_count = multiprocessing.cpu_count()
-            self._executor = ThreadPoolExecutor(cpu_count, "compressor")
-            # logger.info(f"A ThreadPool with {cpu_count} worker(s) was created for compression")
-
-    async def compress(self, content: bytes) -> bytes:
-        if self.enabled:
-            loop = asyncio.get_running_loop()
-            task = loop.run_in_executor(
-                self._executor, functools.partial(self._compress, content))
-            return await task
+        self._process_backend: Optional[ProcessCompressorBackend] = None
+        if self.enabled and conf.pixiv_compression_backend == "process":
+            if ProcessCompressorBackend.is_supported():
+                self._process_backend = ProcessCompressorBackend(cpu_count)
+            else:
+                logger.warning("[compressor] process backend requires fork start method, "
+                               "fallback to thread backend")
+
+        on_shutdown()(self.shutdown)
+
+    def _max_size_of(self, variant: ImageVariant) -> Optional[int]:
+        # 返回None表示该变体即原图，无需编码
+        if variant == ImageVariant.large and self.enabled:
+            return self.max_size
+        elif variant == ImageVariant.thumbnail:
+            return self.thumbnail_max_size
         else:
+            return None
+
+    def variant_key(self, variant: ImageVariant) -> str:
+        """
+        变体在下载缓存中的键。键中包含编码参数，修改压缩配置后不会命中旧的缓存
+        """
+        max_size = self._max_size_of(variant)
+        if max_size is None:
+            return "original"
+        return f"{max_size}_{self.quantity}"
+
+    def _select_backend(self, size: Optional[int]) \
+            -> Union[ThreadCompressorBackend, ProcessCompressorBackend]:
+        # 小图在线程池中处理（省去进程间传输的开销），大图交给进程池
+        if self._process_backend is not None and size is not None and size >= self.process_threshold:
+            return self._process_backend
+        return self._thread_backend
+
+    async def compress(self, content: bytes, variant: ImageVariant = ImageVariant.large) -> bytes:
+        max_size = self._max_size_of(variant)
+        if max_size is None:
             return content
 
-    def _compress(self, content: bytes) -> bytes:
-        p = ImageFile.Parser()
-        p.feed(content)
-        img = p.close()
-
-        w, h = img.size
-        if w > self.max_size or h > self.max_size:
-            ratio = min(self.max_size / w,
-                        self.max_size / h)
-            img_cp = img.resize(
-                (int(ratio * w), int(ratio * h)), Image.ANTIALIAS)
-        else:
-            img_cp = img.copy()
-        img_cp = img_cp.convert("RGB")
+        backend = self._select_backend(len(content))
+        return await backend.compress(content, max_size, self.quantity)
+
+    async def compress_stream(self, chunks: AsyncIterable[bytes], size_hint: Optional[int] = None,
+                              variant: ImageVariant = ImageVariant.large) -> bytes:
+        """
+        边下载边解码，不在内存中保留完整的原图
+        :param chunks: 原图数据块
+        :param size_hint: 原图大小（Content-Length），用于选择线程池或进程池
+        :param variant: 要生成的变体
+        :return: 编码结果（变体为原图时即原图）
+        """
+        max_size = self._max_size_of(variant)
+        if max_size is None:
+            return b"".join([x async for x in chunks])
+
+        backend = self._select_backend(size_hint)
+        if backend is self._process_backend:
+            return await backend.compress_stream(chunks, size_hint, max_size, self.quantity)
+
+        loop = asyncio.get_running_loop()
+        executor = self._thread_backend.executor
+        parser = ImageFile.Parser()
+
+        buffer: List[bytes] = []
+        buffered = 0
+        async for chunk in chunks:
+            buffer.append(chunk)
+            buffered += len(chunk)
+            if buffered >= _FEED_SIZE:
+                await loop.run_in_executor(executor, parser.feed, b"".join(buffer))
+                buffer.clear()
+                buffered = 0
+
+        if buffered > 0:
+            await loop.run_in_executor(executor, parser.feed, b"".join(buffer))
+            buffer.clear()
+
+        img = await loop.run_in_executor(executor, parser.close)
+        return await loop.run_in_executor(executor,
+                                          functools.partial(_encode, img, max_size, self.quantity))
 
-        with BytesIO() as bio:
-            img_cp.save(bio, format="JPEG", optimize=True,
-                        quantity=self.quantity)
-            return bio.getvalue()
+    def shutdown(self):
+        self._thread_backend.shutdown()
+        if self._process_backend is not None:
+            self._process_backend.shutdown()
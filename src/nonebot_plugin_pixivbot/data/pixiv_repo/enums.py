@@ -17,3 +17,9 @@ class PixivResType(Enum):
 class CacheStrategy(Enum):
     NORMAL = 0
     FORCE_EXPIRATION = 1
+
+
+class ImageVariant(Enum):
+    original = 0  # 原图
+    large = 1  # 按pixiv_compression_max_size压缩（未启用压缩时等同于原图）
+    thumbnail = 2  # 按pixiv_thumbnail_max_size压缩，用于合并转发消息等预览场景
@@ -1,9 +1,11 @@
 from __future__ import annotations
 
-from typing import Optional
+from asyncio import Future, Task, CancelledError, create_task, get_running_loop, shield, sleep
+from typing import Optional, Dict, Set, Tuple, Union
 
-from nonebot_plugin_pixivbot.model import Illust
+from nonebot_plugin_pixivbot.model import Illust, IllustSummary
 from nonebot_plugin_pixivbot.utils.lazy_delegation import LazyDelegation
+from nonebot_plugin_pixivbot.utils.request_priority import RequestPriority, current_priority, request_priority
 
 __all__ = ("LazyIllust",)
 
@@ -14,26 +16,161 @@ def _get_src():
     return context.require(PixivRepo)
 
 
+def _get_batch_window() -> float:
+    from nonebot_plugin_pixivbot.config import Config
+    from nonebot_plugin_pixivbot.global_context import context
+    return context.require(Config).pixiv_illust_detail_batch_window
+
+
+class _IllustDetailBatcher:
+    """
+    将一个时间窗口内并发的LazyIllust.get()合并为一次PixivRepo.illust_details()调用，
+    以窗口内各调用方中最高的优先级发出
+    """
+
+    def __init__(self):
+        self._pending: Dict[int, Future] = {}
+        self._priority: Optional[RequestPriority] = None
+        self._flushing: Set[Task] = set()  # 持有task的强引用，避免被GC
+        self._scheduled: Optional[Task] = None  # 当前批次的flush
+
+    async def get(self, illust_id: int) -> Optional[Illust]:
+        priority = current_priority()
+        if self._priority is None or priority < self._priority:
+            self._priority = priority
+
+        fut = self._pending.get(illust_id, None)
+        if fut is None:
+            fut = get_running_loop().create_future()
+            self._pending[illust_id] = fut
+
+            if self._scheduled is None:
+                task = create_task(self._flush())
+                self._scheduled = task
+                self._flushing.add(task)
+                task.add_done_callback(self._on_flush_done)
+
+        # 某个调用者被取消（例如超时）时，不影响同一批次的其他调用者
+        return await shield(fut)
+
+    async def _flush(self):
+        pending: Optional[Dict[int, Future]] = None
+        try:
+            await sleep(_get_batch_window())
+
+            pending, priority = self._take_batch()
+            # 单个插画获取失败时只影响该插画的调用者
+            errors: Dict[int, Exception] = {}
+            # flush所在的Task继承的是第一个调用方的优先级
+            with request_priority(priority):
+                async for x in LazyIllust.src.illust_details(list(pending.keys()), errors=errors):
+                    fut = pending.get(x.id, None)
+                    if fut is not None and not fut.done():
+                        fut.set_result(x)
+
+            for illust_id, err in errors.items():
+                fut = pending.get(illust_id, None)
+                if fut is not None and not fut.done():
+                    fut.set_exception(err)
+        except CancelledError as e:
+            # 在等待窗口时被取消（或取得窗口时出错），批次还未取出
+            if pending is None:
+                pending, _ = self._take_batch()
+            for fut in pending.values():
+                fut.cancel()
+            raise e
+        except Exception as e:
+            if pending is None:
+                pending, _ = self._take_batch()
+            for fut in pending.values():
+                if not fut.done():
+                    fut.set_exception(e)
+        finally:
+            # 远端也查不到的插画，与此前逐个获取时一样返回None
+            if pending is None:
+                pending, _ = self._take_batch()
+            for fut in pending.values():
+                if not fut.done():
+                    fut.set_result(None)
+
+    def _on_flush_done(self, task: Task):
+        self._flushing.discard(task)
+        # flush在开始运行前就被取消时不会执行其中的清理，在这里取消该批次
+        if self._scheduled is task:
+            pending, _ = self._take_batch()
+            for fut in pending.values():
+                fut.cancel()
+
+    def _take_batch(self) -> Tuple[Dict[int, Future], Optional[RequestPriority]]:
+        # 取出当前批次并重置状态，之后的get()开启新的批次
+        pending, priority = self._pending, self._priority
+        self._pending = {}
+        self._priority = None
+        self._scheduled = None
+        return pending, priority
+
+
 class LazyIllust:
+    __slots__ = ("id", "content", "_summary")
+
     src = LazyDelegation(_get_src)
+    _batcher = _IllustDetailBatcher()
 
-    def __init__(self, id: int, content: Optional[Illust] = None) -> None:
+    def __init__(self, id: int, content: Optional[Illust] = None,
+                 summary: Optional[IllustSummary] = None) -> None:
         self.id = id
         self.content = content
+        self._summary = summary
+
+    @classmethod
+    def from_summary(cls, summary: IllustSummary) -> "LazyIllust":
+        return cls(summary.id, summary=summary)
+
+    def compact(self) -> "LazyIllust":
+        """
+        丢弃完整的Illust，只保留IllustSummary
+        """
+        if self.content is not None:
+            self._summary = IllustSummary.from_illust(self.content)
+            self.content = None
+        return self
+
+    def compacted(self) -> "LazyIllust":
+        """
+        返回只保留IllustSummary的副本，不修改自身
+        """
+        if self.content is not None:
+            return LazyIllust(self.id, summary=IllustSummary.from_illust(self.content))
+        return self
 
     async def get(self) -> Illust:
-        if self.content is None:
-            async for x in self.src.illust_detail(self.id):
-                self.content = x
-                break
-        return self.content
+        if self.content is not None:
+            return self.content
+
+        content = await self._batcher.get(self.id)
+        # 紧凑表示的LazyIllust不保留完整的Illust，需要时再从缓存中取
+        if self._summary is None:
+            self.content = content
+        return content
 
     @property
     def loaded(self):
         return self.content is not None
 
+    @property
+    def summary(self) -> Union[Illust, IllustSummary, None]:
+        """
+        随机抽取所需的字段（total_bookmarks, total_view, create_date, has_tag等），
+        未加载完整的Illust时由IllustSummary提供
+        """
+        if self.content is not None:
+            return self.content
+        return self._summary
+
     def __getattr__(self, attr):
-        if self.content is None:
-            return None
-        else:
+        if self.content is not None:
             return self.content.__getattribute__(attr)
+        elif self._summary is not None:
+            return getattr(self._summary, attr, None)
+        else:
+            return None
@@ -23,4 +23,11 @@ elif conf.pixiv_local_cache_type == "file":
 else:
     raise RuntimeError(f"invalid pixiv_local_cache_type: {conf.pixiv_local_cache_type}")
 
+if conf.pixiv_use_local_cache and conf.pixiv_hot_cache_size > 0:
+    from .hot_cache import HotCacheLocalPixivRepo
+
+    impl = SqlPixivRepo if conf.pixiv_local_cache_type == "sql" else FilePixivRepo
+    context.bind_singleton_to(LocalPixivRepo, impl)(HotCacheLocalPixivRepo)
+    logger.info(f"local hot cache: enabled (size: {conf.pixiv_hot_cache_size})")
+
 __all__ = ("LocalPixivRepo",)
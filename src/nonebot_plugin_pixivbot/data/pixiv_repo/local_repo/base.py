@@ -1,4 +1,4 @@
-from typing import List, Union
+from typing import List, Union, Sequence, AsyncGenerator
 
 from nonebot_plugin_pixivbot.enums import RankingMode
 from nonebot_plugin_pixivbot.model import Illust, User
@@ -8,6 +8,11 @@ from ..models import PixivRepoMetadata
 
 
 class LocalPixivRepo(PixivRepo):
+    def illust_details(self, illust_ids: Sequence[int]) \
+            -> AsyncGenerator[Union[Illust, PixivRepoMetadata], None]:
+        # 仅返回命中且未过期的缓存（顺序不定），每个Illust之前先返回其PixivRepoMetadata
+        ...
+
     async def update_illust_detail(self, illust: Illust, metadata: PixivRepoMetadata):
         ...
 
@@ -54,6 +59,10 @@ class LocalPixivRepo(PixivRepo):
                                          metadata: PixivRepoMetadata) -> bool:
         ...
 
+    async def replace_recommended_illusts(self, content: List[Union[Illust, LazyIllust]],
+                                          metadata: PixivRepoMetadata):
+        ...
+
     async def invalidate_related_illusts(self, illust_id: int):
         ...
 
@@ -62,16 +71,26 @@ class LocalPixivRepo(PixivRepo):
                                      metadata: PixivRepoMetadata) -> bool:
         ...
 
-    async def invalidate_illust_ranking(self, mode: RankingMode):
+    async def replace_related_illusts(self, illust_id: int,
+                                      content: List[Union[Illust, LazyIllust]],
+                                      metadata: PixivRepoMetadata):
         ...
 
-    async def append_illust_ranking(self, mode: RankingMode,
+    async def invalidate_illust_ranking(self, mode: RankingMode, date: str):
+        ...
+
+    async def append_illust_ranking(self, mode: RankingMode, date: str,
                                     content: List[Union[Illust, LazyIllust]],
                                     metadata: PixivRepoMetadata) -> bool:
         ...
 
+    def image(self, illust: Illust, page: int = 0, variant: str = "original") \
+            -> AsyncGenerator[Union[bytes, PixivRepoMetadata], None]:
+        # variant为Compressor.variant_key()的返回值，编码参数不同的变体分开缓存
+        ...
+
     async def update_image(self, illust_id: int, page: int, content: bytes,
-                           metadata: PixivRepoMetadata):
+                           metadata: PixivRepoMetadata, variant: str = "original"):
         ...
 
     async def invalidate_all(self):
@@ -11,6 +11,10 @@ class DummyPixivRepo(LocalPixivRepo):
         raise NoSuchItemError()
         yield None
 
+    async def illust_details(self, *args, **kwargs):
+        return
+        yield None
+
     async def update_illust_detail(self, *args, **kwargs):
         pass
 
@@ -77,6 +81,9 @@ class DummyPixivRepo(LocalPixivRepo):
     async def append_recommended_illusts(self, *args, **kwargs) -> bool:
         return False
 
+    async def replace_recommended_illusts(self, *args, **kwargs):
+        pass
+
     # ================ related_illusts ================
     async def related_illusts(self, *args, **kwargs):
         raise NoSuchItemError()
@@ -88,6 +95,9 @@ class DummyPixivRepo(LocalPixivRepo):
     async def append_related_illusts(self, *args, **kwargs) -> bool:
         return False
 
+    async def replace_related_illusts(self, *args, **kwargs):
+        pass
+
     # ================ illust_ranking ================
     async def illust_ranking(self, *args, **kwargs):
         raise NoSuchItemError()
@@ -1,16 +1,22 @@
 import json
 import os
+import shutil
+from datetime import timedelta
+from functools import partial
 from pathlib import Path
-from typing import AsyncGenerator, Union, Generic, TypeVar, Type, List, Callable, Any
+from typing import AsyncGenerator, Union, Generic, TypeVar, Type, List, Callable, Any, Sequence, Optional
 
 import aiofiles
+from apscheduler.triggers.interval import IntervalTrigger
 from nonebot import logger
+from nonebot_plugin_apscheduler import scheduler as apscheduler
 from nonebot_plugin_localstore import get_cache_dir
 from pydantic import ValidationError, BaseModel
 from pydantic.generics import GenericModel
 
 from .base import LocalPixivRepo
-from ..errors import NoSuchItemError
+from .segmented_list import SegmentedListFile
+from ..errors import NoSuchItemError, CacheExpiredError
 from ..lazy_illust import LazyIllust
 from ..models import PixivRepoMetadata
 from ...local_tag import LocalTagRepo
@@ -18,6 +24,8 @@ from ....config import Config
 from ....enums import RankingMode
 from ....global_context import context
 from ....model import Illust, User
+from ....utils.lifecycler import on_startup
+from ....utils.ranking_date import latest_ranking_date, parse_ranking_date
 
 T = TypeVar("T")
 
@@ -39,6 +47,15 @@ def mkdirs_for_parent(path: Path):
 class FilePixivRepo(LocalPixivRepo):
     def __init__(self):
         self.root = get_cache_dir("nonebot_plugin_pixivbot")
+        on_startup(replay=True)(
+            partial(
+                apscheduler.add_job,
+                self.clean_expired,
+                id='pixivbot_file_pixiv_repo_clean_expired',
+                trigger=IntervalTrigger(hours=2),
+                max_instances=1
+            )
+        )
 
     T_Content = TypeVar("T_Content", bound=BaseModel)
 
@@ -66,27 +83,24 @@ class FilePixivRepo(LocalPixivRepo):
         async with aiofiles.open(file, 'w+', encoding="utf-8") as f:
             await f.write(s)
 
-    async def _read_list(self, file: Path, t_content: Type[T_Content], expires_in: int, offset: int = 0) \
+    async def _read_list(self, file: Path, t_content: Type[T_Content], expires_in: Optional[int],
+                         offset: int = 0, limit: Optional[int] = None) \
             -> AsyncGenerator[Union[T_Content, PixivRepoMetadata], None]:
-        if not file.exists():
+        lst = SegmentedListFile(file)
+        if not lst.exists():
             raise NoSuchItemError()
 
         try:
-            async with aiofiles.open(file, 'r', encoding="utf-8") as f:
-                obj = json.loads(await f.read())
-                model = FileModel[List[t_content]].parse_obj(obj)
-                model.metadata.check_is_expired(expires_in)
-                yield model.metadata.copy(update={"pages": 0})
-                for x in model.content:
-                    if offset == 0:
-                        yield x
-                    else:
-                        offset -= 1
-                yield model.metadata
-        except (KeyError, ValueError, ValidationError) as e:
+            header = await lst.read_header()
+            header.metadata.check_is_expired(expires_in)
+            yield header.metadata.copy(update={"pages": 0})
+            async for x in lst.read(header, t_content, offset, limit):
+                yield x
+            yield header.metadata
+        except (KeyError, ValueError, ValidationError, FileNotFoundError) as e:
             logger.opt(exception=e).warning(
                 f"[local] deleting invalid file {file}")
-            os.remove(file)
+            lst.remove()
             raise NoSuchItemError()
 
     async def _append_list(self, file: Path, t_content: Type[T_Content],
@@ -94,35 +108,43 @@ class FilePixivRepo(LocalPixivRepo):
                            content_key: Callable[[T_Content], Any],
                            append_at_begin: bool = False) -> bool:
         # 返回值表示content中是否有已经存在于集合的文档
-        if not file.exists():
-            current_content = []
-        else:
-            async with aiofiles.open(file, 'r', encoding="utf-8") as f:
-                obj = json.loads(await f.read())
-                model = FileModel[List[t_content]].parse_obj(obj)
-                current_content = model.content
-
-        keys = set(map(content_key, current_content))
-        has_duplicated = False
-
-        for c in content:
-            c_key = content_key(c)
-            if c_key not in keys:
-                keys.add(c_key)
-                if append_at_begin:
-                    current_content.insert(0, c)
-                else:
-                    current_content.append(c)
-            else:
-                has_duplicated = True
-
-        s = FileModel[List[t_content]](
-            content=current_content, metadata=metadata).json()
-        mkdirs_for_parent(file)
-        async with aiofiles.open(file, 'w+', encoding="utf-8") as f:
-            await f.write(s)
+        lst = SegmentedListFile(file)
+        if not lst.exists():
+            # 旧版本的缓存是单个json文件
+            legacy_file = file.parent / f"{file.name}.json"
+            if legacy_file.exists():
+                os.remove(legacy_file)
+
+        return await lst.append(content, [content_key(c) for c in content], metadata, append_at_begin)
+
+    async def _replace_list(self, file: Path, t_content: Type[T_Content],
+                            content: List[T_Content], metadata: PixivRepoMetadata,
+                            content_key: Callable[[T_Content], Any]):
+        await SegmentedListFile(file).replace(content, [content_key(c) for c in content], metadata)
+
+    def _remove_list(self, file: Path):
+        SegmentedListFile(file).remove()
+
+    @staticmethod
+    def _lazy_illust(illust: Illust) -> LazyIllust:
+        if conf.pixiv_compact_illust_list:
+            return LazyIllust(illust.id, illust).compact()
+        return LazyIllust(illust.id, illust)
+
+    async def _write_illust_details(self, content: List[Illust], metadata: PixivRepoMetadata):
+        if conf.pixiv_compact_illust_list:
+            # 紧凑表示的列表抽中后通过illust_detail取出完整的Illust
+            for x in content:
+                await self._write_single(self.root / "illust_detail" / f"{x.id}.json", x, metadata)
+
+    async def _append_illust_list(self, file: Path, content: List[Illust], metadata: PixivRepoMetadata,
+                                  append_at_begin: bool = False) -> bool:
+        await self._write_illust_details(content, metadata)
+        return await self._append_list(file, Illust, content, metadata, lambda x: x.id, append_at_begin)
 
-        return has_duplicated
+    async def _replace_illust_list(self, file: Path, content: List[Illust], metadata: PixivRepoMetadata):
+        await self._write_illust_details(content, metadata)
+        await self._replace_list(file, Illust, content, metadata, lambda x: x.id)
 
     # ================ illust_detail ================
     async def illust_detail(self, illust_id: int) \
@@ -130,9 +152,22 @@ class FilePixivRepo(LocalPixivRepo):
         logger.debug(f"[local] illust_detail {illust_id}")
 
         file = self.root / "illust_detail" / f"{illust_id}.json"
-        async for x in self._read_single(file, Illust, conf.pixiv_illust_detail_cache_expires_in):
+        expires_in = conf.pixiv_illust_detail_cache_expires_in + conf.pixiv_illust_detail_cache_stale_in
+        async for x in self._read_single(file, Illust, expires_in):
             yield x
 
+    async def illust_details(self, illust_ids: Sequence[int]) \
+            -> AsyncGenerator[Union[Illust, PixivRepoMetadata], None]:
+        logger.debug(f"[local] illust_details ({len(illust_ids)} items)")
+
+        for illust_id in illust_ids:
+            file = self.root / "illust_detail" / f"{illust_id}.json"
+            try:
+                async for x in self._read_single(file, Illust, conf.pixiv_illust_detail_cache_expires_in):
+                    yield x
+            except (NoSuchItemError, CacheExpiredError):
+                continue
+
     async def update_illust_detail(self, illust: Illust, metadata: PixivRepoMetadata):
         logger.debug(f"[local] update illust_detail {illust.id} {metadata}")
 
@@ -149,7 +184,8 @@ class FilePixivRepo(LocalPixivRepo):
         logger.debug(f"[local] user_detail {user_id}")
 
         file = self.root / "user_detail" / f"{user_id}.json"
-        async for x in self._read_single(file, User, conf.pixiv_user_detail_cache_expires_in):
+        expires_in = conf.pixiv_user_detail_cache_expires_in + conf.pixiv_user_detail_cache_stale_in
+        async for x in self._read_single(file, User, expires_in):
             yield x
 
     async def update_user_detail(self, user: User, metadata: PixivRepoMetadata):
@@ -163,36 +199,36 @@ class FilePixivRepo(LocalPixivRepo):
             -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
         logger.debug(f"[local] search_illust {word}")
 
-        file = self.root / "search_illust" / f"{word}.json"
+        file = self.root / "search_illust" / f"{word}"
         async for x in self._read_list(file, Illust, conf.pixiv_search_illust_cache_expires_in, offset):
             if isinstance(x, PixivRepoMetadata):
                 yield x
             elif isinstance(x, Illust):
-                yield LazyIllust(x.id, x)
+                yield self._lazy_illust(x)
 
     async def invalidate_search_illust(self, word: str):
         logger.debug(f"[local] invalidate search_illust {word}")
-        file = self.root / "search_illust" / f"{word}.json"
-        os.remove(file)
+        file = self.root / "search_illust" / f"{word}"
+        self._remove_list(file)
 
     async def append_search_illust(self, word: str, content: List[Union[Illust, LazyIllust]],
                                    metadata: PixivRepoMetadata) -> bool:
         logger.debug(f"[local] append search_illust {word} "
                      f"({len(content)} items) "
                      f"{metadata}")
-        file = self.root / "search_illust" / f"{word}.json"
+        file = self.root / "search_illust" / f"{word}"
         content: List[Illust] = [
             await x.get() if isinstance(x, LazyIllust) else x
             for x in content
         ]
-        return await self._append_list(file, Illust, content, metadata, lambda x: x.id)
+        return await self._append_illust_list(file, content, metadata)
 
     # ================ search_user ================
     async def search_user(self, word: str, *, offset: int = 0) \
             -> AsyncGenerator[Union[User, PixivRepoMetadata], None]:
         logger.debug(f"[local] search_user {word}")
 
-        file = self.root / "search_user" / f"{word}.json"
+        file = self.root / "search_user" / f"{word}"
         async for x in self._read_list(file, User, conf.pixiv_search_user_cache_expires_in, offset):
             if isinstance(x, PixivRepoMetadata):
                 yield x
@@ -201,8 +237,8 @@ class FilePixivRepo(LocalPixivRepo):
 
     async def invalidate_search_user(self, word: str):
         logger.debug(f"[local] invalidate search_user {word}")
-        file = self.root / "search_user" / f"{word}.json"
-        os.remove(file)
+        file = self.root / "search_user" / f"{word}"
+        self._remove_list(file)
 
     async def append_search_user(self, word: str, content: List[User],
                                  metadata: PixivRepoMetadata) -> bool:
@@ -210,7 +246,7 @@ class FilePixivRepo(LocalPixivRepo):
                      f"({len(content)} items) "
                      f"{metadata}")
 
-        file = self.root / "search_user" / f"{word}.json"
+        file = self.root / "search_user" / f"{word}"
         return await self._append_list(file, User, content, metadata, lambda x: x.id)
 
     # ================ user_illusts ================
@@ -218,17 +254,17 @@ class FilePixivRepo(LocalPixivRepo):
             -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
         logger.debug(f"[local] user_illusts {user_id}")
 
-        file = self.root / "user_illusts" / f"{user_id}.json"
+        file = self.root / "user_illusts" / f"{user_id}"
         async for x in self._read_list(file, Illust, conf.pixiv_user_illusts_cache_expires_in, offset):
             if isinstance(x, PixivRepoMetadata):
                 yield x
             elif isinstance(x, Illust):
-                yield LazyIllust(x.id, x)
+                yield self._lazy_illust(x)
 
     async def invalidate_user_illusts(self, user_id: int):
         logger.debug(f"[local] invalidate user_illusts {user_id}")
-        file = self.root / "user_illusts" / f"{user_id}.json"
-        os.remove(file)
+        file = self.root / "user_illusts" / f"{user_id}"
+        self._remove_list(file)
 
     async def append_user_illusts(self, user_id: int,
                                   content: List[Union[Illust, LazyIllust]],
@@ -239,29 +275,29 @@ class FilePixivRepo(LocalPixivRepo):
                      f"({len(content)} items) "
                      f"{metadata}")
 
-        file = self.root / "user_illusts" / f"{user_id}.json"
+        file = self.root / "user_illusts" / f"{user_id}"
         content: List[Illust] = [
             await x.get() if isinstance(x, LazyIllust) else x
             for x in content
         ]
-        return await self._append_list(file, Illust, content, metadata, lambda x: x.id, append_at_begin)
+        return await self._append_illust_list(file, content, metadata, append_at_begin)
 
     # ================ user_bookmarks ================
     async def user_bookmarks(self, user_id: int = 0, *, offset: int = 0) \
             -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
         logger.debug(f"[local] user_bookmarks {user_id}")
 
-        file = self.root / "user_bookmarks" / f"{user_id}.json"
+        file = self.root / "user_bookmarks" / f"{user_id}"
         async for x in self._read_list(file, Illust, conf.pixiv_user_bookmarks_cache_expires_in, offset):
             if isinstance(x, PixivRepoMetadata):
                 yield x
             elif isinstance(x, Illust):
-                yield LazyIllust(x.id, x)
+                yield self._lazy_illust(x)
 
     async def invalidate_user_bookmarks(self, user_id: int):
         logger.debug(f"[local] invalidate user_bookmarks {user_id}")
-        file = self.root / "user_bookmarks" / f"{user_id}.json"
-        os.remove(file)
+        file = self.root / "user_bookmarks" / f"{user_id}"
+        self._remove_list(file)
 
     async def append_user_bookmarks(self, user_id: int,
                                     content: List[Union[Illust, LazyIllust]],
@@ -272,30 +308,31 @@ class FilePixivRepo(LocalPixivRepo):
                      f"({len(content)} items) "
                      f"{metadata}")
 
-        file = self.root / "user_bookmarks" / f"{user_id}.json"
+        file = self.root / "user_bookmarks" / f"{user_id}"
         content: List[Illust] = [
             x.content if isinstance(x, LazyIllust) else x
             for x in content
         ]
         content = list(filter(lambda x: x is not None, content))
-        return await self._append_list(file, Illust, content, metadata, lambda x: x.id, append_at_begin)
+        return await self._append_illust_list(file, content, metadata, append_at_begin)
 
     # ================ recommended_illusts ================
     async def recommended_illusts(self, *, offset: int = 0) \
             -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
         logger.debug("[local] recommended_illusts")
 
-        file = self.root / "other" / "recommended_illusts.json"
-        async for x in self._read_list(file, Illust, conf.pixiv_other_cache_expires_in, offset):
+        file = self.root / "other" / "recommended_illusts"
+        expires_in = conf.pixiv_other_cache_expires_in + conf.pixiv_other_cache_stale_in
+        async for x in self._read_list(file, Illust, expires_in, offset):
             if isinstance(x, PixivRepoMetadata):
                 yield x
             elif isinstance(x, Illust):
-                yield LazyIllust(x.id, x)
+                yield self._lazy_illust(x)
 
     async def invalidate_recommended_illusts(self):
         logger.debug("[local] invalidate recommended_illusts")
-        file = self.root / "other" / "recommended_illusts.json"
-        os.remove(file)
+        file = self.root / "other" / "recommended_illusts"
+        self._remove_list(file)
 
     async def append_recommended_illusts(self, content: List[Union[Illust, LazyIllust]],
                                          metadata: PixivRepoMetadata) -> bool:
@@ -303,29 +340,43 @@ class FilePixivRepo(LocalPixivRepo):
                      f"({len(content)} items) "
                      f"{metadata}")
 
-        file = self.root / "other" / "recommended_illusts.json"
+        file = self.root / "other" / "recommended_illusts"
+        content: List[Illust] = [
+            await x.get() if isinstance(x, LazyIllust) else x
+            for x in content
+        ]
+        return await self._append_illust_list(file, content, metadata)
+
+    async def replace_recommended_illusts(self, content: List[Union[Illust, LazyIllust]],
+                                          metadata: PixivRepoMetadata):
+        logger.debug(f"[local] replace recommended_illusts "
+                     f"({len(content)} items) "
+                     f"{metadata}")
+
+        file = self.root / "other" / "recommended_illusts"
         content: List[Illust] = [
             await x.get() if isinstance(x, LazyIllust) else x
             for x in content
         ]
-        return await self._append_list(file, Illust, content, metadata, lambda x: x.id)
+        await self._replace_illust_list(file, content, metadata)
 
     # ================ related_illusts ================
     async def related_illusts(self, illust_id: int, *, offset: int = 0) \
             -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
         logger.debug(f"[local] related_illusts {illust_id}")
 
-        file = self.root / "related_illusts" / f"{illust_id}.json"
-        async for x in self._read_list(file, Illust, conf.pixiv_related_illusts_cache_expires_in, offset):
+        file = self.root / "related_illusts" / f"{illust_id}"
+        expires_in = conf.pixiv_related_illusts_cache_expires_in + conf.pixiv_related_illusts_cache_stale_in
+        async for x in self._read_list(file, Illust, expires_in, offset):
             if isinstance(x, PixivRepoMetadata):
                 yield x
             elif isinstance(x, Illust):
-                yield LazyIllust(x.id, x)
+                yield self._lazy_illust(x)
 
     async def invalidate_related_illusts(self, illust_id: int):
         logger.debug("[local] invalidate related_illusts")
-        file = self.root / "related_illusts" / f"{illust_id}.json"
-        os.remove(file)
+        file = self.root / "related_illusts" / f"{illust_id}"
+        self._remove_list(file)
 
     async def append_related_illusts(self, illust_id: int, content: List[Union[Illust, LazyIllust]],
                                      metadata: PixivRepoMetadata) -> bool:
@@ -333,55 +384,71 @@ class FilePixivRepo(LocalPixivRepo):
                      f"({len(content)} items) "
                      f"{metadata}")
 
-        file = self.root / "related_illusts" / f"{illust_id}.json"
+        file = self.root / "related_illusts" / f"{illust_id}"
         content: List[Illust] = [
             await x.get() if isinstance(x, LazyIllust) else x
             for x in content
         ]
-        return await self._append_list(file, Illust, content, metadata, lambda x: x.id)
+        return await self._append_illust_list(file, content, metadata)
+
+    async def replace_related_illusts(self, illust_id: int, content: List[Union[Illust, LazyIllust]],
+                                      metadata: PixivRepoMetadata):
+        logger.debug(f"[local] replace related_illusts {illust_id} "
+                     f"({len(content)} items) "
+                     f"{metadata}")
+
+        file = self.root / "related_illusts" / f"{illust_id}"
+        content: List[Illust] = [
+            await x.get() if isinstance(x, LazyIllust) else x
+            for x in content
+        ]
+        await self._replace_illust_list(file, content, metadata)
 
     # ================ illust_ranking ================
-    async def illust_ranking(self, mode: Union[str, RankingMode], *, offset: int = 0) \
+    async def illust_ranking(self, mode: Union[str, RankingMode], date: str,
+                             *, offset: int = 0, limit: Optional[int] = None) \
             -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
         if isinstance(mode, str):
             mode = RankingMode[mode]
 
-        logger.debug(f"[local] illust_ranking {mode}")
+        logger.debug(f"[local] illust_ranking {mode} {date}")
 
-        file = self.root / "illust_ranking" / f"{mode}.json"
-        async for x in self._read_list(file, Illust, conf.pixiv_illust_ranking_cache_expires_in, offset):
+        # 已发布的榜单不会改变，永不过期
+        file = self.root / "illust_ranking" / date / f"{mode}"
+        async for x in self._read_list(file, Illust, None, offset, limit):
             if isinstance(x, PixivRepoMetadata):
                 yield x
             elif isinstance(x, Illust):
-                yield LazyIllust(x.id, x)
+                yield self._lazy_illust(x)
 
-    async def invalidate_illust_ranking(self, mode: RankingMode):
+    async def invalidate_illust_ranking(self, mode: RankingMode, date: str):
         logger.debug("[local] invalidate illust_ranking")
-        file = self.root / "illust_ranking" / f"{mode}.json"
-        os.remove(file)
+        file = self.root / "illust_ranking" / date / f"{mode}"
+        self._remove_list(file)
 
-    async def append_illust_ranking(self, mode: RankingMode, content: List[Union[Illust, LazyIllust]],
+    async def append_illust_ranking(self, mode: RankingMode, date: str, content: List[Union[Illust, LazyIllust]],
                                     metadata: PixivRepoMetadata) -> bool:
-        logger.debug(f"[local] append illust_ranking {mode} "
+        logger.debug(f"[local] append illust_ranking {mode} {date} "
                      f"({len(content)} items) "
                      f"{metadata}")
 
-        file = self.root / "illust_ranking" / f"{mode}.json"
+        file = self.root / "illust_ranking" / date / f"{mode}"
         content: List[Illust] = [
             await x.get() if isinstance(x, LazyIllust) else x
             for x in content
         ]
-        return await self._append_list(file, Illust, content, metadata, lambda x: x.id)
+        return await self._append_illust_list(file, content, metadata)
 
     # ================ image ================
-    async def image(self, illust: Illust, page: int = 0) -> AsyncGenerator[Union[bytes, PixivRepoMetadata], None]:
-        logger.debug(f"[local] image {illust.id}")
+    async def image(self, illust: Illust, page: int = 0, variant: str = "original") \
+            -> AsyncGenerator[Union[bytes, PixivRepoMetadata], None]:
+        logger.debug(f"[local] image {illust.id}[{page}] {variant}")
 
         metadata_file = self.root / "image" / \
-            f"{illust.id}_{page}_metadata.json"
-        image_file = self.root / "image" / f"{illust.id}_{page}.jpg"
+            f"{illust.id}_{page}_{variant}_metadata.json"
+        image_file = self.root / "image" / f"{illust.id}_{page}_{variant}.jpg"
 
-        if not metadata_file.exists() or image_file:
+        if not metadata_file.exists() or not image_file.exists():
             raise NoSuchItemError()
 
         try:
@@ -391,7 +458,7 @@ class FilePixivRepo(LocalPixivRepo):
                     conf.pixiv_download_cache_expires_in)
 
             async with aiofiles.open(image_file, 'rb') as f:
-                content = f.read()
+                content = await f.read()
 
             yield metadata
             yield content
@@ -407,12 +474,13 @@ class FilePixivRepo(LocalPixivRepo):
             raise NoSuchItemError()
 
     async def update_image(self, illust_id: int, page: int,
-                           content: bytes, metadata: PixivRepoMetadata):
-        logger.debug(f"[local] update image {illust_id} {metadata}")
+                           content: bytes, metadata: PixivRepoMetadata,
+                           variant: str = "original"):
+        logger.debug(f"[local] update image {illust_id}[{page}] {variant} {metadata}")
 
         metadata_file = self.root / "image" / \
-            f"{illust_id}_{page}_metadata.json"
-        image_file = self.root / "image" / f"{illust_id}_{page}.jpg"
+            f"{illust_id}_{page}_{variant}_metadata.json"
+        image_file = self.root / "image" / f"{illust_id}_{page}_{variant}.jpg"
 
         
         mkdirs_for_parent(metadata_file)
@@ -430,4 +498,20 @@ class FilePixivRepo(LocalPixivRepo):
     async def clean_expired(self):
         logger.debug("[local] clean_expired")
 
+        # 删除超过保留期数的榜单（illust_ranking/<date>）
+        retention = conf.pixiv_ranking_cache_retention_days
+        ranking_root = self.root / "illust_ranking"
+        if retention > 0 and ranking_root.exists():
+            oldest = latest_ranking_date(conf.pixiv_ranking_rollover_time) - timedelta(days=retention)
+            deleted = 0
+            for d in ranking_root.iterdir():
+                try:
+                    expired = d.is_dir() and parse_ranking_date(d.name) < oldest
+                except ValueError:
+                    continue
+                if expired:
+                    shutil.rmtree(d, ignore_errors=True)
+                    deleted += 1
+            logger.success(f"[local] deleted {deleted} illust_ranking cache")
+
         # TODO
@@ -0,0 +1,137 @@
+from datetime import timedelta
+from typing import AsyncGenerator, Union, Sequence, Type, Tuple, TypeVar, Generic
+
+from nonebot import logger
+
+from .base import LocalPixivRepo
+from ..models import PixivRepoMetadata
+from ....config import Config
+from ....global_context import context
+from ....model import Illust, User
+from ....utils.expires_lru_dict import AsyncExpiresLruDict
+
+conf = context.require(Config)
+
+T = TypeVar("T")
+
+
+class HotCache(Generic[T]):
+    def __init__(self, maxsize: int, expires_in: int):
+        self.expires_in = expires_in
+        self.hits = 0
+        self.misses = 0
+
+        self._data = AsyncExpiresLruDict[int, Tuple[PixivRepoMetadata, T]](maxsize)
+
+    async def get(self, key: int) -> Union[Tuple[PixivRepoMetadata, T], None]:
+        node = await self._data.get(key)
+        if node is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return node
+
+    async def put(self, key: int, value: T, metadata: PixivRepoMetadata):
+        if await self._data.contains(key):
+            await self._data.pop(key)
+        # 与本地缓存的过期时间一致
+        expires_time = metadata.update_time + timedelta(seconds=self.expires_in)
+        await self._data.add(key, (metadata, value), expires_time)
+
+    def clear(self):
+        self._data = AsyncExpiresLruDict[int, Tuple[PixivRepoMetadata, T]](self._data.maxsize)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+
+class HotCacheLocalPixivRepo:
+    """
+    在LocalPixivRepo之前缓存已解析的illust_detail与user_detail，其余方法直接委托
+    """
+
+    def __init__(self, delegation_type: Type[LocalPixivRepo]):
+        self.delegation = context.require(delegation_type)
+
+        self.illust_cache = HotCache[Illust](conf.pixiv_hot_cache_size,
+                                             conf.pixiv_illust_detail_cache_expires_in)
+        self.user_cache = HotCache[User](conf.pixiv_hot_cache_size,
+                                         conf.pixiv_user_detail_cache_expires_in)
+
+    async def illust_detail(self, illust_id: int) -> AsyncGenerator[Union[Illust, PixivRepoMetadata], None]:
+        node = await self.illust_cache.get(illust_id)
+        if node is not None:
+            logger.debug(f"[local] illust_detail {illust_id} (hot cache)")
+            yield node[0]
+            yield node[1]
+            return
+
+        metadata = None
+        async for x in self.delegation.illust_detail(illust_id):
+            if isinstance(x, PixivRepoMetadata):
+                metadata = x
+            else:
+                await self.illust_cache.put(illust_id, x, metadata)
+            yield x
+
+    async def illust_details(self, illust_ids: Sequence[int]) \
+            -> AsyncGenerator[Union[Illust, PixivRepoMetadata], None]:
+        missed = []
+        for illust_id in illust_ids:
+            node = await self.illust_cache.get(illust_id)
+            if node is not None:
+                yield node[0]
+                yield node[1]
+            else:
+                missed.append(illust_id)
+
+        if len(missed) == 0:
+            return
+
+        metadata = None
+        async for x in self.delegation.illust_details(missed):
+            if isinstance(x, PixivRepoMetadata):
+                metadata = x
+            else:
+                await self.illust_cache.put(x.id, x, metadata)
+            yield x
+
+    async def update_illust_detail(self, illust: Illust, metadata: PixivRepoMetadata):
+        await self.delegation.update_illust_detail(illust, metadata)
+        await self.illust_cache.put(illust.id, illust, metadata)
+
+    async def user_detail(self, user_id: int) -> AsyncGenerator[Union[User, PixivRepoMetadata], None]:
+        node = await self.user_cache.get(user_id)
+        if node is not None:
+            logger.debug(f"[local] user_detail {user_id} (hot cache)")
+            yield node[0]
+            yield node[1]
+            return
+
+        metadata = None
+        async for x in self.delegation.user_detail(user_id):
+            if isinstance(x, PixivRepoMetadata):
+                metadata = x
+            else:
+                await self.user_cache.put(user_id, x, metadata)
+            yield x
+
+    async def update_user_detail(self, user: User, metadata: PixivRepoMetadata):
+        await self.delegation.update_user_detail(user, metadata)
+        await self.user_cache.put(user.id, user, metadata)
+
+    async def invalidate_all(self):
+        logger.info(f"[local] hot cache invalidated "
+                    f"(illust_detail: {self.illust_cache.hits} hits, {self.illust_cache.misses} misses; "
+                    f"user_detail: {self.user_cache.hits} hits, {self.user_cache.misses} misses)")
+        self.illust_cache.clear()
+        self.user_cache.clear()
+        await self.delegation.invalidate_all()
+
+    def __getattr__(self, name: str):
+        return getattr(self.delegation, name)
+
+
+__all__ = ("HotCacheLocalPixivRepo",)
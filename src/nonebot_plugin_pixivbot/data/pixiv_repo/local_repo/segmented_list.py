@@ -0,0 +1,298 @@
+import json
+import os
+import shutil
+from asyncio import Lock
+from pathlib import Path
+from typing import List, Type, TypeVar, AsyncGenerator, Any, Set, Sequence, Optional, Tuple
+from weakref import WeakValueDictionary
+
+import aiofiles
+from cachetools import LRUCache
+from nonebot import logger
+from pydantic import BaseModel
+
+from ..models import PixivRepoMetadata
+
+T_Content = TypeVar("T_Content", bound=BaseModel)
+
+# 分段数超过该值时合并为一段
+_COMPACTION_THRESHOLD = 32
+
+# 每个列表的写锁（追加、合并分段），没有列表在使用时自动释放
+_locks: "WeakValueDictionary[Path, Lock]" = WeakValueDictionary()
+
+# 最近写入的列表的键集合，以及对应的keys.jsonl的(大小, 修改时间)；
+# keys.jsonl在此之外被修改时（例如被删除）重新读取
+_keys_index = LRUCache[Path, Tuple[Tuple[int, int], Set[Any]]](maxsize=64)
+
+
+class SegmentInfo(BaseModel):
+    name: str
+    count: int
+
+
+class SegmentedListHeader(BaseModel):
+    metadata: PixivRepoMetadata
+    segments: List[SegmentInfo] = []  # 按列表中的顺序排列
+    next_segment_id: int = 0
+
+
+class SegmentedListFile:
+    """
+    分段存储的列表缓存，目录结构如下：
+
+    - header.json：元数据及各分段的顺序与条目数
+    - keys.jsonl：已存在的条目的键（只追加）
+    - {n}.jsonl：分段，每行一个条目（写入后不再修改）
+
+    追加（包括追加到开头）只需写入一个新的分段并重写header，不需要读取已有的条目；
+    已有的键缓存在内存中，只在第一次追加时读取一次keys.jsonl
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.header_file = path / "header.json"
+        self.keys_file = path / "keys.jsonl"
+
+        self.lock = _locks.get(path, None)
+        if self.lock is None:
+            self.lock = Lock()
+            _locks[path] = self.lock
+
+    def exists(self) -> bool:
+        return self.header_file.exists()
+
+    def remove(self):
+        _keys_index.pop(self.path, None)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    async def read_header(self) -> SegmentedListHeader:
+        async with aiofiles.open(self.header_file, 'r', encoding="utf-8") as f:
+            return SegmentedListHeader.parse_raw(await f.read())
+
+    async def _write_header(self, header: SegmentedListHeader):
+        # 先写临时文件再替换，避免读到写了一半的header
+        tmp_file = self.path / "header.json.tmp"
+        async with aiofiles.open(tmp_file, 'w+', encoding="utf-8") as f:
+            await f.write(header.json())
+        os.replace(tmp_file, self.header_file)
+
+    def _stat_keys(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.keys_file)
+            return st.st_size, st.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    async def read_keys(self) -> Set[Any]:
+        """
+        读取已存在的条目的键（返回的集合不可修改）
+        """
+        stat = self._stat_keys()
+        if stat is None:
+            _keys_index.pop(self.path, None)
+            return set()
+
+        cached = _keys_index.get(self.path, None)
+        if cached is not None and cached[0] == stat:
+            return cached[1]
+
+        async with aiofiles.open(self.keys_file, 'r', encoding="utf-8") as f:
+            keys = {json.loads(line) async for line in f if line.strip()}
+        _keys_index[self.path] = (stat, keys)
+        return keys
+
+    async def read(self, header: SegmentedListHeader, t_content: Type[T_Content],
+                   offset: int = 0, limit: Optional[int] = None) \
+            -> AsyncGenerator[T_Content, None]:
+        pos = offset  # 下一个条目在列表中的位置
+        while True:
+            try:
+                async for x in self._read_segments(header, t_content, pos, limit):
+                    pos += 1
+                    if limit is not None:
+                        limit -= 1
+                    yield x
+                return
+            except FileNotFoundError:
+                # 读取期间分段被合并，按合并后的header从当前位置继续读取
+                new_header = await self.read_header()
+                if new_header.segments == header.segments:
+                    raise
+                header = new_header
+
+    async def _read_segments(self, header: SegmentedListHeader, t_content: Type[T_Content],
+                             offset: int = 0, limit: Optional[int] = None) \
+            -> AsyncGenerator[T_Content, None]:
+        for seg in header.segments:
+            if limit is not None and limit <= 0:
+                break
+
+            # 整段跳过的分段不需要打开
+            if offset >= seg.count:
+                offset -= seg.count
+                continue
+
+            async with aiofiles.open(self.path / seg.name, 'r', encoding="utf-8") as f:
+                async for line in f:
+                    if offset > 0:
+                        # 只跳过行，不做解析
+                        offset -= 1
+                        continue
+                    yield t_content.parse_raw(line)
+
+                    if limit is not None:
+                        limit -= 1
+                        if limit <= 0:
+                            break
+
+    async def append(self, content: Sequence[T_Content], keys: Sequence[Any],
+                     metadata: PixivRepoMetadata, append_at_begin: bool = False) -> bool:
+        """
+        追加条目，跳过键已存在的条目
+
+        :param content: 条目
+        :param keys: 各条目的键
+        :param metadata: 元数据
+        :param append_at_begin: 是否追加到开头
+        :return: content中是否有键已存在的条目
+        """
+        async with self.lock:
+            self.path.mkdir(parents=True, exist_ok=True)
+
+            if self.exists():
+                header = await self.read_header()
+                header.metadata = metadata
+                existing_keys = await self.read_keys()
+            else:
+                header = SegmentedListHeader(metadata=metadata)
+                existing_keys = set()
+                # 没有header时残留的keys.jsonl不属于任何条目
+                if self.keys_file.exists():
+                    os.remove(self.keys_file)
+
+            new_content, new_keys, seen = self._dedupe(content, keys, existing_keys)
+
+            if append_at_begin:
+                # 与逐个插入到开头的结果保持一致
+                new_content.reverse()
+
+            if len(new_content) > 0:
+                seg = await self._write_segment(header, new_content)
+
+                stat = self._stat_keys()
+                async with aiofiles.open(self.keys_file, 'a', encoding="utf-8") as f:
+                    await f.write("".join(json.dumps(k) + "\n" for k in new_keys))
+
+                # 增量更新内存中的键集合
+                cached = _keys_index.get(self.path, None)
+                if stat is None:
+                    _keys_index[self.path] = (self._stat_keys(), seen)
+                elif cached is not None and cached[0] == stat:
+                    cached[1].update(seen)
+                    _keys_index[self.path] = (self._stat_keys(), cached[1])
+
+                if append_at_begin:
+                    header.segments.insert(0, seg)
+                else:
+                    header.segments.append(seg)
+
+            await self._write_header(header)
+
+            if len(header.segments) > _COMPACTION_THRESHOLD:
+                await self._compact(header)
+
+            return len(new_content) < len(content)
+
+    async def replace(self, content: Sequence[T_Content], keys: Sequence[Any],
+                      metadata: PixivRepoMetadata):
+        """
+        以content替换整个列表：先写入新的分段与键，最后替换header，替换前读到的仍是旧的列表
+
+        :param content: 条目
+        :param keys: 各条目的键
+        :param metadata: 元数据
+        """
+        async with self.lock:
+            self.path.mkdir(parents=True, exist_ok=True)
+
+            if self.exists():
+                header = await self.read_header()
+                old_segments = header.segments
+                header = SegmentedListHeader(metadata=metadata, next_segment_id=header.next_segment_id)
+            else:
+                header = SegmentedListHeader(metadata=metadata)
+                old_segments = []
+
+            new_content, new_keys, seen = self._dedupe(content, keys, set())
+            if len(new_content) > 0:
+                header.segments.append(await self._write_segment(header, new_content))
+
+            tmp_file = self.path / "keys.jsonl.tmp"
+            async with aiofiles.open(tmp_file, 'w+', encoding="utf-8") as f:
+                await f.write("".join(json.dumps(k) + "\n" for k in new_keys))
+            os.replace(tmp_file, self.keys_file)
+            _keys_index[self.path] = (self._stat_keys(), seen)
+
+            await self._write_header(header)
+            self._remove_segments(old_segments)
+
+    @staticmethod
+    def _dedupe(content: Sequence[T_Content], keys: Sequence[Any], existing_keys: Set[Any]) \
+            -> Tuple[List[T_Content], List[Any], Set[Any]]:
+        new_content = []
+        new_keys = []
+        seen = set()
+        for c, k in zip(content, keys):
+            if k in existing_keys or k in seen:
+                continue
+            seen.add(k)
+            new_content.append(c)
+            new_keys.append(k)
+        return new_content, new_keys, seen
+
+    async def _write_segment(self, header: SegmentedListHeader, content: Sequence[T_Content]) -> SegmentInfo:
+        # 分段写入后才会被header引用
+        seg = SegmentInfo(name=f"{header.next_segment_id}.jsonl", count=len(content))
+        header.next_segment_id += 1
+
+        async with aiofiles.open(self.path / seg.name, 'w+', encoding="utf-8") as f:
+            await f.write("".join(x.json() + "\n" for x in content))
+        return seg
+
+    def _remove_segments(self, segments: Sequence[SegmentInfo]):
+        # 正在按旧header读取的调用方找不到分段时会按新header继续读取（见read）
+        for x in segments:
+            try:
+                os.remove(self.path / x.name)
+            except OSError as e:
+                # Windows下无法删除正在被读取的文件
+                logger.opt(exception=e).warning(f"[local] failed to remove segment {self.path / x.name}")
+
+    async def compact(self):
+        """
+        将所有分段按顺序合并为一段（按行拷贝，不做解析）
+        """
+        async with self.lock:
+            await self._compact(await self.read_header())
+
+    async def _compact(self, header: SegmentedListHeader):
+        seg = SegmentInfo(name=f"{header.next_segment_id}.jsonl",
+                          count=sum(x.count for x in header.segments))
+        old_segments = header.segments
+
+        # 先写临时文件再重命名，header替换前不会出现写了一半的分段
+        tmp_file = self.path / f"{seg.name}.tmp"
+        async with aiofiles.open(tmp_file, 'w+', encoding="utf-8") as fw:
+            for x in old_segments:
+                async with aiofiles.open(self.path / x.name, 'r', encoding="utf-8") as fr:
+                    await fw.write(await fr.read())
+        os.replace(tmp_file, self.path / seg.name)
+
+        header.segments = [seg]
+        header.next_segment_id += 1
+        await self._write_header(header)
+        self._remove_segments(old_segments)
+
+
+__all__ = ("SegmentedListFile", "SegmentedListHeader")
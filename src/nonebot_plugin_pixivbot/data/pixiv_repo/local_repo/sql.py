@@ -1,6 +1,6 @@
 from datetime import datetime, timezone, timedelta
 from functools import partial
-from typing import AsyncGenerator, Union, Optional, List
+from typing import AsyncGenerator, Union, Optional, List, Sequence
 
 from apscheduler.triggers.interval import IntervalTrigger
 from nonebot import logger
@@ -11,7 +11,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from .base import LocalPixivRepo
 from .sql_models import IllustDetailCache, UserDetailCache, DownloadCache, IllustSetCache, IllustSetCacheIllust, \
     UserSetCache, UserSetCacheUser
-from ..errors import NoSuchItemError
+from ..errors import NoSuchItemError, CacheExpiredError
 from ..lazy_illust import LazyIllust
 from ..models import PixivRepoMetadata
 from ...local_tag import LocalTagRepo
@@ -20,8 +20,10 @@ from ...utils.sql import insert
 from ....config import Config
 from ....enums import RankingMode
 from ....global_context import context
-from ....model import Illust, User
+from ....model import Illust, IllustSummary, User
+from ....utils.algorithm import as_unique, chunked
 from ....utils.lifecycler import on_startup
+from ....utils.ranking_date import latest_ranking_date
 
 
 def _extract_metadata(cache, is_set_cache):
@@ -34,6 +36,9 @@ def _extract_metadata(cache, is_set_cache):
     return metadata
 
 
+# 批量插入时每条语句的行数，每行3个参数，不超过旧版SQLite的999个参数的限制
+_BULK_BATCH_SIZE = 300
+
 conf = context.require(Config)
 data_source = context.require(DataSource)
 local_tags = context.require(LocalTagRepo)
@@ -56,8 +61,9 @@ class SqlPixivRepo(LocalPixivRepo):
     async def _get_illusts(self, session: AsyncSession,
                            cache_type: str,
                            key: dict,
-                           expired_in: int,
-                           offset: int = 0, ):
+                           expired_in: Optional[int],
+                           offset: int = 0,
+                           limit: Optional[int] = None):
         stmt = (select(IllustSetCache)
                 .where(IllustSetCache.cache_type == cache_type,
                        IllustSetCache.key == key))
@@ -74,6 +80,8 @@ class SqlPixivRepo(LocalPixivRepo):
                 .outerjoin(IllustDetailCache, IllustSetCacheIllust.illust_id == IllustDetailCache.illust_id)
                 .order_by(IllustSetCacheIllust.rank, IllustDetailCache.update_time.desc())
                 .offset(offset))
+        if limit is not None:
+            stmt = stmt.limit(limit)
 
         total = 0
         broken = 0
@@ -86,7 +94,11 @@ class SqlPixivRepo(LocalPixivRepo):
                 total += 1
 
                 if illust is not None:
-                    yield LazyIllust(illust.illust_id, Illust(**illust.illust))
+                    if conf.pixiv_compact_illust_list:
+                        # 不必构造完整的Illust，抽中后再由illust_details取出
+                        yield LazyIllust.from_summary(IllustSummary.from_dict(illust.illust))
+                    else:
+                        yield LazyIllust(illust.illust_id, Illust(**illust.illust))
                 else:
                     yield LazyIllust(cache_illust.illust_id)
                     broken += 1
@@ -97,7 +109,8 @@ class SqlPixivRepo(LocalPixivRepo):
 
     async def _invalidate_illusts(self, session: AsyncSession,
                                   cache_type: str,
-                                  key: dict):
+                                  key: dict,
+                                  commit: bool = True):
         if conf.pixiv_sql_dialect == 'sqlite':
             await session.execute(text("PRAGMA foreign_keys = ON;"))
 
@@ -105,7 +118,17 @@ class SqlPixivRepo(LocalPixivRepo):
                 .where(IllustSetCache.cache_type == cache_type,
                        IllustSetCache.key == key))
         await session.execute(stmt)
-        await session.commit()
+        if commit:
+            await session.commit()
+
+    async def _replace_illusts(self, session: AsyncSession,
+                               cache_type: str,
+                               key: dict,
+                               content: List[Union[Illust, LazyIllust]],
+                               metadata: PixivRepoMetadata):
+        # 删除旧的集合与写入新的集合在同一个事务中提交，其他会话读到的要么是旧的集合，要么是新的集合
+        await self._invalidate_illusts(session, cache_type, key, commit=False)
+        await self._append_and_check_illusts(session, cache_type, key, content=content, metadata=metadata)
 
     async def _append_and_check_illusts(self, session: AsyncSession,
                                         cache_type: str,
@@ -131,7 +154,14 @@ class SqlPixivRepo(LocalPixivRepo):
                 # commit to get cache id
                 await tx2.commit()
 
-            row_count = 0
+            # 先查出已存在于集合的illust，只为新的illust分配rank，然后分批插入
+            existed = set()
+            for ids in chunked(as_unique(x.id for x in content), _BULK_BATCH_SIZE):
+                stmt = (select(IllustSetCacheIllust.illust_id)
+                        .where(IllustSetCacheIllust.cache_id == cache.id,
+                               IllustSetCacheIllust.illust_id.in_(ids)))
+                existed.update((await session.execute(stmt)).scalars())
+
             if append_at_begin:
                 stmt = select(
                     func.min(IllustSetCacheIllust.rank)
@@ -143,15 +173,10 @@ class SqlPixivRepo(LocalPixivRepo):
                 if rnk is None:
                     rnk = 0
 
-                for x in reversed(content):
-                    stmt = insert(IllustSetCacheIllust).values(
-                        cache_id=cache.id, illust_id=x.id, rank=rnk - 1
-                    ).on_conflict_do_nothing(index_elements=[
-                        IllustSetCacheIllust.cache_id, IllustSetCacheIllust.illust_id
-                    ])
-                    result = await session.execute(stmt)
-                    row_count += result.rowcount
-                    rnk -= result.rowcount
+                # 与逐条插入时一致，content内重复的illust保留靠后的一个
+                new_ids = [x for x in as_unique(x.id for x in reversed(content)) if x not in existed]
+                new_ids.reverse()
+                rnk -= len(new_ids)
             else:
                 stmt = select(
                     func.max(IllustSetCacheIllust.rank)
@@ -163,30 +188,40 @@ class SqlPixivRepo(LocalPixivRepo):
                 if rnk is None:
                     rnk = 0
 
-                for x in content:
-                    stmt = insert(IllustSetCacheIllust).values(
-                        cache_id=cache.id, illust_id=x.id, rank=rnk + 1
-                    ).on_conflict_do_nothing(index_elements=[
-                        IllustSetCacheIllust.cache_id, IllustSetCacheIllust.illust_id
-                    ])
-                    result = await session.execute(stmt)
-                    row_count += result.rowcount
-                    rnk += result.rowcount
+                new_ids = [x for x in as_unique(x.id for x in content) if x not in existed]
+                rnk += 1
+
+            row_count = 0
+            for i, ids in enumerate(chunked(new_ids, _BULK_BATCH_SIZE)):
+                base_rnk = rnk + i * _BULK_BATCH_SIZE
+                stmt = insert(IllustSetCacheIllust).values([
+                    dict(cache_id=cache.id, illust_id=illust_id, rank=base_rnk + j)
+                    for j, illust_id in enumerate(ids)
+                ]).on_conflict_do_nothing(index_elements=[
+                    IllustSetCacheIllust.cache_id, IllustSetCacheIllust.illust_id
+                ])
+                result = await session.execute(stmt)
+                row_count += result.rowcount
 
             cache.size += row_count
 
             await tx1.commit()
 
         # insert illust detail
+        li = {}
         for x in content:
             if isinstance(x, LazyIllust):
                 if not x.loaded:
                     continue
                 x = x.content
-
-            stmt = insert(IllustDetailCache).values(
-                illust_id=x.id, illust=x.dict(), update_time=metadata.update_time
-            )
+            # 同一条语句内不能更新同一行两次（PostgreSQL）
+            li[x.id] = x
+
+        for illusts in chunked(list(li.values()), _BULK_BATCH_SIZE):
+            stmt = insert(IllustDetailCache).values([
+                dict(illust_id=x.id, illust=x.dict(), update_time=metadata.update_time)
+                for x in illusts
+            ])
             stmt = stmt.on_conflict_do_update(
                 index_elements=[IllustDetailCache.illust_id],
                 set_={
@@ -199,14 +234,7 @@ class SqlPixivRepo(LocalPixivRepo):
         await session.commit()
 
         # insert local tags
-        li = []
-        for x in content:
-            if isinstance(x, LazyIllust):
-                if not x.loaded:
-                    continue
-                x = x.content
-            li.append(x)
-        await local_tags.update_from_illusts(li)
+        await local_tags.update_from_illusts(list(li.values()))
 
         return row_count != len(content)
 
@@ -318,13 +346,30 @@ class SqlPixivRepo(LocalPixivRepo):
             cache = (await session.execute(stmt)).scalar_one_or_none()
 
             if cache is not None:
-                metadata = _extract_metadata(cache, False).check_is_expired(conf.pixiv_illust_detail_cache_expires_in)
+                metadata = _extract_metadata(cache, False).check_is_expired(
+                    conf.pixiv_illust_detail_cache_expires_in + conf.pixiv_illust_detail_cache_stale_in)
 
                 yield metadata
                 yield Illust(**cache.illust)
             else:
                 raise NoSuchItemError()
 
+    async def illust_details(self, illust_ids: Sequence[int]) \
+            -> AsyncGenerator[Union[Illust, PixivRepoMetadata], None]:
+        logger.debug(f"[local] illust_details ({len(illust_ids)} items)")
+
+        async with data_source.start_session() as session:
+            stmt = select(IllustDetailCache).where(IllustDetailCache.illust_id.in_(illust_ids))
+            for cache in (await session.execute(stmt)).scalars():
+                try:
+                    metadata = _extract_metadata(cache, False).check_is_expired(
+                        conf.pixiv_illust_detail_cache_expires_in)
+                except CacheExpiredError:
+                    continue
+
+                yield metadata
+                yield Illust(**cache.illust)
+
     async def update_illust_detail(self, illust: Illust, metadata: PixivRepoMetadata):
         logger.debug(f"[local] update illust_detail {illust.id} {metadata}")
 
@@ -353,7 +398,8 @@ class SqlPixivRepo(LocalPixivRepo):
             cache = (await session.execute(stmt)).scalar_one_or_none()
 
             if cache is not None:
-                metadata = _extract_metadata(cache, False).check_is_expired(conf.pixiv_user_detail_cache_expires_in)
+                metadata = _extract_metadata(cache, False).check_is_expired(
+                    conf.pixiv_user_detail_cache_expires_in + conf.pixiv_user_detail_cache_stale_in)
 
                 yield metadata
                 yield User(**cache.user)
@@ -376,12 +422,14 @@ class SqlPixivRepo(LocalPixivRepo):
             await session.commit()
 
     # ================ image ================
-    async def image(self, illust: Illust, page: int = 0) -> AsyncGenerator[Union[bytes, PixivRepoMetadata], None]:
-        logger.debug(f"[local] image {illust.id}")
+    async def image(self, illust: Illust, page: int = 0, variant: str = "original") \
+            -> AsyncGenerator[Union[bytes, PixivRepoMetadata], None]:
+        logger.debug(f"[local] image {illust.id}[{page}] {variant}")
 
         async with data_source.start_session() as session:
             stmt = select(DownloadCache).where(DownloadCache.illust_id == illust.id,
-                                               DownloadCache.page == page).limit(1)
+                                               DownloadCache.page == page,
+                                               DownloadCache.variant == variant).limit(1)
             cache = (await session.execute(stmt)).scalar_one_or_none()
 
             if cache is not None:
@@ -393,13 +441,16 @@ class SqlPixivRepo(LocalPixivRepo):
                 raise NoSuchItemError()
 
     async def update_image(self, illust_id: int, page: int,
-                           content: bytes, metadata: PixivRepoMetadata):
-        logger.debug(f"[local] update image {illust_id} {metadata}")
+                           content: bytes, metadata: PixivRepoMetadata,
+                           variant: str = "original"):
+        logger.debug(f"[local] update image {illust_id}[{page}] {variant} {metadata}")
 
         async with data_source.start_session() as session:
             stmt = (insert(DownloadCache)
-                    .values(illust_id=illust_id, page=page, content=content, update_time=metadata.update_time))
-            stmt = stmt.on_conflict_do_update(index_elements=[DownloadCache.illust_id, DownloadCache.page],
+                    .values(illust_id=illust_id, page=page, variant=variant,
+                            content=content, update_time=metadata.update_time))
+            stmt = stmt.on_conflict_do_update(index_elements=[DownloadCache.illust_id, DownloadCache.page,
+                                                              DownloadCache.variant],
                                               set_={
                                                   DownloadCache.content: stmt.excluded.content,
                                                   DownloadCache.update_time: stmt.excluded.update_time
@@ -409,30 +460,32 @@ class SqlPixivRepo(LocalPixivRepo):
             await session.commit()
 
     # ================ illust_ranking ================
-    async def illust_ranking(self, mode: Union[str, RankingMode], *, offset: int = 0) \
+    async def illust_ranking(self, mode: Union[str, RankingMode], date: str,
+                             *, offset: int = 0, limit: Optional[int] = None) \
             -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
         if isinstance(mode, str):
             mode = RankingMode[mode]
 
-        logger.debug(f"[local] illust_ranking {mode}")
+        logger.debug(f"[local] illust_ranking {mode} {date}")
 
         async with data_source.start_session() as session:
-            async for x in self._get_illusts(session, "illust_ranking", {"mode": mode},
-                                             expired_in=conf.pixiv_illust_ranking_cache_expires_in, offset=offset):
+            # 已发布的榜单不会改变，永不过期
+            async for x in self._get_illusts(session, "illust_ranking", {"mode": mode, "date": date},
+                                             expired_in=None, offset=offset, limit=limit):
                 yield x
 
-    async def invalidate_illust_ranking(self, mode: RankingMode):
+    async def invalidate_illust_ranking(self, mode: RankingMode, date: str):
         logger.debug("[local] invalidate illust_ranking")
         async with data_source.start_session() as session:
-            await self._invalidate_illusts(session, "illust_ranking", {"mode": mode})
+            await self._invalidate_illusts(session, "illust_ranking", {"mode": mode, "date": date})
 
-    async def append_illust_ranking(self, mode: RankingMode, content: List[Union[Illust, LazyIllust]],
+    async def append_illust_ranking(self, mode: RankingMode, date: str, content: List[Union[Illust, LazyIllust]],
                                     metadata: PixivRepoMetadata) -> bool:
-        logger.debug(f"[local] append illust_ranking {mode} "
+        logger.debug(f"[local] append illust_ranking {mode} {date} "
                      f"({len(content)} items) "
                      f"{metadata}")
         async with data_source.start_session() as session:
-            return await self._append_and_check_illusts(session, "illust_ranking", {"mode": mode},
+            return await self._append_and_check_illusts(session, "illust_ranking", {"mode": mode, "date": date},
                                                         content=content, metadata=metadata)
 
     # ================ search_illust ================
@@ -457,7 +510,7 @@ class SqlPixivRepo(LocalPixivRepo):
                      f"{metadata}")
         async with data_source.start_session() as session:
             return await self._append_and_check_illusts(session, "search_illust", {"word": word},
-                                                        content=content, metadata=metadata,append_at_begin=True)
+                                                        content=content, metadata=metadata, append_at_begin=True)
 
     # ================ user_illusts ================
     async def user_illusts(self, user_id: int, *, offset: int = 0) \
@@ -518,8 +571,9 @@ class SqlPixivRepo(LocalPixivRepo):
             -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
         logger.debug("[local] recommended_illusts")
         async with data_source.start_session() as session:
+            expired_in = conf.pixiv_other_cache_expires_in + conf.pixiv_other_cache_stale_in
             async for x in self._get_illusts(session, "other", {"type": "recommended_illusts"},
-                                             expired_in=conf.pixiv_other_cache_expires_in, offset=offset):
+                                             expired_in=expired_in, offset=offset):
                 yield x
 
     async def invalidate_recommended_illusts(self):
@@ -536,14 +590,23 @@ class SqlPixivRepo(LocalPixivRepo):
             return await self._append_and_check_illusts(session, "other", {"type": "recommended_illusts"},
                                                         content=content, metadata=metadata)
 
+    async def replace_recommended_illusts(self, content: List[Union[Illust, LazyIllust]],
+                                          metadata: PixivRepoMetadata):
+        logger.debug(f"[local] replace recommended_illusts "
+                     f"({len(content)} items) "
+                     f"{metadata}")
+        async with data_source.start_session() as session:
+            await self._replace_illusts(session, "other", {"type": "recommended_illusts"},
+                                        content=content, metadata=metadata)
+
     # ================ related_illusts ================
     async def related_illusts(self, illust_id: int, *, offset: int = 0) \
             -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
         logger.debug(f"[local] related_illusts {illust_id}")
         async with data_source.start_session() as session:
+            expired_in = conf.pixiv_related_illusts_cache_expires_in + conf.pixiv_related_illusts_cache_stale_in
             async for x in self._get_illusts(session, "related_illusts", {"original_illust_id": illust_id},
-                                             expired_in=conf.pixiv_related_illusts_cache_expires_in,
-                                             offset=offset):
+                                             expired_in=expired_in, offset=offset):
                 yield x
 
     async def invalidate_related_illusts(self, illust_id: int):
@@ -560,6 +623,15 @@ class SqlPixivRepo(LocalPixivRepo):
             return await self._append_and_check_illusts(session, "related_illusts", {"original_illust_id": illust_id},
                                                         content=content, metadata=metadata)
 
+    async def replace_related_illusts(self, illust_id: int, content: List[Union[Illust, LazyIllust]],
+                                      metadata: PixivRepoMetadata):
+        logger.debug(f"[local] replace related_illusts {illust_id} "
+                     f"({len(content)} items) "
+                     f"{metadata}")
+        async with data_source.start_session() as session:
+            await self._replace_illusts(session, "related_illusts", {"original_illust_id": illust_id},
+                                        content=content, metadata=metadata)
+
     # ================ search_user ================
     async def search_user(self, word: str, *, offset: int = 0) \
             -> AsyncGenerator[Union[User, PixivRepoMetadata], None]:
@@ -610,14 +682,16 @@ class SqlPixivRepo(LocalPixivRepo):
                 await session.execute(text("PRAGMA foreign_keys = ON;"))
 
             now = datetime.utcnow()
+            expired_in = conf.pixiv_illust_detail_cache_expires_in + conf.pixiv_illust_detail_cache_stale_in
             stmt = delete(IllustDetailCache).where(
-                IllustDetailCache.update_time <= now - timedelta(seconds=conf.pixiv_illust_detail_cache_expires_in)
+                IllustDetailCache.update_time <= now - timedelta(seconds=expired_in)
             )
             result = await session.execute(stmt)
             logger.success(f"[local] deleted {result.rowcount} illust_detail cache")
 
+            expired_in = conf.pixiv_user_detail_cache_expires_in + conf.pixiv_user_detail_cache_stale_in
             stmt = delete(UserDetailCache).where(
-                UserDetailCache.update_time <= now - timedelta(seconds=conf.pixiv_user_detail_cache_expires_in)
+                UserDetailCache.update_time <= now - timedelta(seconds=expired_in)
             )
             result = await session.execute(stmt)
             logger.success(f"[local] deleted {result.rowcount} user_detail cache")
@@ -628,12 +702,15 @@ class SqlPixivRepo(LocalPixivRepo):
             result = await session.execute(stmt)
             logger.success(f"[local] deleted {result.rowcount} download cache")
 
-            stmt = delete(IllustSetCache).where(
-                IllustSetCache.cache_type == 'illust_ranking',
-                IllustSetCache.update_time <= now - timedelta(seconds=conf.pixiv_illust_ranking_cache_expires_in)
-            )
-            result = await session.execute(stmt)
-            logger.success(f"[local] deleted {result.rowcount} illust_ranking cache")
+            # 榜单按(mode, date)缓存且不会过期，删除旧版本按mode缓存的榜单与超过保留期数的榜单
+            retention = conf.pixiv_ranking_cache_retention_days
+            oldest = latest_ranking_date(conf.pixiv_ranking_rollover_time) - timedelta(days=retention)
+            stmt = select(IllustSetCache.id, IllustSetCache.key).where(IllustSetCache.cache_type == 'illust_ranking')
+            deleted = [cache_id for cache_id, key in await session.execute(stmt)
+                       if "date" not in key or (retention > 0 and key["date"] < oldest.isoformat())]
+            if len(deleted) > 0:
+                await session.execute(delete(IllustSetCache).where(IllustSetCache.id.in_(deleted)))
+            logger.success(f"[local] deleted {len(deleted)} illust_ranking cache")
 
             stmt = delete(IllustSetCache).where(
                 IllustSetCache.cache_type == 'search_illust',
@@ -663,16 +740,18 @@ class SqlPixivRepo(LocalPixivRepo):
             result = await session.execute(stmt)
             logger.success(f"[local] deleted {result.rowcount} user_bookmarks cache")
 
+            expired_in = conf.pixiv_related_illusts_cache_expires_in + conf.pixiv_related_illusts_cache_stale_in
             stmt = delete(IllustSetCache).where(
                 IllustSetCache.cache_type == 'related_illusts',
-                IllustSetCache.update_time <= now - timedelta(seconds=conf.pixiv_related_illusts_cache_expires_in)
+                IllustSetCache.update_time <= now - timedelta(seconds=expired_in)
             )
             result = await session.execute(stmt)
             logger.success(f"[local] deleted {result.rowcount} related_illusts cache")
 
+            expired_in = conf.pixiv_other_cache_expires_in + conf.pixiv_other_cache_stale_in
             stmt = delete(IllustSetCache).where(
                 IllustSetCache.cache_type == 'other',
-                IllustSetCache.update_time <= now - timedelta(seconds=conf.pixiv_other_cache_expires_in)
+                IllustSetCache.update_time <= now - timedelta(seconds=expired_in)
             )
             result = await session.execute(stmt)
             logger.success(f"[local] deleted {result.rowcount} other cache")
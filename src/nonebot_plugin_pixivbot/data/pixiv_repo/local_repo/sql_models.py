@@ -14,6 +14,7 @@ class DownloadCache:
 
     illust_id: Mapped[int] = mapped_column(primary_key=True)
     page: Mapped[int] = mapped_column(primary_key=True, default=0)
+    variant: Mapped[str] = mapped_column(primary_key=True, default="original")
     content: Mapped[bytes] = mapped_column(BLOB)
 
     update_time: Mapped[datetime] = mapped_column(UTCDateTime, index=True)
@@ -5,6 +5,7 @@ from nonebot import logger
 
 from .errors import NoSuchItemError, CacheExpiredError
 from .models import PixivRepoMetadata
+from ...utils.coros import aclosing
 from ...utils.format import format_kwargs
 
 T = TypeVar("T")
@@ -17,22 +18,42 @@ class Mediator(Protocol[T]):
         ...
 
 
+def _check_stale(tag: str, expires_in: Optional[int], metadata: PixivRepoMetadata, query_kwargs: T_KWARGS,
+                 on_stale: Optional[Callable[[], Any]]):
+    if expires_in is None or not metadata.is_stale(expires_in):
+        return
+
+    # 没有提供on_stale时按过期处理
+    if on_stale is None:
+        raise CacheExpiredError(metadata)
+
+    logger.info(f"[{tag}] cache stale, revalidating in background  ({format_kwargs(**query_kwargs)})")
+    on_stale()
+
+
 class SingleMediator(Mediator, Generic[T]):
     def __init__(self, tag: str,
                  cache_factory: Callable[[T_KWARGS], AsyncGenerator[Union[T, PixivRepoMetadata], None]],
                  remote_factory: Callable[[T_KWARGS], AsyncGenerator[Union[T, PixivRepoMetadata], None]],
-                 cache_updater: Callable[[T_KWARGS, T, Optional[PixivRepoMetadata]], Awaitable[Any]]):
+                 cache_updater: Callable[[T_KWARGS, T, Optional[PixivRepoMetadata]], Awaitable[Any]],
+                 expires_in: Optional[int] = None):
         self.tag = tag
         self.cache_factory = cache_factory
         self.remote_factory = remote_factory
         self.cache_updater = cache_updater
+        # cache_factory在过期后的一段时间内仍返回缓存（stale-while-revalidate），此时由on_stale在后台刷新
+        self.expires_in = expires_in
 
     async def mediate(self, query_kwargs: T_KWARGS,
-                      *, force_expiration: bool = False) -> AsyncGenerator[Union[T, PixivRepoMetadata], None]:
+                      *, force_expiration: bool = False,
+                      on_stale: Optional[Callable[[], Any]] = None) \
+            -> AsyncGenerator[Union[T, PixivRepoMetadata], None]:
         try:
             if force_expiration:
                 raise NoSuchItemError()
             async for x in self.cache_factory(query_kwargs):
+                if isinstance(x, PixivRepoMetadata):
+                    _check_stale(self.tag, self.expires_in, x, query_kwargs, on_stale)
                 yield x
             logger.info(f"[{self.tag}] cache loaded  ({format_kwargs(**query_kwargs)})")
         except (NoSuchItemError, CacheExpiredError):
@@ -62,18 +83,33 @@ class SingleMediator(Mediator, Generic[T]):
 class ManyMediator(Mediator, Generic[T]):
     def __init__(self, tag: str,
                  cache_factory: Callable[[T_KWARGS], AsyncGenerator[Union[T, PixivRepoMetadata], None]],
-                 remote_factory: Callable[[T_KWARGS], AsyncGenerator[Union[T, PixivRepoMetadata], None]],
+                 remote_factory: Callable[[T_KWARGS, int], AsyncGenerator[Union[T, PixivRepoMetadata], None]],
                  cache_invalidator: Callable[[T_KWARGS], Awaitable[Any]],
-                 cache_appender: Callable[[T_KWARGS, List[T], Optional[PixivRepoMetadata]], Awaitable[Any]]):
+                 cache_appender: Callable[[T_KWARGS, List[T], Optional[PixivRepoMetadata]], Awaitable[Any]],
+                 item_compactor: Optional[Callable[[T], T]] = None,
+                 expires_in: Optional[int] = None,
+                 cache_replacer: Optional[Callable[[T_KWARGS, List[T], PixivRepoMetadata], Awaitable[Any]]] = None,
+                 append_complete_only: bool = False):
         self.tag = tag
         self.cache_factory = cache_factory
+        # 第二个参数为最多加载的页数，远端加载到该页后不再预先加载下一页（但调用方继续读取时仍会加载）
         self.remote_factory = remote_factory
         self.cache_invalidator = cache_invalidator
         self.cache_appender = cache_appender
+        # 以新的列表原子地替换本地缓存（revalidate时使用）
+        self.cache_replacer = cache_replacer
+        # 写入缓存后，在交给调用方前压缩远端获取的条目
+        self.item_compactor = item_compactor
+        # 同SingleMediator.expires_in
+        self.expires_in = expires_in
+        # 只在远端加载完整（到达末尾或max_item）后一次写入缓存，中途停止（如达到max_page）的部分不写入。
+        # 条目在写入缓存后才经item_compactor压缩，此前交给调用方的是完整的条目
+        self.append_complete_only = append_complete_only
 
     async def _load_many_from_local_and_remote_and_append(self, query_kwargs: T_KWARGS,
                                                           max_item: int,
-                                                          max_page: int):
+                                                          max_page: int,
+                                                          on_stale: Optional[Callable[[], Any]] = None):
         loaded_items = 0
         loaded_pages = 0
 
@@ -81,6 +117,8 @@ class ManyMediator(Mediator, Generic[T]):
         metadata = None
         async for x in self.cache_factory(query_kwargs):
             if isinstance(x, PixivRepoMetadata):
+                if metadata is None:
+                    _check_stale(self.tag, self.expires_in, x, query_kwargs, on_stale)
                 metadata = x
                 loaded_pages = metadata.pages
             else:
@@ -98,7 +136,8 @@ class ManyMediator(Mediator, Generic[T]):
             return
 
         # then check metadata["next_qs"] and load from remote
-        if metadata and metadata.next_qs:
+        # append_complete_only时缓存的都是完整的列表（可能因max_item截断而仍有next_qs），不再追加
+        if metadata and metadata.next_qs and not self.append_complete_only:
             async for x in self._load_many_from_remote_and_append(metadata.next_qs,
                                                                   max_item - loaded_items, max_page - loaded_pages,
                                                                   loaded_pages):
@@ -112,39 +151,61 @@ class ManyMediator(Mediator, Generic[T]):
         loaded_pages = 0
 
         buffer = []
-
-        async for item in self.remote_factory(query_kwargs):
-            if isinstance(item, PixivRepoMetadata):
-                item.pages += metadata_page_offset
-                loaded_pages = item.pages
-
-                if len(buffer) > 0:
-                    await self.cache_appender(query_kwargs, buffer, item)
-                    logger.debug(f"[{self.tag}] cache appended  ({format_kwargs(**query_kwargs)})")
-
-                    for x in buffer:
-                        yield x
+        pending = []  # append_complete_only时已加载但还未写入缓存的条目
+
+        async with aclosing(self.remote_factory(query_kwargs, max_page)) as gen:
+            async for item in gen:
+                if isinstance(item, PixivRepoMetadata):
+                    loaded_pages = item.pages
+                    item.pages += metadata_page_offset
+
+                    if self.append_complete_only:
+                        pending.extend(buffer)
+                        # 最后一页的条目可能全部被过滤掉，因此以next_qs而不是buffer判断是否加载完整
+                        if not item.next_qs or loaded_items >= max_item:
+                            await self.cache_appender(query_kwargs, pending, item)
+                            logger.debug(f"[{self.tag}] cache appended  ({format_kwargs(**query_kwargs)})")
+
+                            # 此前各页的条目已原样交给调用方，写入后再（原地）压缩
+                            if self.item_compactor is not None:
+                                for x in pending:
+                                    self.item_compactor(x)
+                            pending.clear()
+
+                        for x in buffer:
+                            yield x
+                    elif len(buffer) > 0:
+                        await self.cache_appender(query_kwargs, buffer, item)
+                        logger.debug(f"[{self.tag}] cache appended  ({format_kwargs(**query_kwargs)})")
+
+                        for x in buffer:
+                            if self.item_compactor is not None:
+                                x = self.item_compactor(x)
+                            yield x
 
                     buffer.clear()
 
-                    # check whether we approach limit
-                    if loaded_items >= max_item or loaded_pages >= max_page:
+                    # check whether we approach limit（开头的pages=0的metadata除外）
+                    if loaded_pages > 0 and (loaded_items >= max_item or loaded_pages >= max_page):
                         return
 
-                yield item
-            else:
-                loaded_items += 1
-                buffer.append(item)
+                    yield item
+                else:
+                    loaded_items += 1
+                    buffer.append(item)
 
     async def mediate(self, query_kwargs: T_KWARGS,
                       *, force_expiration: bool = False,
                       max_item: int = 2 ** 31,
-                      max_page: int = 2 ** 31, ) -> AsyncGenerator[Union[T, PixivRepoMetadata], None]:
+                      max_page: int = 2 ** 31,
+                      on_stale: Optional[Callable[[], Any]] = None) \
+            -> AsyncGenerator[Union[T, PixivRepoMetadata], None]:
         try:
             if force_expiration:
                 raise NoSuchItemError()
 
-            async for x in self._load_many_from_local_and_remote_and_append(query_kwargs, max_item, max_page):
+            async for x in self._load_many_from_local_and_remote_and_append(query_kwargs, max_item, max_page,
+                                                                            on_stale):
                 yield x
         except NoSuchItemError:
             logger.info(f"[{self.tag}] no cache  ({format_kwargs(**query_kwargs)})")
@@ -157,15 +218,44 @@ class ManyMediator(Mediator, Generic[T]):
             async for x in self._load_many_from_remote_and_append(query_kwargs, max_item, max_page):
                 yield x
 
+    async def revalidate(self, query_kwargs: T_KWARGS,
+                         *, max_item: int = 2 ** 31,
+                         max_page: int = 2 ** 31) -> AsyncGenerator[PixivRepoMetadata, None]:
+        """
+        从远端重新加载，全部加载完成后再以cache_replacer替换本地缓存（替换前读到的仍是旧的缓存）
+        """
+        loaded_items = 0
+        buffer = []
+        metadata = None
+
+        async with aclosing(self.remote_factory(query_kwargs, max_page)) as gen:
+            async for x in gen:
+                if isinstance(x, PixivRepoMetadata):
+                    metadata = x
+                    if loaded_items >= max_item or metadata.pages >= max_page:
+                        break
+                else:
+                    loaded_items += 1
+                    buffer.append(x)
+
+        if metadata is None:
+            raise RuntimeError("no metadata")
+
+        await self.cache_replacer(query_kwargs, buffer, metadata)
+        logger.info(f"[{self.tag}] cache revalidated  ({format_kwargs(**query_kwargs)})")
+
+        yield metadata
+
 
 class AppendMediator(ManyMediator):
     def __init__(self, tag: str,
                  cache_factory: Callable[[T_KWARGS], AsyncGenerator[Union[T, PixivRepoMetadata], None]],
-                 remote_factory: Callable[[T_KWARGS], AsyncGenerator[Union[T, PixivRepoMetadata], None]],
+                 remote_factory: Callable[[T_KWARGS, int], AsyncGenerator[Union[T, PixivRepoMetadata], None]],
                  cache_invalidator: Callable[[T_KWARGS], Awaitable[Any]],
                  cache_appender: Callable[[T_KWARGS, List[T], Optional[PixivRepoMetadata]], Awaitable[Any]],
-                 front_cache_appender: Callable[[T_KWARGS, List[T], Optional[PixivRepoMetadata]], Awaitable[bool]]):
-        super().__init__(tag, cache_factory, remote_factory, cache_invalidator, cache_appender)
+                 front_cache_appender: Callable[[T_KWARGS, List[T], Optional[PixivRepoMetadata]], Awaitable[bool]],
+                 item_compactor: Optional[Callable[[T], T]] = None):
+        super().__init__(tag, cache_factory, remote_factory, cache_invalidator, cache_appender, item_compactor)
         self.front_cache_appender = front_cache_appender
 
     async def mediate(self, query_kwargs: Mapping[str, Any],
@@ -201,23 +291,25 @@ class AppendMediator(ManyMediator):
             buffer = []
             metadata = e.metadata
 
-            async for x in self.remote_factory(query_kwargs):
-                if isinstance(x, PixivRepoMetadata):
-                    loaded_pages = x.pages
-                    # we don't use this metadata
-
-                    if len(buffer) > 0:
-                        metadata.update_time = datetime.now(timezone.utc)
-                        if await self.front_cache_appender(query_kwargs, buffer, metadata):
-                            break
-                        buffer = []
-
-                        # check whether we approach limit
-                        if loaded_items >= max_item or loaded_pages >= max_page:
-                            return
-                else:
-                    loaded_items += 1
-                    buffer.append(x)
+            # 通常第一页就能找到已缓存的项，因此不预先加载下一页（需要时仍会继续加载）
+            async with aclosing(self.remote_factory(query_kwargs, 1)) as gen:
+                async for x in gen:
+                    if isinstance(x, PixivRepoMetadata):
+                        loaded_pages = x.pages
+                        # we don't use this metadata
+
+                        if len(buffer) > 0:
+                            metadata.update_time = datetime.now(timezone.utc)
+                            if await self.front_cache_appender(query_kwargs, buffer, metadata):
+                                break
+                            buffer = []
+
+                            # check whether we approach limit
+                            if loaded_items >= max_item or loaded_pages >= max_page:
+                                return
+                    else:
+                        loaded_items += 1
+                        buffer.append(x)
 
             async for x in self._load_many_from_local_and_remote_and_append(query_kwargs, max_item, max_page):
                 yield x
@@ -1,5 +1,7 @@
-from datetime import datetime, timedelta
-from typing import Any, AsyncGenerator, Union
+from asyncio import gather, Semaphore, Task, create_task, CancelledError
+from datetime import datetime, timedelta, timezone, date
+from heapq import heapify, heappop, heappush
+from typing import Any, AsyncGenerator, Union, Sequence, Optional, Callable, Tuple, List, Dict
 
 from frozendict import frozendict
 from nonebot import logger
@@ -12,17 +14,33 @@ from nonebot_plugin_pixivbot.global_context import context
 from nonebot_plugin_pixivbot.model import Illust, User, UserPreview
 from nonebot_plugin_pixivbot.utils.shared_agen import SharedAsyncGeneratorManager
 from .base import PixivRepo
-from .enums import PixivResType, CacheStrategy
+from .compressor import Compressor
+from .enums import PixivResType, CacheStrategy, ImageVariant
+from .errors import NoSuchItemError, CacheExpiredError
 from .lazy_illust import LazyIllust
 from .local_repo import LocalPixivRepo
 from .mediator import SingleMediator, AppendMediator, ManyMediator
 from .models import PixivRepoMetadata
 from .remote_repo import RemotePixivRepo
+from ...utils.coros import aclosing
 from ...utils.format import format_kwargs
+from ...utils.ranking_date import latest_ranking_date, parse_ranking_date
+from ...utils.request_priority import RequestPriority, request_priority
 
 conf = context.require(Config)
 local = context.require(LocalPixivRepo)
 remote = context.require(RemotePixivRepo)
+compressor = context.require(Compressor)
+
+# Pixiv排行榜每页的数量
+_RANKING_PAGE_SIZE = 30
+
+
+def _compact_illust(x: LazyIllust) -> LazyIllust:
+    # 完整的Illust已写入本地缓存，需要时可以再从中取出
+    if conf.pixiv_use_local_cache and conf.pixiv_compact_illust_list:
+        return x.compact()
+    return x
 
 
 class SharedAgenIdentifier(BaseModel):
@@ -43,31 +61,38 @@ class SharedAgenIdentifier(BaseModel):
 class PixivSharedAsyncGeneratorManager(SharedAsyncGeneratorManager[SharedAgenIdentifier, Any]):
     log_tag = "pixiv_shared_agen"
 
+    def __init__(self):
+        super().__init__()
+        self._revalidate_tasks = set()
+
     mediators = {
         "illust_detail": SingleMediator(
             "illust_detail",
             cache_factory=lambda kwargs: local.illust_detail(kwargs["illust_id"]),
             remote_factory=lambda kwargs: remote.illust_detail(**kwargs),
-            cache_updater=lambda kwargs, data, meta: local.update_illust_detail(data, meta)
+            cache_updater=lambda kwargs, data, meta: local.update_illust_detail(data, meta),
+            expires_in=conf.pixiv_illust_detail_cache_expires_in,
         ),
         "user_detail": SingleMediator(
             "user_detail",
             cache_factory=lambda kwargs: local.user_detail(kwargs["user_id"]),
             remote_factory=lambda kwargs: remote.user_detail(**kwargs),
-            cache_updater=lambda kwargs, data, meta: local.update_user_detail(data, meta)
+            cache_updater=lambda kwargs, data, meta: local.update_user_detail(data, meta),
+            expires_in=conf.pixiv_user_detail_cache_expires_in,
         ),
         "search_illust": AppendMediator(
             "search_illust",
             cache_factory=lambda kwargs: local.search_illust(kwargs["word"]),
-            remote_factory=lambda kwargs: remote.search_illust(**kwargs),
+            remote_factory=lambda kwargs, max_page: remote.search_illust(max_page=max_page, **kwargs),
             cache_invalidator=lambda kwargs: local.invalidate_search_illust(kwargs["word"]),
             cache_appender=lambda kwargs, data, meta: local.append_search_illust(kwargs["word"], data, meta),
             front_cache_appender=lambda kwargs, data, meta: local.append_search_illust(kwargs["word"], data, meta),
+            item_compactor=_compact_illust,
         ),
         "search_user": AppendMediator(
             "search_user",
             cache_factory=lambda kwargs: local.search_user(kwargs["word"]),
-            remote_factory=lambda kwargs: remote.search_user(**kwargs),
+            remote_factory=lambda kwargs, max_page: remote.search_user(max_page=max_page, **kwargs),
             cache_invalidator=lambda kwargs: local.invalidate_search_user(kwargs["word"]),
             cache_appender=lambda kwargs, data, meta: local.append_search_user(kwargs["word"], data, meta),
             front_cache_appender=lambda kwargs, data, meta: local.append_search_user(kwargs["word"], data, meta),
@@ -75,62 +100,126 @@ class PixivSharedAsyncGeneratorManager(SharedAsyncGeneratorManager[SharedAgenIde
         "user_illusts": AppendMediator(
             "user_illusts",
             cache_factory=lambda kwargs: local.user_illusts(kwargs["user_id"]),
-            remote_factory=lambda kwargs: remote.user_illusts(**kwargs),
+            remote_factory=lambda kwargs, max_page: remote.user_illusts(max_page=max_page, **kwargs),
             cache_invalidator=lambda kwargs: local.invalidate_user_illusts(kwargs["user_id"]),
             cache_appender=lambda kwargs, data, meta: local.append_user_illusts(kwargs["user_id"], data, meta),
             front_cache_appender=lambda kwargs, data, meta: local.append_user_illusts(kwargs["user_id"], data, meta,
                                                                                       append_at_begin=True),
+            item_compactor=_compact_illust,
         ),
         "user_bookmarks": AppendMediator(
             "user_bookmarks",
             cache_factory=lambda kwargs: local.user_bookmarks(kwargs["user_id"]),
-            remote_factory=lambda kwargs: remote.user_bookmarks(**kwargs),
+            remote_factory=lambda kwargs, max_page: remote.user_bookmarks(max_page=max_page, **kwargs),
             cache_invalidator=lambda kwargs: local.invalidate_user_bookmarks(kwargs["user_id"]),
             cache_appender=lambda kwargs, data, meta: local.append_user_bookmarks(kwargs["user_id"], data, meta),
             front_cache_appender=lambda kwargs, data, meta: local.append_user_bookmarks(kwargs["user_id"], data, meta,
                                                                                         append_at_begin=True),
+            item_compactor=_compact_illust,
         ),
         "recommended_illusts": ManyMediator(
             "recommended_illusts",
             cache_factory=lambda kwargs: local.recommended_illusts(),
-            remote_factory=lambda kwargs: remote.recommended_illusts(**kwargs),
+            remote_factory=lambda kwargs, max_page: remote.recommended_illusts(max_page=max_page, **kwargs),
             cache_invalidator=lambda kwargs: local.invalidate_recommended_illusts(),
             cache_appender=lambda kwargs, data, meta: local.append_recommended_illusts(data, meta),
+            item_compactor=_compact_illust,
+            expires_in=conf.pixiv_other_cache_expires_in,
+            cache_replacer=lambda kwargs, data, meta: local.replace_recommended_illusts(data, meta),
         ),
         "related_illusts": ManyMediator(
             "related_illusts",
             cache_factory=lambda kwargs: local.related_illusts(kwargs["illust_id"]),
-            remote_factory=lambda kwargs: remote.related_illusts(**kwargs),
+            remote_factory=lambda kwargs, max_page: remote.related_illusts(max_page=max_page, **kwargs),
             cache_invalidator=lambda kwargs: local.invalidate_related_illusts(kwargs["illust_id"]),
             cache_appender=lambda kwargs, data, meta: local.append_related_illusts(kwargs["illust_id"], data, meta),
+            item_compactor=_compact_illust,
+            expires_in=conf.pixiv_related_illusts_cache_expires_in,
+            cache_replacer=lambda kwargs, data, meta: local.replace_related_illusts(kwargs["illust_id"], data, meta),
         ),
         "illust_ranking": ManyMediator(
             "illust_ranking",
-            cache_factory=lambda kwargs: local.illust_ranking(kwargs["mode"]),
-            remote_factory=lambda kwargs: remote.illust_ranking(**kwargs),
-            cache_invalidator=lambda kwargs: local.invalidate_illust_ranking(kwargs["mode"]),
-            cache_appender=lambda kwargs, data, meta: local.append_illust_ranking(kwargs["mode"], data, meta),
+            cache_factory=lambda kwargs: local.illust_ranking(kwargs["mode"], kwargs["date"]),
+            remote_factory=lambda kwargs, max_page: remote.illust_ranking(max_page=max_page, **kwargs),
+            cache_invalidator=lambda kwargs: local.invalidate_illust_ranking(kwargs["mode"], kwargs["date"]),
+            cache_appender=lambda kwargs, data, meta: local.append_illust_ranking(kwargs["mode"], kwargs["date"],
+                                                                                  data, meta),
+            item_compactor=_compact_illust,
+            # 榜单缓存后不再更新，只缓存完整的榜单
+            append_complete_only=True,
         ),
         "image": SingleMediator(
             "image",
-            cache_factory=lambda kwargs: local.image(kwargs["illust"], kwargs["page"]),
-            remote_factory=lambda kwargs: remote.image(**kwargs),
-            cache_updater=lambda kwargs, data, meta: local.update_image(kwargs["illust"].id, kwargs["page"], data, meta)
+            cache_factory=lambda kwargs: local.image(kwargs["illust"], kwargs["page"],
+                                                     compressor.variant_key(kwargs["variant"])),
+            remote_factory=lambda kwargs: PixivSharedAsyncGeneratorManager._remote_image(**kwargs),
+            cache_updater=lambda kwargs, data, meta: local.update_image(kwargs["illust"].id, kwargs["page"],
+                                                                        data, meta,
+                                                                        compressor.variant_key(kwargs["variant"]))
         ),
     }
 
+    @staticmethod
+    async def _remote_image(illust: Illust, page: int, variant: ImageVariant) \
+            -> AsyncGenerator[Union[bytes, PixivRepoMetadata], None]:
+        if not conf.pixiv_download_cache_original \
+                or compressor.variant_key(variant) == compressor.variant_key(ImageVariant.original):
+            async for x in remote.image(illust, page, variant):
+                yield x
+            return
+
+        # 由（经过缓存的）原图生成其他变体，同一张图的多个变体只需下载一次
+        original = None
+        async for x in context.require(MediatorPixivRepo).image(illust, page, ImageVariant.original):
+            original = x
+
+        if original is None:
+            raise NoSuchItemError()
+
+        yield PixivRepoMetadata()
+        yield await compressor.compress(original, variant)
+
+    def _revalidator(self, type: PixivResType, **kwargs) -> Callable[[], None]:
+        def on_stale():
+            # 后台刷新不应与触发它的用户指令抢占配额
+            with request_priority(RequestPriority.background):
+                task = create_task(self._revalidate(SharedAgenIdentifier(type, revalidate=True, **kwargs),
+                                                    SharedAgenIdentifier(type, **kwargs)))
+            self._revalidate_tasks.add(task)
+            task.add_done_callback(self._revalidate_tasks.discard)
+
+        return on_stale
+
+    async def _revalidate(self, revalidate_identifier: SharedAgenIdentifier, identifier: SharedAgenIdentifier):
+        # 同一资源的刷新共享同一个agen（刷新完成后直到过期前也会复用），因此只会向远端请求一次
+        try:
+            async with self.get(revalidate_identifier) as gen:
+                async for _ in gen:
+                    pass
+        except Exception as e:
+            logger.opt(exception=e).warning(f"[{self.log_tag}] {identifier} revalidation failed")
+            return
+
+        # 新数据已写入本地缓存，不再复用旧的agen
+        if self.is_cached(identifier):
+            await self.invalidate(identifier)
+
     def illust_detail_factory(self, illust_id: int,
-                              cache_strategy: CacheStrategy) -> AsyncGenerator[Illust, None]:
+                              cache_strategy: CacheStrategy,
+                              revalidate: bool = False) -> AsyncGenerator[Illust, None]:
         return self.mediators["illust_detail"].mediate(
             {"illust_id": illust_id},
-            force_expiration=cache_strategy == CacheStrategy.FORCE_EXPIRATION,
+            force_expiration=revalidate or cache_strategy == CacheStrategy.FORCE_EXPIRATION,
+            on_stale=self._revalidator(PixivResType.ILLUST_DETAIL, illust_id=illust_id),
         )
 
     def user_detail_factory(self, user_id: int,
-                            cache_strategy: CacheStrategy) -> AsyncGenerator[User, None]:
+                            cache_strategy: CacheStrategy,
+                            revalidate: bool = False) -> AsyncGenerator[User, None]:
         return self.mediators["user_detail"].mediate(
             query_kwargs={"user_id": user_id},
-            force_expiration=cache_strategy == CacheStrategy.FORCE_EXPIRATION,
+            force_expiration=revalidate or cache_strategy == CacheStrategy.FORCE_EXPIRATION,
+            on_stale=self._revalidator(PixivResType.USER_DETAIL, user_id=user_id),
         )
 
     def search_illust_factory(self, word: str,
@@ -168,35 +257,60 @@ class PixivSharedAsyncGeneratorManager(SharedAsyncGeneratorManager[SharedAgenIde
             force_expiration=cache_strategy == CacheStrategy.FORCE_EXPIRATION,
         )
 
-    def recommended_illusts_factory(self, cache_strategy: CacheStrategy) -> AsyncGenerator[LazyIllust, None]:
+    def recommended_illusts_factory(self, cache_strategy: CacheStrategy,
+                                    revalidate: bool = False) -> AsyncGenerator[LazyIllust, None]:
+        if revalidate:
+            return self.mediators["recommended_illusts"].revalidate(
+                query_kwargs={},
+                max_item=conf.pixiv_random_recommended_illust_max_item,
+                max_page=conf.pixiv_random_recommended_illust_max_page,
+            )
+
         return self.mediators["recommended_illusts"].mediate(
             query_kwargs={},
             max_item=conf.pixiv_random_recommended_illust_max_item,
             max_page=conf.pixiv_random_recommended_illust_max_page,
             force_expiration=cache_strategy == CacheStrategy.FORCE_EXPIRATION,
+            on_stale=self._revalidator(PixivResType.RECOMMENDED_ILLUSTS),
         )
 
     def related_illusts_factory(self, illust_id: int,
-                                cache_strategy: CacheStrategy) -> AsyncGenerator[LazyIllust, None]:
+                                cache_strategy: CacheStrategy,
+                                revalidate: bool = False) -> AsyncGenerator[LazyIllust, None]:
+        if revalidate:
+            return self.mediators["related_illusts"].revalidate(
+                query_kwargs={"illust_id": illust_id},
+                max_item=conf.pixiv_random_related_illust_max_item,
+                max_page=conf.pixiv_random_related_illust_max_page,
+            )
+
         return self.mediators["related_illusts"].mediate(
             query_kwargs={"illust_id": illust_id},
             max_item=conf.pixiv_random_related_illust_max_item,
             max_page=conf.pixiv_random_related_illust_max_page,
             force_expiration=cache_strategy == CacheStrategy.FORCE_EXPIRATION,
+            on_stale=self._revalidator(PixivResType.RELATED_ILLUSTS, illust_id=illust_id),
         )
 
-    def illust_ranking_factory(self, mode: RankingMode,
-                               cache_strategy: CacheStrategy) -> AsyncGenerator[LazyIllust, None]:
+    def illust_ranking_factory(self, mode: RankingMode, date: str,
+                               cache_strategy: CacheStrategy,
+                               max_page: Optional[int] = None) -> AsyncGenerator[LazyIllust, None]:
+        # 已发布的榜单不会改变，不需要在后台刷新
+        # max_page不为None时只加载排行榜的前max_page页（见MediatorPixivRepo.illust_ranking_range），不写入本地缓存
+        if parse_ranking_date(date) > latest_ranking_date(conf.pixiv_ranking_rollover_time):
+            # 还未发布的榜单不写入本地缓存
+            return remote.illust_ranking(mode, date, max_page=max_page)
         return self.mediators["illust_ranking"].mediate(
-            query_kwargs={"mode": mode},
+            query_kwargs={"mode": mode, "date": date},
             max_item=conf.pixiv_ranking_fetch_item,
+            max_page=max_page or 2 ** 31,
             force_expiration=cache_strategy == CacheStrategy.FORCE_EXPIRATION,
         )
 
-    def image_factory(self, illust_id: int, illust: Illust, page: int,
+    def image_factory(self, illust_id: int, illust: Illust, page: int, variant: ImageVariant,
                       cache_strategy: CacheStrategy) -> AsyncGenerator[bytes, None]:
         return self.mediators["image"].mediate(
-            query_kwargs={"illust": illust, "page": page},
+            query_kwargs={"illust": illust, "page": page, "variant": variant},
             force_expiration=cache_strategy == CacheStrategy.FORCE_EXPIRATION,
         )
 
@@ -231,10 +345,42 @@ class PixivSharedAsyncGeneratorManager(SharedAsyncGeneratorManager[SharedAgenIde
         PixivResType.USER_BOOKMARKS: timedelta(seconds=context.require(Config).pixiv_user_bookmarks_cache_expires_in),
         PixivResType.RECOMMENDED_ILLUSTS: timedelta(seconds=context.require(Config).pixiv_other_cache_expires_in),
         PixivResType.RELATED_ILLUSTS: timedelta(seconds=context.require(Config).pixiv_related_illusts_cache_expires_in),
-        PixivResType.ILLUST_RANKING: timedelta(seconds=context.require(Config).pixiv_illust_ranking_cache_expires_in),
+        # 榜单快照不会改变，内存中保留一天（之后仍从本地缓存读取）
+        PixivResType.ILLUST_RANKING: timedelta(days=1),
         PixivResType.IMAGE: timedelta(seconds=context.require(Config).pixiv_download_cache_expires_in),
     }
 
+    # 图片的数据量远大于其他类型，按字节数单独限制
+    memory_budgets = {
+        PixivResType.IMAGE: context.require(Config).pixiv_image_memory_budget,
+    }
+
+    def budget_key(self, identifier: SharedAgenIdentifier) -> Optional[PixivResType]:
+        return identifier.type if identifier.type in self.memory_budgets else None
+
+    # 元素数量可能很多的列表类型
+    _list_types = frozenset({
+        PixivResType.SEARCH_ILLUST,
+        PixivResType.SEARCH_USER,
+        PixivResType.USER_ILLUSTS,
+        PixivResType.USER_BOOKMARKS,
+        PixivResType.RECOMMENDED_ILLUSTS,
+        PixivResType.RELATED_ILLUSTS,
+        PixivResType.ILLUST_RANKING,
+    })
+
+    def bounded(self, identifier: SharedAgenIdentifier) -> bool:
+        return conf.pixiv_bounded_replay_buffer and identifier.type in self._list_types
+
+    def snapshot_item(self, identifier: SharedAgenIdentifier, item: Any) -> Any:
+        # 完整的Illust已写入本地缓存，快照中只保留IllustSummary
+        # 只加载了前几页的榜单不写入本地缓存（见ManyMediator.append_complete_only），保留完整的Illust
+        if identifier.type == PixivResType.ILLUST_RANKING and "max_page" in identifier.kwargs:
+            return item
+        if isinstance(item, LazyIllust) and conf.pixiv_use_local_cache and conf.pixiv_compact_illust_list:
+            return item.compacted()
+        return item
+
     def calc_expires_time(self, identifier: SharedAgenIdentifier, update_time: datetime) -> datetime:
         if identifier.type in self.factories:
             return update_time + self.expires_in[identifier.type]
@@ -245,7 +391,9 @@ class PixivSharedAsyncGeneratorManager(SharedAsyncGeneratorManager[SharedAgenIde
         await super().on_agen_next(identifier, item)
         if isinstance(item, PixivRepoMetadata) and not self.get_expires_time(identifier):
             expires_time = self.calc_expires_time(identifier, item.update_time)
-            await self.set_expires_time(identifier, expires_time.timestamp())
+            # 过期（stale-while-revalidate期间）的缓存不再复用，也不能在读取途中invalidate
+            if expires_time > datetime.now(timezone.utc):
+                await self.set_expires_time(identifier, expires_time.timestamp())
 
 
 @context.root.register_singleton()
@@ -272,6 +420,54 @@ class MediatorPixivRepo(PixivRepo):
         if data is not None:
             yield data
 
+    async def _illust_detail_or_none(self, illust_id: int,
+                                     cache_strategy: CacheStrategy) -> Optional[Illust]:
+        async for x in self.illust_detail(illust_id, cache_strategy):
+            return x
+        return None
+
+    async def illust_details(self, illust_ids: Sequence[int],
+                             cache_strategy: CacheStrategy = CacheStrategy.NORMAL,
+                             errors: Optional[Dict[int, Exception]] = None) -> AsyncGenerator[Illust, None]:
+        """
+        批量获取插画详情：先用一次查询从本地缓存取出命中项，再并发地从远端获取未命中项
+        （未命中项仍经过shared_agen_mgr，与同时进行的illust_detail共享）。返回顺序不定。
+
+        :param errors: 若传入，获取某一项时发生的异常按illust_id记录在其中，不再抛出；
+                       否则在返回所有成功项后抛出第一个异常
+        """
+        logger.debug(f"[mediator] illust_details ({len(illust_ids)} items) "
+                     f"cache_strategy={cache_strategy.name}")
+
+        missed = list(illust_ids)
+        if cache_strategy == CacheStrategy.NORMAL:
+            hit = set()
+            async for x in local.illust_details(missed):
+                if not isinstance(x, PixivRepoMetadata):
+                    hit.add(x.id)
+                    yield x
+            missed = [x for x in missed if x not in hit]
+
+        if len(missed) == 0:
+            return
+
+        logger.info(f"[mediator] illust_details: {len(illust_ids) - len(missed)} hit, {len(missed)} missed")
+        results = await gather(*[self._illust_detail_or_none(x, cache_strategy) for x in missed],
+                               return_exceptions=True)
+
+        err = None
+        for illust_id, x in zip(missed, results):
+            if isinstance(x, BaseException):
+                if errors is not None and isinstance(x, Exception):
+                    errors[illust_id] = x
+                else:
+                    err = err or x
+            elif x is not None:
+                yield x
+
+        if err is not None:
+            raise err
+
     async def user_detail(self, user_id: int,
                           cache_strategy: CacheStrategy = CacheStrategy.NORMAL) -> AsyncGenerator[User, None]:
         logger.debug(f"[mediator] user_detail {user_id} "
@@ -308,23 +504,33 @@ class MediatorPixivRepo(PixivRepo):
                     yield x
 
     async def user_bookmarks(self, user_id: int = 0,
-                             cache_strategy: CacheStrategy = CacheStrategy.NORMAL) -> AsyncGenerator[LazyIllust, None]:
+                             cache_strategy: CacheStrategy = CacheStrategy.NORMAL,
+                             *, with_metadata: bool = False) \
+            -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
+        """
+        :param with_metadata: 是否产出PixivRepoMetadata（其pages为已产出的页数，用于按页计数）
+        """
         logger.debug(f"[mediator] user_bookmarks {user_id} "
                      f"cache_strategy={cache_strategy.name}")
         async with self.shared_agen_mgr.get(SharedAgenIdentifier(PixivResType.USER_BOOKMARKS, user_id=user_id),
                                             cache_strategy) as gen:
             async for x in gen:
-                if not isinstance(x, PixivRepoMetadata):
+                if with_metadata or not isinstance(x, PixivRepoMetadata):
                     yield x
 
     async def user_illusts(self, user_id: int = 0,
-                           cache_strategy: CacheStrategy = CacheStrategy.NORMAL) -> AsyncGenerator[LazyIllust, None]:
+                           cache_strategy: CacheStrategy = CacheStrategy.NORMAL,
+                           *, with_metadata: bool = False) \
+            -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
+        """
+        :param with_metadata: 是否产出PixivRepoMetadata（其pages为已产出的页数，用于按页计数）
+        """
         logger.debug(f"[mediator] user_illusts {user_id} "
                      f"cache_strategy={cache_strategy.name}")
         async with self.shared_agen_mgr.get(SharedAgenIdentifier(PixivResType.USER_ILLUSTS, user_id=user_id),
                                             cache_strategy) as gen:
             async for x in gen:
-                if not isinstance(x, PixivRepoMetadata):
+                if with_metadata or not isinstance(x, PixivRepoMetadata):
                     yield x
 
     async def _contact_user_illusts_with_preview(self, user_preview: UserPreview,
@@ -336,48 +542,73 @@ class MediatorPixivRepo(PixivRepo):
         ids = {x.id for x in user_preview.illusts}
 
         if len(user_preview.illusts) >= 3:
-            gen = self.user_illusts(user_preview.user.id, cache_strategy)
-
-            async for x in gen:
-                if x.id not in ids:
-                    yield x
+            async with aclosing(self.user_illusts(user_preview.user.id, cache_strategy)) as gen:
+                async for x in gen:
+                    if x.id not in ids:
+                        yield x
 
     async def user_following_illusts(self, user_id: int,
-                                     cache_strategy: CacheStrategy = CacheStrategy.NORMAL) \
+                                     cache_strategy: CacheStrategy = CacheStrategy.NORMAL,
+                                     checkpoint: Optional[datetime] = None) \
             -> AsyncGenerator[LazyIllust, None]:
-        logger.debug(f"[mediator] user_following_illusts {user_id} "
-                     f"cache_strategy={cache_strategy.name}")
+        """
+        按发布时间从新到旧合并所有关注画师的插画
 
-        n = 0
-        gen = []
-        peeked = []
+        :param checkpoint: 只获取在该时间之后发布的插画，预览中没有更新的插画的画师不会被查询
+        """
+        logger.debug(f"[mediator] user_following_illusts {user_id} "
+                     f"cache_strategy={cache_strategy.name} checkpoint={checkpoint}")
 
+        gens = []
         async for user_preview in remote.user_following_with_preview(user_id):
-            if not isinstance(user_preview, PixivRepoMetadata):
-                n += 1
-                gen.append(self._contact_user_illusts_with_preview(user_preview, cache_strategy))
-                peeked.append(None)
-
+            if isinstance(user_preview, PixivRepoMetadata):
+                continue
+            if checkpoint is not None and \
+                    all(x.create_date <= checkpoint for x in user_preview.illusts):
+                continue
+            gens.append(self._contact_user_illusts_with_preview(user_preview, cache_strategy))
+
+        sema = Semaphore(conf.pixiv_following_merge_concurrency)
+
+        async def advance(i: int) -> Optional[LazyIllust]:
+            # 预览中的插画不需要请求，只有进入user_illusts后才会占用并发数
+            async with sema:
+                try:
+                    return await gens[i].__anext__()
+                except StopAsyncIteration:
+                    return None
+
+        # 堆中元素为(-发布时间, 画师下标, 插画)，堆顶即为所有画师中最新的插画
+        heap = []
+        for i, x in enumerate(await gather(*[advance(i) for i in range(len(gens))])):
+            if x is not None:
+                heap.append((-x.create_date.timestamp(), i, x))
+        heapify(heap)
+
+        prefetching: Optional[Task] = None
         try:
-            while True:
-                select = -1
-                for i in range(n):
-                    try:
-                        if not peeked[i]:
-                            peeked[i] = await gen[i].__anext__()
-
-                        if select == -1 or peeked[i].create_date > peeked[select].create_date:
-                            select = i
-                    except StopAsyncIteration:
-                        pass
-
-                if select == -1:
+            while len(heap) > 0:
+                _, i, x = heappop(heap)
+                if checkpoint is not None and x.create_date <= checkpoint:
                     break
 
-                yield peeked[select]
-                peeked[select] = None
-        except GeneratorExit:
-            for gen in gen:
+                # 在调用方处理当前插画时预取该画师的下一张插画
+                prefetching = create_task(advance(i))
+                yield x
+
+                nxt = await prefetching
+                prefetching = None
+                if nxt is not None:
+                    heappush(heap, (-nxt.create_date.timestamp(), i, nxt))
+        finally:
+            if prefetching is not None:
+                # 等待预取结束后再关闭，否则关闭正在运行的agen会抛出RuntimeError
+                prefetching.cancel()
+                try:
+                    await prefetching
+                except CancelledError:
+                    pass
+            for gen in gens:
                 await gen.aclose()
 
     async def recommended_illusts(self, cache_strategy: CacheStrategy = CacheStrategy.NORMAL) \
@@ -400,24 +631,107 @@ class MediatorPixivRepo(PixivRepo):
                 if not isinstance(x, PixivRepoMetadata):
                     yield x
 
+    @staticmethod
+    def _ranking_date(d: Union[date, str, None]) -> str:
+        # 为None时取已发布的最新一期
+        if d is None:
+            d = latest_ranking_date(conf.pixiv_ranking_rollover_time)
+        if isinstance(d, date):
+            d = d.isoformat()
+        return d
+
     async def illust_ranking(self, mode: Union[str, RankingMode],
+                             date: Union[date, str, None] = None,
                              cache_strategy: CacheStrategy = CacheStrategy.NORMAL) -> AsyncGenerator[LazyIllust, None]:
+        """
+        :param mode: 榜单类型
+        :param date: 榜单日期，为None时取已发布的最新一期
+        """
         if isinstance(mode, str):
             mode = RankingMode[mode]
+        date = self._ranking_date(date)
 
-        logger.debug(f"[mediator] illust_ranking {mode} "
+        logger.debug(f"[mediator] illust_ranking {mode} {date} "
                      f"cache_strategy={cache_strategy.name}")
-        async with self.shared_agen_mgr.get(SharedAgenIdentifier(PixivResType.ILLUST_RANKING, mode=mode),
+        async with self.shared_agen_mgr.get(SharedAgenIdentifier(PixivResType.ILLUST_RANKING, mode=mode, date=date),
                                             cache_strategy) as gen:
             async for x in gen:
                 if not isinstance(x, PixivRepoMetadata):
                     yield x
 
-    async def image(self, illust: Illust, page: int = 0,
+    @staticmethod
+    async def _local_illust_ranking_range(mode: RankingMode, date: str, range: Tuple[int, int]) \
+            -> Optional[List[LazyIllust]]:
+        # 直接从本地缓存取出排行榜的一段，没有本地缓存时返回None。
+        # 本地缓存的排行榜都是完整的（见ManyMediator.append_complete_only），过滤后不足这一段时只返回已有的部分
+        start, end = range
+        illusts = []
+        try:
+            async for x in local.illust_ranking(mode, date, offset=start - 1, limit=end - start + 1):
+                if not isinstance(x, PixivRepoMetadata):
+                    illusts.append(x)
+        except (NoSuchItemError, CacheExpiredError):
+            return None
+        return illusts
+
+    async def illust_ranking_range(self, mode: Union[str, RankingMode], range: Tuple[int, int],
+                                   date: Union[date, str, None] = None,
+                                   cache_strategy: CacheStrategy = CacheStrategy.NORMAL) \
+            -> AsyncGenerator[LazyIllust, None]:
+        """
+        按排名获取排行榜的一段：内存中已有排行榜时从中取出，本地缓存包含这一段时直接取出这一段，
+        否则只从远端加载到这一段所在的页为止
+
+        :param mode: 排行榜类型
+        :param range: 排名区间，下标从1开始，闭区间
+        :param date: 榜单日期，为None时取已发布的最新一期
+        """
+        if isinstance(mode, str):
+            mode = RankingMode[mode]
+        date = self._ranking_date(date)
+
+        start, end = range[0], min(range[1], conf.pixiv_ranking_fetch_item)
+        logger.debug(f"[mediator] illust_ranking_range {mode} {date} {start}-{end} "
+                     f"cache_strategy={cache_strategy.name}")
+        if start > end:
+            return
+
+        identifier = SharedAgenIdentifier(PixivResType.ILLUST_RANKING, mode=mode, date=date)
+        pages = (end - 1) // _RANKING_PAGE_SIZE + 1
+        if pages * _RANKING_PAGE_SIZE < conf.pixiv_ranking_fetch_item:
+            partial_identifier = SharedAgenIdentifier(PixivResType.ILLUST_RANKING, mode=mode, date=date,
+                                                      max_page=pages)
+        else:
+            partial_identifier = identifier
+
+        if cache_strategy == CacheStrategy.NORMAL:
+            if self.shared_agen_mgr.is_cached(identifier):
+                partial_identifier = identifier
+            elif not self.shared_agen_mgr.is_cached(partial_identifier):
+                illusts = await self._local_illust_ranking_range(mode, date, (start, end))
+                if illusts is not None:
+                    for x in illusts:
+                        yield x
+                    return
+
+        async with self.shared_agen_mgr.get(partial_identifier, cache_strategy) as gen:
+            rank = 0
+            async for x in gen:
+                if isinstance(x, PixivRepoMetadata):
+                    continue
+
+                rank += 1
+                if rank >= start:
+                    yield x
+                if rank >= end:
+                    break
+
+    async def image(self, illust: Illust, page: int = 0, variant: ImageVariant = ImageVariant.large,
                     cache_strategy: CacheStrategy = CacheStrategy.NORMAL) -> AsyncGenerator[bytes, None]:
-        logger.debug(f"[mediator] image {illust.id}[{page}] "
+        logger.debug(f"[mediator] image {illust.id}[{page}] {variant.name} "
                      f"cache_strategy={cache_strategy.name}")
-        async with self.shared_agen_mgr.get(SharedAgenIdentifier(PixivResType.IMAGE, illust_id=illust.id, page=page),
+        async with self.shared_agen_mgr.get(SharedAgenIdentifier(PixivResType.IMAGE, illust_id=illust.id, page=page,
+                                                                 variant=variant),
                                             cache_strategy, illust=illust) as gen:
             data = None
             async for x in gen:
@@ -9,11 +9,18 @@ class PixivRepoMetadata(BaseModel):
     pages: Optional[int] = None
     next_qs: Optional[dict] = None
 
-    def check_is_expired(self, expires_in: int) -> "PixivRepoMetadata":
-        if datetime.now(timezone.utc) - self.update_time >= timedelta(seconds=expires_in):
+    def check_is_expired(self, expires_in: Optional[int]) -> "PixivRepoMetadata":
+        # expires_in为None表示永不过期
+        if expires_in is not None and datetime.now(timezone.utc) - self.update_time >= timedelta(seconds=expires_in):
             from .errors import CacheExpiredError
             raise CacheExpiredError(self)
         return self
 
+    def is_stale(self, expires_in: int) -> bool:
+        """
+        已过期但仍在stale-while-revalidate时间窗口内的缓存（本地缓存读取时按过期时间+窗口检查）
+        """
+        return datetime.now(timezone.utc) - self.update_time >= timedelta(seconds=expires_in)
+
 
 __all__ = ("PixivRepoMetadata",)
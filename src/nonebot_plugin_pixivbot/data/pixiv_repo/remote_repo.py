@@ -1,24 +1,25 @@
-import asyncio
-from asyncio import sleep, create_task, CancelledError, Semaphore, Task
-from contextlib import asynccontextmanager
-from datetime import datetime, timedelta
-from io import BytesIO
-from typing import TypeVar, Optional, Awaitable, List, Callable, Tuple, AsyncGenerator, Union
+from asyncio import Task, create_task
+from typing import TypeVar, Optional, Awaitable, List, Callable, Tuple, AsyncGenerator, Union, AsyncContextManager, \
+    Dict, Any
 
 import aiohttp
 from cachetools.func import rr_cache
 from nonebot import logger
 from pixivpy_async import *
-from pixivpy_async.error import TokenError
 
 from nonebot_plugin_pixivbot.config import Config
 from nonebot_plugin_pixivbot.enums import RankingMode
 from nonebot_plugin_pixivbot.global_context import context
 from nonebot_plugin_pixivbot.model import Illust, User, UserPreview
+from nonebot_plugin_pixivbot.model.tag_index import tag_index
+from nonebot_plugin_pixivbot.utils.coros import aclosing
 from nonebot_plugin_pixivbot.utils.errors import QueryError, RateLimitError
 from nonebot_plugin_pixivbot.utils.lifecycler import on_startup, on_shutdown
+from nonebot_plugin_pixivbot.utils.rate_limiter import ConcurrencyLimiter
+from .account_pool import PixivAccount, PixivAccountPool
 from .base import PixivRepo
 from .compressor import Compressor
+from .enums import ImageVariant
 from .lazy_illust import LazyIllust
 from .models import PixivRepoMetadata
 
@@ -27,88 +28,61 @@ _compressor = context.require(Compressor)
 
 T = TypeVar("T")
 
+_IMAGE_REFERER = "https://app-api.pixiv.net/"
+_IMAGE_CHUNK_SIZE = 64 * 1024
+
 
 @context.register_eager_singleton()
 class RemotePixivRepo(PixivRepo):
 
     # noinspection PyTypeChecker
     def __init__(self):
-        self._sema: Semaphore = None
         self._pclient: PixivClient = None
-        self._papi: AppPixivAPI = None
-        self._refresh_daemon: Task = None
-
-        self._got_rate_limit: Optional[datetime] = None
+        self._session: aiohttp.ClientSession = None
+        self.pool: PixivAccountPool = None
 
-        self.user_id = 0
+        # 下载图片使用独立的连接池与并发限制，避免大图下载占满API查询的配额
+        self._download_pclient: PixivClient = None
+        self._download_session: aiohttp.ClientSession = None
+        self.download_limiter: ConcurrencyLimiter = None
 
         on_startup(replay=True)(self.start)
         on_shutdown()(self.shutdown)
 
-    async def _refresh(self):
-        # Latest app version can be found using GET /old/application-info/android
-        USER_AGENT = "PixivAndroidApp/5.0.234 (Android 11; Pixel 5)"
-        # REDIRECT_URI = "https://app-api.pixiv.net/web/v1/users/auth/pixiv/callback"
-        # LOGIN_URL = "https://app-api.pixiv.net/web/v1/login"
-        AUTH_TOKEN_URL = "https://oauth.secure.pixiv.net/auth/token"
-        CLIENT_ID = "MOBrBDS8blbauoSck0ZfDbtuzpyT"
-        CLIENT_SECRET = "lsACyCD94FhDUtGTXi3QzcFE2uU1hqtDaKeqrdwj"
-
-        refresh_token = _conf.pixiv_refresh_token
-
-        data = {
-            "client_id": CLIENT_ID,
-            "client_secret": CLIENT_SECRET,
-            "grant_type": "refresh_token",
-            "include_policy": "true",
-            "refresh_token": refresh_token,
+    @property
+    def user_id(self) -> int:
+        # 主账号的user_id
+        return self.pool.primary.user_id if self.pool is not None else 0
+
+    @property
+    def metrics(self) -> Dict[str, Any]:
+        """
+        各个池的指标：api为每个账号的限流器指标，download为下载池的指标
+        """
+        return {
+            "api": {repr(x): x.rate_limiter.metrics for x in self.pool.accounts},
+            "download": self.download_limiter.metrics
         }
-        result = await self._papi.requests_(method="POST", url=AUTH_TOKEN_URL, data=data,
-                                            headers={"User-Agent": USER_AGENT},
-                                            auth=False)
-        if result.has_error:
-            raise TokenError(None, result)
-        else:
-            self._papi.set_auth(result.access_token, result.refresh_token)
-            self.user_id = result["user"]["id"]
-
-            logger.success(
-                f"refresh access token successfully. new token expires in {result.expires_in} seconds.")
-            logger.debug(f"access_token: {result.access_token}")
-            logger.debug(f"refresh_token: {result.refresh_token}")
-
-            # maybe the refresh token will be changed (even thought i haven't seen it yet)
-            if result.refresh_token != refresh_token:
-                refresh_token = result.refresh_token
-                logger.warning(
-                    f"refresh token has been changed: {result.refresh_token}")
-
-            return result
-
-    async def _refresh_daemon_worker(self):
-        while True:
-            try:
-                result = await self._refresh()
-                await sleep(result.expires_in * 0.8)
-            except CancelledError as e:
-                raise e
-            except (ConnectionError, aiohttp.ServerConnectionError, asyncio.TimeoutError):
-                logger.warning("failed to refresh access token, will retry after 60s.")
-                await sleep(60)
-            except Exception as e:
-                logger.opt(exception=e).error("failed to refresh access token, will retry after 60s.")
-                await sleep(60)
 
     def start(self):
-        self._pclient = PixivClient(proxy=_conf.pixiv_proxy, timeout=_conf.pixiv_query_timeout)
-        self._papi = AppPixivAPI(client=self._pclient.start())
-        self._papi.set_additional_headers({'Accept-Language': 'zh-CN'})
-        self._refresh_daemon = create_task(self._refresh_daemon_worker())
-        self._sema = Semaphore(_conf.pixiv_simultaneous_query)
+        refresh_tokens = list(dict.fromkeys([_conf.pixiv_refresh_token, *_conf.pixiv_extra_refresh_tokens]))
+
+        self._pclient = PixivClient(proxy=_conf.pixiv_proxy, timeout=_conf.pixiv_query_timeout,
+                                    limit=_conf.pixiv_simultaneous_query * len(refresh_tokens))
+        self._session = self._pclient.start()
+        self.pool = PixivAccountPool(refresh_tokens, self._session)
+        self.pool.start()
+
+        self._download_pclient = PixivClient(proxy=_conf.pixiv_proxy, timeout=_conf.pixiv_download_timeout,
+                                             limit=_conf.pixiv_simultaneous_download)
+        self._download_session = self._download_pclient.start()
+        self.download_limiter = ConcurrencyLimiter(_conf.pixiv_simultaneous_download,
+                                                   aging=_conf.pixiv_background_priority_aging)
 
     async def shutdown(self):
         await self._pclient.close()
-        self._refresh_daemon.cancel()
+        await self._download_pclient.close()
+        self.pool.stop()
 
     def _check_error_in_raw_result(self, raw_result: dict):
         if "error" in raw_result:
@@ -116,40 +90,36 @@ class RemotePixivRepo(PixivRepo):
                       or raw_result["error"]["message"] \
                       or raw_result["error"]["reason"]
             if message == "Rate Limit":
-                # 处理RateLimit
-                self._got_rate_limit = datetime.utcnow()
+                # 由rate_limiter降低速率
                 raise RateLimitError()
             else:
                 raise QueryError(message)
 
-    @asynccontextmanager
-    async def _query(self):
-        # RateLimit期间不进行查询
-        if self._got_rate_limit is not None:
-            now = datetime.utcnow()
-            if now - self._got_rate_limit >= timedelta(minutes=2):
-                self._got_rate_limit = None
-            else:
-                raise RateLimitError()
+    def _query(self, account: Optional[PixivAccount] = None) -> AsyncContextManager[PixivAccount]:
+        # 等待配额，超时仍未获得则抛出RateLimitError
+        return self.pool.query(account)
 
-        async with self._sema:
-            yield
+    def _download(self) -> AsyncContextManager[None]:
+        # 等待下载池的配额，超时仍未获得则抛出RateLimitError
+        return self.download_limiter.limit(timeout=_conf.pixiv_rate_limit_wait_timeout)
 
     async def _load_raw_page(self, papi_search_func: Callable[..., Awaitable[dict]],
+                             *, account: Optional[PixivAccount] = None,
                              **kwargs):
-        async with self._query():
-            raw_result = await papi_search_func(**kwargs)
+        async with self._query(account) as account:
+            raw_result = await papi_search_func(account.papi, **kwargs)
             self._check_error_in_raw_result(raw_result)
             return raw_result
 
     @staticmethod
     @rr_cache()  # 因为size足够就不会发生替换，所以缓存用random replacement算法最快
     def _make_illust_filter(min_view: int = 2 ** 31 - 1, min_bookmark: int = 2 ** 31 - 1):
+        block_mask = tag_index.mask(_conf.pixiv_block_tags)
+
         def illust_filter(illust: Illust) -> bool:
             # 标签过滤
-            for tag in _conf.pixiv_block_tags:
-                if illust.has_tag(tag):
-                    return False
+            if illust.has_tag_mask(block_mask):
+                return False
             # 书签下限过滤
             if illust.total_bookmarks < min_bookmark:
                 return False
@@ -167,17 +137,19 @@ class RemotePixivRepo(PixivRepo):
                          element_list_name: str,
                          *, mapper: Optional[Callable[[dict], T]] = None,
                          filter_item: Optional[Callable[[T], bool]] = None,
+                         account: Optional[PixivAccount] = None,
                          **kwargs) -> Tuple[List[T], PixivRepoMetadata]:
         """
         加载一页
-        :param papi_search_func: PixivPy-Async的加载方法
+        :param papi_search_func: PixivPy-Async的加载方法（AppPixivAPI的未绑定方法）
         :param element_list_name: 返回JSON中元素所在列表名
         :param mapper: 将元素从JSON格式映射为特定格式
         :param filter_item: 过滤不符合条件的元素（先映射再过滤）
+        :param account: 指定发出查询的账号，为None时选择负载最低的账号
         :param kwargs: 传给papi_search_func的参数
         :return: 加载结果
         """
-        raw_result = await self._load_raw_page(papi_search_func, **kwargs)
+        raw_result = await self._load_raw_page(papi_search_func, account=account, **kwargs)
 
         pending = []
         for x in raw_result[element_list_name]:
@@ -195,49 +167,85 @@ class RemotePixivRepo(PixivRepo):
                                element_list_name: str,
                                *, mapper: Optional[Callable[[dict], T]] = None,
                                filter_item: Optional[Callable[[T], bool]] = None,
+                               account: Optional[PixivAccount] = None,
+                               prefetch: bool = True,
+                               max_page: Optional[int] = None,
                                **kwargs) -> AsyncGenerator[Tuple[List[T], PixivRepoMetadata], None]:
         """
         一次加载多页
-        :param papi_search_func: PixivPy-Async的加载方法
+        :param papi_search_func: PixivPy-Async的加载方法（AppPixivAPI的未绑定方法）
         :param element_list_name: 返回JSON中元素所在列表名
         :param mapper: 将元素从JSON格式映射为特定格式
         :param filter_item: 过滤不符合条件的元素（先映射再过滤）
+        :param account: 指定发出查询的账号，为None时每页分别选择负载最低的账号
+        :param prefetch: 是否在消费当前页的同时预先加载下一页（还需启用pixiv_page_prefetch）
+        :param max_page: 调用方最多消费的页数，加载到该页后不再预先加载下一页
         :param kwargs: 传给papi_search_func的参数
         :return: 加载结果
         """
-        loaded_items = 0
-        loaded_pages = 0
-        next_qs = kwargs
+        prefetch = prefetch and _conf.pixiv_page_prefetch
 
-        while True:
+        def load(qs: dict) -> Awaitable[Tuple[List[T], PixivRepoMetadata]]:
             logger.info(f"[remote] loading page {loaded_pages}")
-            page, metadata = await self._load_page(papi_search_func, element_list_name, mapper=mapper,
-                                                   filter_item=filter_item, **next_qs)
+            return self._load_page(papi_search_func, element_list_name, mapper=mapper,
+                                   filter_item=filter_item, account=account, **qs)
 
-            loaded_pages = loaded_pages + 1
-            loaded_items += len(page)
+        loaded_items = 0
+        loaded_pages = 0
+        next_page: Optional[Task] = None
 
-            metadata.pages = loaded_pages
-            yield page, metadata
+        try:
+            page, metadata = await load(kwargs)
+            while True:
+                loaded_pages = loaded_pages + 1
+                loaded_items += len(page)
 
-            next_qs = metadata.next_qs
-            if next_qs:
-                if 'viewed' in next_qs:
+                next_qs = metadata.next_qs
+                if next_qs and 'viewed' in next_qs:
                     # 由于pixivpy-async的illust_recommended的bug，需要删掉这个参数
                     del next_qs['viewed']
-            else:
-                break
 
-    async def _get_illusts(self, papi_search_func: Callable[[], Awaitable[dict]],
+                # 在当前页被消费（写入本地缓存等）的同时加载下一页
+                if next_qs and prefetch and (max_page is None or loaded_pages < max_page):
+                    next_page = create_task(load(next_qs))
+
+                metadata.pages = loaded_pages
+                yield page, metadata
+
+                if not next_qs:
+                    break
+
+                if next_page is not None:
+                    page, metadata = await next_page
+                    next_page = None
+                else:
+                    page, metadata = await load(next_qs)
+        finally:
+            # 消费者提前退出（如达到max_item/max_page）时取消预加载
+            if next_page is not None:
+                if next_page.done():
+                    if not next_page.cancelled():
+                        next_page.exception()  # 取出异常，避免未获取异常的警告
+                else:
+                    next_page.cancel()
+                    logger.debug(f"[remote] prefetching page {loaded_pages} was cancelled")
+
+    async def _get_illusts(self, papi_search_func: Callable[..., Awaitable[dict]],
                            *, min_bookmark: int = 0,
                            min_view: int = 0,
+                           account: Optional[PixivAccount] = None,
+                           prefetch: bool = True,
+                           max_page: Optional[int] = None,
                            **kwargs) \
             -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
         """
         加载插画
-        :param papi_search_func: PixivPy-Async的加载方法
+        :param papi_search_func: PixivPy-Async的加载方法（AppPixivAPI的未绑定方法）
         :param min_bookmark: 书签数下限
         :param min_view: 阅读数下限
+        :param account: 指定发出查询的账号，为None时选择负载最低的账号
+        :param prefetch: 是否预先加载下一页
+        :param max_page: 调用方最多消费的页数
         :param kwargs: 传给papi_search_func的参数
         :return:
         """
@@ -246,45 +254,52 @@ class RemotePixivRepo(PixivRepo):
 
         try:
             yield PixivRepoMetadata(pages=0, next_qs=kwargs)
-            async for page, metadata in self._load_many_pages(papi_search_func, "illusts",
-                                                              mapper=lambda x: Illust.parse_obj(x),
-                                                              filter_item=self._make_illust_filter(min_view,
-                                                                                                   min_bookmark),
-                                                              **kwargs):
-                for item in page:
-                    total += 1
-                    if "limit_unknown_360.png" in item.image_urls.large:
-                        broken += 1
-                        yield LazyIllust(item.id)
-                    else:
-                        yield LazyIllust(item.id, item)
-                yield metadata
+            pages = self._load_many_pages(papi_search_func, "illusts",
+                                          mapper=lambda x: Illust.parse_obj(x),
+                                          filter_item=self._make_illust_filter(min_view, min_bookmark),
+                                          account=account, prefetch=prefetch, max_page=max_page, **kwargs)
+            async with aclosing(pages):
+                async for page, metadata in pages:
+                    for item in page:
+                        total += 1
+                        if "limit_unknown_360.png" in item.image_urls.large:
+                            broken += 1
+                            yield LazyIllust(item.id)
+                        else:
+                            yield LazyIllust(item.id, item)
+                    yield metadata
         finally:
             logger.info(f"[remote] got {total} illusts, illust_detail of {broken} are missed")
 
-    async def _get_user_previews(self, papi_search_func: Callable[[], Awaitable[dict]], **kwargs) \
+    async def _get_user_previews(self, papi_search_func: Callable[..., Awaitable[dict]], **kwargs) \
             -> AsyncGenerator[Union[PixivRepoMetadata, UserPreview], None]:
         yield PixivRepoMetadata(pages=0, next_qs=kwargs)
-        async for page, metadata in self._load_many_pages(papi_search_func, "user_previews",
-                                                          mapper=lambda x: UserPreview.parse_obj(x), **kwargs):
-            for item in page:
-                item: UserPreview
-                item.illusts = list(filter(self._make_illust_filter(), item.illusts))
-                yield item
-            yield metadata
-
-    async def _get_users(self, papi_search_func: Callable[[], Awaitable[dict]], **kwargs) \
+        pages = self._load_many_pages(papi_search_func, "user_previews",
+                                      mapper=lambda x: UserPreview.parse_obj(x), **kwargs)
+        async with aclosing(pages):
+            async for page, metadata in pages:
+                for item in page:
+                    item: UserPreview
+                    item.illusts = list(filter(self._make_illust_filter(), item.illusts))
+                    yield item
+                yield metadata
+
+    async def _get_users(self, papi_search_func: Callable[..., Awaitable[dict]],
+                         *, max_page: Optional[int] = None,
+                         **kwargs) \
             -> AsyncGenerator[Union[PixivRepoMetadata, User], None]:
         yield PixivRepoMetadata(pages=0, next_qs=kwargs)
-        async for page, metadata in self._load_many_pages(papi_search_func, "user_previews",
-                                                          mapper=lambda x: User.parse_obj(x["user"]), **kwargs):
-            for item in page:
-                yield item
-            yield metadata
+        pages = self._load_many_pages(papi_search_func, "user_previews",
+                                      mapper=lambda x: User.parse_obj(x["user"]), max_page=max_page, **kwargs)
+        async with aclosing(pages):
+            async for page, metadata in pages:
+                for item in page:
+                    yield item
+                yield metadata
 
     async def _raw_illust_detail(self, illust_id: int, **kwargs) -> dict:
-        async with self._query():
-            raw_result = await self._papi.illust_detail(illust_id, **kwargs)
+        async with self._query() as account:
+            raw_result = await account.papi.illust_detail(illust_id, **kwargs)
             self._check_error_in_raw_result(raw_result)
             return raw_result
 
@@ -295,8 +310,8 @@ class RemotePixivRepo(PixivRepo):
         yield Illust.parse_obj(raw_result["illust"])
 
     async def _raw_user_detail(self, user_id: int, **kwargs) -> dict:
-        async with self._query():
-            raw_result = await self._papi.user_detail(user_id, **kwargs)
+        async with self._query() as account:
+            raw_result = await account.papi.user_detail(user_id, **kwargs)
             self._check_error_in_raw_result(raw_result)
             return raw_result
 
@@ -309,7 +324,7 @@ class RemotePixivRepo(PixivRepo):
     def search_illust(self, word: str, **kwargs) \
             -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
         logger.debug(f"[remote] search_illust {word}")
-        return self._get_illusts(self._papi.search_illust,
+        return self._get_illusts(AppPixivAPI.search_illust,
                                  min_bookmark=_conf.pixiv_random_illust_min_bookmark,
                                  min_view=_conf.pixiv_random_illust_min_view,
                                  word=word, **kwargs)
@@ -317,50 +332,58 @@ class RemotePixivRepo(PixivRepo):
     def search_user(self, word: str, **kwargs) \
             -> AsyncGenerator[Union[User, PixivRepoMetadata], None]:
         logger.debug(f"[remote] search_user {word}")
-        return self._get_users(self._papi.search_user,
+        return self._get_users(AppPixivAPI.search_user,
                                word=word, **kwargs)
 
     def search_user_with_preview(self, word: str, **kwargs) \
             -> AsyncGenerator[Union[UserPreview, PixivRepoMetadata], None]:
         logger.debug(f"[remote] search_user {word}")
-        return self._get_user_previews(self._papi.search_user,
+        return self._get_user_previews(AppPixivAPI.search_user,
                                        word=word, **kwargs)
 
     def user_following(self, user_id: int, **kwargs) \
             -> AsyncGenerator[Union[User, PixivRepoMetadata], None]:
         logger.debug(f"[remote] following_users {user_id}")
-        return self._get_users(self._papi.user_following,
+        return self._get_users(AppPixivAPI.user_following,
                                user_id=user_id, **kwargs)
 
     def user_following_with_preview(self, user_id: int, **kwargs) \
             -> AsyncGenerator[Union[UserPreview, PixivRepoMetadata], None]:
         logger.debug(f"[remote] following_users {user_id}")
-        return self._get_user_previews(self._papi.user_following,
+        return self._get_user_previews(AppPixivAPI.user_following,
                                        user_id=user_id, **kwargs)
 
-    def user_illusts(self, user_id: int, **kwargs) \
+    def user_illusts(self, user_id: int, *, prefetch: bool = True, **kwargs) \
             -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
         logger.debug(f"[remote] user_illusts {user_id}")
-        return self._get_illusts(self._papi.user_illusts,
+        return self._get_illusts(AppPixivAPI.user_illusts,
                                  min_bookmark=_conf.pixiv_random_user_illust_min_bookmark,
                                  min_view=_conf.pixiv_random_user_illust_min_view,
-                                 user_id=user_id, **kwargs)
+                                 prefetch=prefetch, user_id=user_id, **kwargs)
 
-    def user_bookmarks(self, user_id: int = 0, **kwargs) \
+    async def user_bookmarks(self, user_id: int = 0, **kwargs) \
             -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
+        # 启动时（如定时推送的预热）账号可能还未登录，需要等待登录后才知道账号的user_id
         if user_id == 0:
-            user_id = self.user_id
+            account = self.pool.primary
+            await account.wait_ready(_conf.pixiv_query_timeout)
+            user_id = account.user_id
+        else:
+            # 池中账号的收藏由其本人查询（可以看到非公开的收藏），其他用户的收藏是公开查询
+            account = await self.pool.owner_of(user_id)
 
         logger.debug(f"[remote] user_bookmarks {user_id}")
-        return self._get_illusts(self._papi.user_bookmarks_illust,
-                                 min_bookmark=_conf.pixiv_random_bookmark_min_bookmark,
-                                 min_view=_conf.pixiv_random_bookmark_min_view,
-                                 user_id=user_id, **kwargs)
+        async with aclosing(self._get_illusts(AppPixivAPI.user_bookmarks_illust,
+                                              min_bookmark=_conf.pixiv_random_bookmark_min_bookmark,
+                                              min_view=_conf.pixiv_random_bookmark_min_view,
+                                              account=account, user_id=user_id, **kwargs)) as gen:
+            async for x in gen:
+                yield x
 
     # def following_illusts(self, **kwargs) \
     #         -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
     #     logger.debug(f"[remote] following_illusts")
-    #     return self._get_illusts(self._papi.illust_follow,
+    #     return self._get_illusts(AppPixivAPI.illust_follow,
     #                              min_bookmark=_conf.pixiv_random_following_illust_min_bookmark,
     #                              min_view=_conf.pixiv_random_following_illust_min_view,
     #                              **kwargs)
@@ -368,46 +391,65 @@ class RemotePixivRepo(PixivRepo):
     def recommended_illusts(self, **kwargs) \
             -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
         logger.debug("[remote] recommended_illusts")
-        return self._get_illusts(self._papi.illust_recommended,
+        # 推荐结果与账号相关，固定由主账号查询
+        return self._get_illusts(AppPixivAPI.illust_recommended,
                                  min_bookmark=_conf.pixiv_random_recommended_illust_min_bookmark,
                                  min_view=_conf.pixiv_random_recommended_illust_min_view,
-                                 **kwargs)
+                                 account=self.pool.primary, **kwargs)
 
     def related_illusts(self, illust_id: int, **kwargs) \
             -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
         logger.debug(f"[remote] related_illusts {illust_id}")
-        return self._get_illusts(self._papi.illust_related,
+        return self._get_illusts(AppPixivAPI.illust_related,
                                  min_bookmark=_conf.pixiv_random_related_illust_min_bookmark,
                                  min_view=_conf.pixiv_random_related_illust_min_view,
                                  illust_id=illust_id, **kwargs)
 
-    def illust_ranking(self, mode: Union[str, RankingMode], **kwargs) \
+    def illust_ranking(self, mode: Union[str, RankingMode], date: str, **kwargs) \
             -> AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]:
         if isinstance(mode, str):
             mode = RankingMode[mode]
 
-        logger.debug(f"[remote] illust_ranking {mode}")
-        return self._get_illusts(self._papi.illust_ranking,
-                                 mode=mode.name, **kwargs)
+        logger.debug(f"[remote] illust_ranking {mode} {date}")
+        return self._get_illusts(AppPixivAPI.illust_ranking,
+                                 mode=mode.name, date=date, **kwargs)
 
-    async def _raw_image(self, illust: Illust, page: int, **kwargs) -> bytes:
+    @staticmethod
+    def _image_url(illust: Illust, page: int) -> str:
         custom_domain = _conf.pixiv_download_custom_domain
 
         url = illust.page_image_url(page)
         if custom_domain is not None:
             url = url.replace("i.pximg.net", custom_domain)
+        return url
 
-        async with self._query():
-            with BytesIO() as bio:
-                await self._papi.download(url, fname=bio, **kwargs)
-                content = bio.getvalue()
-                return content
+    async def _raw_image(self, illust: Illust, page: int) -> bytes:
+        url = self._image_url(illust, page)
 
-    async def image(self, illust: Illust, page: int = 0, **kwargs) \
+        async with self._download():
+            async with self._download_session.get(url, headers={"Referer": _IMAGE_REFERER}) as resp:
+                resp.raise_for_status()
+                return await resp.read()
+
+    async def _stream_image(self, illust: Illust, page: int, variant: ImageVariant) -> bytes:
+        url = self._image_url(illust, page)
+
+        async with self._download():
+            async with self._download_session.get(url, headers={"Referer": _IMAGE_REFERER}) as resp:
+                resp.raise_for_status()
+                return await _compressor.compress_stream(resp.content.iter_chunked(_IMAGE_CHUNK_SIZE),
+                                                         size_hint=resp.content_length,
+                                                         variant=variant)
+
+    async def image(self, illust: Illust, page: int = 0, variant: ImageVariant = ImageVariant.large, **kwargs) \
             -> AsyncGenerator[Union[bytes, PixivRepoMetadata], None]:
-        logger.debug(f"[remote] image {illust.id}")
-        content = await self._raw_image(illust, page, **kwargs)
-        content = await _compressor.compress(content)
+        logger.debug(f"[remote] image {illust.id}[{page}] {variant.name}")
+        if _conf.pixiv_download_streaming:
+            # 边下载边解码压缩，不在内存中缓冲完整的原图
+            content = await self._stream_image(illust, page, variant)
+        else:
+            content = await self._raw_image(illust, page)
+            content = await _compressor.compress(content, variant)
         yield PixivRepoMetadata()
         yield content
 
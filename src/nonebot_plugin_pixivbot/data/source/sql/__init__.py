@@ -31,7 +31,7 @@ def json_serializer(obj):
 
 @context.register_eager_singleton()
 class DataSource(DataSourceLifecycle):
-    app_db_version = 5
+    app_db_version = 6
     registry = registry()
 
     def __init__(self):
@@ -4,6 +4,7 @@ from .sql_v1_to_v2 import SqlV1ToV2
 from .sql_v2_to_v3 import SqlV2ToV3
 from .sql_v3_to_v4 import SqlV3ToV4
 from .sql_v4_to_v5 import SqlV4ToV5
+from .sql_v5_to_v6 import SqlV5ToV6
 from ...migration_manager import MigrationManager
 
 
@@ -14,3 +15,4 @@ class SqlMigrationManager(MigrationManager):
         self.add(SqlV2ToV3)
         self.add(SqlV3ToV4)
         self.add(SqlV4ToV5)
+        self.add(SqlV5ToV6)
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod, ABCMeta
-from asyncio import Event
+from asyncio import Event, gather
 from typing import Sequence, Optional
 from typing import Type
 
@@ -15,9 +15,12 @@ from .pkg_context import context
 from ..config import Config
 from ..model import Illust
 from ..model.message import IllustMessagesModel
+from ..model.message.illust_message import select_image_variant, download_image
+from ..model.tag_index import tag_index
 from ..plugin_service import r18_service, r18g_service
 from ..service.postman import Postman
 from ..utils.algorithm import as_unique
+from ..utils.request_priority import RequestPriority, request_priority
 
 conf = context.require(Config)
 
@@ -89,6 +92,11 @@ class Handler(ABC, metaclass=HandlerMeta):
         self.silently = silently
         self.disable_interceptors = disable_interceptors
 
+    @property
+    def priority(self) -> RequestPriority:
+        # 静默执行的是定时推送、订阅等后台任务，让位于用户发出的指令
+        return RequestPriority.background if self.silently else RequestPriority.interactive
+
     @classmethod
     @abstractmethod
     def type(cls) -> str:
@@ -107,16 +115,18 @@ class Handler(ABC, metaclass=HandlerMeta):
         return {}
 
     async def handle(self, *args, **kwargs):
-        if not self.disable_interceptors:
-            await self.interceptor.intercept(self, self._parse_args_and_actual_handle, *args, **kwargs)
-        else:
-            await self._parse_args_and_actual_handle(*args, **kwargs)
+        with request_priority(self.priority):
+            if not self.disable_interceptors:
+                await self.interceptor.intercept(self, self._parse_args_and_actual_handle, *args, **kwargs)
+            else:
+                await self._parse_args_and_actual_handle(*args, **kwargs)
 
     async def handle_with_parsed_args(self, **kwargs):
-        if not self.disable_interceptors:
-            await self.interceptor.intercept(self, self.actual_handle, **kwargs)
-        else:
-            await self.actual_handle(**kwargs)
+        with request_priority(self.priority):
+            if not self.disable_interceptors:
+                await self.interceptor.intercept(self, self.actual_handle, **kwargs)
+            else:
+                await self.actual_handle(**kwargs)
 
     async def _parse_args_and_actual_handle(self, *args, **kwargs):
         parsed_kwargs = await self.parse_args(args)
@@ -131,6 +141,13 @@ class Handler(ABC, metaclass=HandlerMeta):
         """
         raise NotImplementedError()
 
+    async def prewarm(self, **kwargs):
+        """
+        在定时任务触发前预先加载actual_handle所需的数据（不发送任何消息）
+        :param kwargs: 与actual_handle相同的参数dict
+        """
+        pass
+
     @classmethod
     def add_interceptor_before(cls, interceptor: Interceptor, before: Interceptor):
         """
@@ -209,8 +226,11 @@ class Handler(ABC, metaclass=HandlerMeta):
     async def post_illust(self, illust: Illust, *,
                           header: Optional[str] = None,
                           number: Optional[int] = None):
+        max_page = conf.pixiv_max_page_per_illust
+        forward = context.require(Postman).is_forward_message(self.session, min(illust.page_count, max_page))
         model = await IllustMessagesModel.from_illust(illust, header=header, number=number,
-                                                      max_page=conf.pixiv_max_page_per_illust,
+                                                      max_page=max_page,
+                                                      variant=select_image_variant(forward),
                                                       block_r18=(not await self.is_r18_allowed()),
                                                       block_r18g=(not await self.is_r18g_allowed()))
         if model:
@@ -222,12 +242,31 @@ class Handler(ABC, metaclass=HandlerMeta):
         if len(illusts) == 1:
             await self.post_illust(illusts[0], header=header, number=number)
         else:
+            forward = context.require(Postman).is_forward_message(self.session, len(illusts))
             model = await IllustMessagesModel.from_illusts(illusts, header=header, number=number,
+                                                           variant=select_image_variant(forward),
                                                            block_r18=(not await self.is_r18_allowed()),
                                                            block_r18g=(not await self.is_r18g_allowed()))
             if model:
                 await context.require(Postman).post_illusts(model, self.session, self.event)
 
+    async def prewarm_illusts(self, illusts: Sequence[Illust]):
+        """
+        预先下载post_illusts将要发送的图片
+        """
+        if len(illusts) == 1:
+            n_pages = min(illusts[0].page_count, conf.pixiv_max_page_per_illust)
+            forward = context.require(Postman).is_forward_message(self.session, n_pages)
+        else:
+            n_pages = 1
+            forward = context.require(Postman).is_forward_message(self.session, len(illusts))
+
+        variant = select_image_variant(forward)
+        block_mask = tag_index.mask(conf.pixiv_block_tags)
+        await gather(*[download_image(x, page, variant)
+                       for x in illusts if not x.has_tag_mask(block_mask)
+                       for page in range(n_pages)])
+
 
 class EntryHandler(Handler, ABC, interceptors=[context.require(DefaultErrorInterceptor)]):
     pass
@@ -39,10 +39,7 @@ class RandomBookmarkHandler(RecordCommonHandler, service=random_bookmark_service
 
         return {"pixiv_user_id": pixiv_user_id, "sender_user_id": self.session.id1}
 
-    # noinspection PyMethodOverriding
-    async def actual_handle(self, *, pixiv_user_id: int = 0,
-                            sender_user_id: int = 0,
-                            count: int = 1):
+    async def _resolve_pixiv_user_id(self, pixiv_user_id: int, sender_user_id: int) -> int:
         if not pixiv_user_id and sender_user_id:
             pixiv_user_id = await binder.get_binding(self.session.platform, sender_user_id)
 
@@ -52,6 +49,21 @@ class RandomBookmarkHandler(RecordCommonHandler, service=random_bookmark_service
         if not pixiv_user_id:
             raise BadRequestError("无效的Pixiv账号，或未绑定Pixiv账号")
 
+        return pixiv_user_id
+
+    # noinspection PyMethodOverriding
+    async def prewarm(self, *, pixiv_user_id: int = 0,
+                      sender_user_id: int = 0,
+                      count: int = 1):
+        pixiv_user_id = await self._resolve_pixiv_user_id(pixiv_user_id, sender_user_id)
+        await service.prewarm_random_bookmark(pixiv_user_id)
+
+    # noinspection PyMethodOverriding
+    async def actual_handle(self, *, pixiv_user_id: int = 0,
+                            sender_user_id: int = 0,
+                            count: int = 1):
+        pixiv_user_id = await self._resolve_pixiv_user_id(pixiv_user_id, sender_user_id)
+
         illusts = await service.random_bookmark(pixiv_user_id, count=count,
                                                 exclude_r18=(not await self.is_r18_allowed()),
                                                 exclude_r18g=(not await self.is_r18g_allowed()))
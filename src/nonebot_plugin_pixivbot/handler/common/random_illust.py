@@ -29,6 +29,11 @@ class RandomIllustHandler(RecordCommonHandler, service=random_illust_service):
     async def parse_args(self, args: Sequence[str]) -> dict:
         return {"word": args[0]}
 
+    # noinspection PyMethodOverriding
+    async def prewarm(self, *, word: str,
+                      count: int = 1):
+        await service.prewarm_random_illust(word)
+
     # noinspection PyMethodOverriding
     async def actual_handle(self, *, word: str,
                             count: int = 1):
@@ -23,6 +23,9 @@ class RandomRecommendedIllustHandler(RecordCommonHandler, service=random_recomme
     def enabled(cls) -> bool:
         return conf.pixiv_random_recommended_illust_query_enabled
 
+    async def prewarm(self, *, count: int = 1):
+        await service.prewarm_random_recommended_illust()
+
     async def actual_handle(self, *, count: int = 1):
         illusts = await service.random_recommended_illust(count=count,
                                                           exclude_r18=(not await self.is_r18_allowed()),
@@ -35,6 +35,11 @@ class RandomUserIllustHandler(RecordCommonHandler, service=random_user_illust_se
             user = await service.get_user(args[0])
             return {"user": user.id}
 
+    # noinspection PyMethodOverriding
+    async def prewarm(self, *, user: Union[str, int],
+                      count: int = 1):
+        await service.prewarm_random_user_illust(user)
+
     # noinspection PyMethodOverriding
     async def actual_handle(self, *, user: Union[str, int],
                             count: int = 1):
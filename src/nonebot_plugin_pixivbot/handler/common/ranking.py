@@ -1,3 +1,5 @@
+import re
+from datetime import date
 from typing import Sequence
 from typing import Tuple
 from typing import Union
@@ -17,10 +19,13 @@ from ...plugin_service import ranking_service
 from ...service.pixiv_service import PixivService
 from ...utils.decode_integer import decode_integer
 from ...utils.errors import BadRequestError
+from ...utils.ranking_date import latest_ranking_date, parse_ranking_date
 
 conf = context.require(Config)
 service = context.require(PixivService)
 
+_DATE_PATTERN = re.compile(r"^\d{4}-\d{1,2}-\d{1,2}$|^\d{8}$")
+
 
 class RankingHandler(CommonHandler, service=ranking_service):
     @classmethod
@@ -51,9 +56,28 @@ class RankingHandler(CommonHandler, service=ranking_service):
                 raise BadRequestError(
                     f'仅支持查询{conf.pixiv_ranking_fetch_item}名以内的插画')
 
+    def validate_date(self, date: date = None):
+        if date and date > latest_ranking_date(conf.pixiv_ranking_rollover_time):
+            raise BadRequestError("该日期的榜单还未发布")
+
+    @staticmethod
+    def _normalize_date(date: Union[date, str, None]) -> Union[date, None]:
+        # 订阅的参数保存为JSON，其中的日期是isoformat字符串
+        if isinstance(date, str):
+            try:
+                date = parse_ranking_date(date)
+            except ValueError:
+                raise BadRequestError(f"{date}不是合法的日期")
+        return date
+
     async def parse_args(self, args: Sequence[str]) -> dict:
         mode = args[0].lower() if len(args) > 0 else None
         range = args[1] if len(args) > 1 else None
+        date = args[2] if len(args) > 2 else None
+
+        # 省略范围只指定日期
+        if range and not date and _DATE_PATTERN.match(range):
+            range, date = None, range
 
         if not mode:  # 判断是不是空字符串
             mode = None
@@ -78,10 +102,18 @@ class RankingHandler(CommonHandler, service=ranking_service):
             except ValueError:
                 raise BadRequestError(f"{range}不是合法的范围")
 
-        return {"mode": mode, "range": range}
+        if not date:
+            date = None
+        else:
+            try:
+                date = parse_ranking_date(date)
+            except ValueError:
+                raise BadRequestError(f"{date}不是合法的日期")
+
+        return {"mode": mode, "range": range, "date": date}
 
-    async def actual_handle(self, *, mode: Union[RankingMode, None] = None,
-                            range: Union[Tuple[int, int], int, None] = None):
+    def _normalize_args(self, mode: Union[RankingMode, None],
+                        range: Union[Tuple[int, int], int, None]) -> Tuple[RankingMode, Tuple[int, int]]:
         if mode is None:
             mode = conf.pixiv_ranking_default_mode
 
@@ -92,9 +124,26 @@ class RankingHandler(CommonHandler, service=ranking_service):
             range = range, range
 
         self.validate_range(range)
-        illusts = await service.illust_ranking(mode, range)
+        return mode, range
+
+    async def prewarm(self, *, mode: Union[RankingMode, None] = None,
+                      range: Union[Tuple[int, int], int, None] = None,
+                      date: Union[date, str, None] = None):
+        mode, range = self._normalize_args(mode, range)
+        date = self._normalize_date(date)
+        self.validate_date(date)
+        illusts = await service.illust_ranking(mode, range, date)
+        await self.prewarm_illusts(illusts)
+
+    async def actual_handle(self, *, mode: Union[RankingMode, None] = None,
+                            range: Union[Tuple[int, int], int, None] = None,
+                            date: Union[date, str, None] = None):
+        mode, range = self._normalize_args(mode, range)
+        date = self._normalize_date(date)
+        self.validate_date(date)
+        illusts = await service.illust_ranking(mode, range, date)
         await self.post_illusts(illusts,
-                                header=f"这是您点的{self.mode_mapping[mode]}榜",
+                                header=f"这是您点的{date or ''}{self.mode_mapping[mode]}榜",
                                 number=range[0])
 
 
@@ -104,8 +153,9 @@ async def on_match(event: Event,
                    session=Depends(extract_session)):
     if matched_groups:
         mode = matched_groups[0]
-        num = matched_groups[1]
+        # <范围> <日期>
+        args = (matched_groups[1] or "").split()
     else:
         mode = None
-        num = None
-    await RankingHandler(session, event).handle(mode, num)
+        args = []
+    await RankingHandler(session, event).handle(mode, *args)
@@ -1,4 +1,6 @@
 import time
+from datetime import datetime
+from typing import Tuple
 
 from nonebot import logger
 
@@ -17,13 +19,16 @@ pixiv = context.require(PixivRepo)
 
 
 # 因为要强制从远端获取，所以用这个shared_agen_mgr来缓存
-class WatchFollowingIllustsSharedAsyncGeneratorManager(SharedAsyncGeneratorManager[int, Illust]):
+# identifier为(pixiv_user_id, checkpoint)，checkpoint之前的插画不会被获取
+class WatchFollowingIllustsSharedAsyncGeneratorManager(SharedAsyncGeneratorManager[Tuple[int, datetime], Illust]):
     log_tag = "watch_following_illusts_shared_agen"
 
-    async def agen(self, identifier: int, cache_strategy: CacheStrategy, **kwargs):
+    async def agen(self, identifier: Tuple[int, datetime], cache_strategy: CacheStrategy, **kwargs):
         await self.set_expires_time(identifier, time.time() + 30)  # 30s过期，保证每分钟的所有task都能共享
-        async for x in pixiv.user_following_illusts(user_id=identifier,
-                                                    cache_strategy=CacheStrategy.FORCE_EXPIRATION):
+        user_id, checkpoint = identifier
+        async for x in pixiv.user_following_illusts(user_id=user_id,
+                                                    cache_strategy=CacheStrategy.FORCE_EXPIRATION,
+                                                    checkpoint=checkpoint):
             yield await x.get()
 
 
@@ -50,7 +55,7 @@ class WatchFollowingIllustsHandler(WatchTaskHandler):
             logger.warning(f"[watchman] no binding found for {task.subscriber.id1}")
             return
 
-        async with shared_agen_mgr.get(pixiv_user_id) as illusts:
+        async with shared_agen_mgr.get((pixiv_user_id, task.checkpoint)) as illusts:
             async for illust in illusts:
                 if illust.create_date <= task.checkpoint:
                     break
@@ -1,4 +1,5 @@
 import time
+from typing import Optional, Sequence
 
 from nonebot import logger
 
@@ -33,11 +34,22 @@ class WatchUserIllustsHandler(WatchTaskHandler):
     def type(cls) -> str:
         return "watch_user_illusts"
 
+    async def _post(self, task: WatchTask, illust: Illust):
+        logger.info(f"[watchman] send illust {illust.id} to {task.subscriber}")
+        await self.post_illust(illust, header="您订阅的画师更新了")
+
     # noinspection PyMethodOverriding
-    async def actual_handle(self, *, task: WatchTask):
+    async def actual_handle(self, *, task: WatchTask, illusts: Optional[Sequence[Illust]] = None):
+        # illusts为ArtistPoller轮询得到的新插画（从新到旧），手动触发时为None，此时自行获取
+        if illusts is not None:
+            for illust in illusts:
+                if illust.create_date <= task.checkpoint:
+                    break
+                await self._post(task, illust)
+            return
+
         async with shared_agen_mgr.get(task.kwargs["user_id"]) as illusts:
             async for illust in illusts:
                 if illust.create_date <= task.checkpoint:
                     break
-                logger.info(f"[watchman] send illust {illust.id} to {task.subscriber}")
-                await self.post_illust(illust, header="您订阅的画师更新了")
+                await self._post(task, illust)
@@ -4,6 +4,7 @@ import typing
 from pydantic import *
 
 from .tag import Tag
+from .tag_index import tag_index
 from .user import User
 
 
@@ -40,6 +41,21 @@ class Illust(BaseModel):
     total_bookmarks: int
     illust_ai_type: int = 0  # 0为非AI作品，其他暂时不知道
 
+    _tag_bits: typing.Optional[typing.Tuple[int, int]] = PrivateAttr(default=None)  # (tag_index版本, 位集)
+
+    def tag_bits(self) -> int:
+        # 只在tag_index加入新标签后重新计算
+        version = tag_index.version
+        if self._tag_bits is None or self._tag_bits[0] != version:
+            self._tag_bits = (version, tag_index.bits_of(self.tags))
+        return self._tag_bits[1]
+
+    def has_tag_mask(self, mask: int) -> bool:
+        """
+        :param mask: tag_index.mask()的返回值
+        """
+        return self.tag_bits() & mask != 0
+
     def has_tag(self, tag: typing.Union[str, Tag]) -> bool:
         if isinstance(tag, Tag):
             for x in self.tags:
@@ -47,16 +63,17 @@ class Illust(BaseModel):
                     return True
             return False
         else:
-            for x in self.tags:
-                if x.name == tag or x.translated_name == tag:
-                    return True
-            return False
+            return self.has_tag_mask(tag_index.mask([tag]))
 
     def has_tags(self, tags: typing.List[typing.Union[str, Tag]]) -> bool:
+        names = []
         for tag in tags:
-            if self.has_tag(tag):
-                return True
-        return False
+            if isinstance(tag, Tag):
+                if self.has_tag(tag):
+                    return True
+            else:
+                names.append(tag)
+        return self.has_tag_mask(tag_index.mask(names))
 
     def page_image_url(self, page: int) -> str:
         if len(self.meta_pages) > 0:
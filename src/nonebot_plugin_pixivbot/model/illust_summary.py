@@ -0,0 +1,72 @@
+import sys
+from datetime import datetime, timezone
+from typing import FrozenSet, Union, List, Any, Mapping
+
+from .illust import Illust
+from .tag import Tag
+
+
+class IllustSummary:
+    """
+    插画列表中随机抽取所需的字段（书签数、查看数、发布时间、标签、AI标记），
+    用于替代完整的Illust常驻内存。标签名经过intern，相同的标签只保存一份
+    """
+    __slots__ = ("id", "total_bookmarks", "total_view", "create_timestamp", "tags", "illust_ai_type")
+
+    def __init__(self, id: int, total_bookmarks: int, total_view: int, create_timestamp: float,
+                 tags: FrozenSet[str], illust_ai_type: int = 0):
+        self.id = id
+        self.total_bookmarks = total_bookmarks
+        self.total_view = total_view
+        self.create_timestamp = create_timestamp
+        self.tags = tags  # 标签名及其翻译
+        self.illust_ai_type = illust_ai_type
+
+    @staticmethod
+    def _intern_tags(tags) -> FrozenSet[str]:
+        names = set()
+        for t in tags:
+            if isinstance(t, Mapping):
+                name, translated_name = t.get("name"), t.get("translated_name")
+            else:
+                name, translated_name = t.name, t.translated_name
+            names.add(sys.intern(name))
+            if translated_name:
+                names.add(sys.intern(translated_name))
+        return frozenset(names)
+
+    @classmethod
+    def from_illust(cls, illust: Illust) -> "IllustSummary":
+        return cls(illust.id, illust.total_bookmarks, illust.total_view, illust.create_date.timestamp(),
+                   cls._intern_tags(illust.tags), illust.illust_ai_type)
+
+    @classmethod
+    def from_dict(cls, obj: Mapping[str, Any]) -> "IllustSummary":
+        # 直接从缓存的dict构造，省去一次完整的Illust校验
+        create_date = obj["create_date"]
+        if not isinstance(create_date, datetime):
+            create_date = datetime.fromisoformat(create_date)
+        if create_date.tzinfo is None:
+            create_date = create_date.replace(tzinfo=timezone.utc)
+
+        return cls(obj["id"], obj["total_bookmarks"], obj["total_view"], create_date.timestamp(),
+                   cls._intern_tags(obj["tags"]), obj.get("illust_ai_type", 0))
+
+    @property
+    def create_date(self) -> datetime:
+        return datetime.fromtimestamp(self.create_timestamp, timezone.utc)
+
+    def has_tag(self, tag: Union[str, Tag]) -> bool:
+        if isinstance(tag, Tag):
+            return tag.name in self.tags
+        else:
+            return tag in self.tags
+
+    def has_tags(self, tags: List[Union[str, Tag]]) -> bool:
+        for tag in tags:
+            if self.has_tag(tag):
+                return True
+        return False
+
+
+__all__ = ("IllustSummary",)
@@ -7,16 +7,27 @@ from tzlocal import get_localzone
 from .. import Illust
 from ...config import Config
 from ...data.pixiv_repo import PixivRepo
+from ...data.pixiv_repo.enums import ImageVariant
 from ...enums import BlockAction
 from ...global_context import context
 
 conf = context.require(Config)
 
 
-async def download_image(illust: Illust, page: int):
+def select_image_variant(forward: bool) -> ImageVariant:
+    """
+    根据发送方式选择插画的尺寸
+    :param forward: 是否以合并转发消息的形式发送
+    """
+    if forward and conf.pixiv_forward_message_thumbnail:
+        return ImageVariant.thumbnail
+    return ImageVariant.large
+
+
+async def download_image(illust: Illust, page: int, variant: ImageVariant = ImageVariant.large):
     with BytesIO() as bio:
         repo = context.require(PixivRepo)
-        async for x in repo.image(illust, page):
+        async for x in repo.image(illust, page, variant):
             bio.write(x)
             break
         return bio.getvalue()
@@ -44,6 +55,7 @@ class IllustMessageModel(BaseModel):
                           header: Optional[str] = None,
                           number: Optional[int] = None,
                           page: int = 0,
+                          variant: ImageVariant = ImageVariant.large,
                           block_r18: bool = False,
                           block_r18g: bool = False) -> Optional["IllustMessageModel"]:
         model = IllustMessageModel(id=illust.id, header=header, number=number, page=page, total=illust.page_count)
@@ -64,7 +76,7 @@ class IllustMessageModel(BaseModel):
             elif conf.pixiv_block_action == BlockAction.no_reply:
                 return None
         else:
-            model.image = await download_image(illust, page)
+            model.image = await download_image(illust, page, variant)
         model.title = illust.title
         model.author = f"{illust.user.name} ({illust.user.id})"
         model.create_time = illust.create_date.astimezone(get_localzone()).strftime('%Y-%m-%d %H:%M:%S')
@@ -5,6 +5,7 @@ from pydantic import BaseModel
 
 from .illust_message import IllustMessageModel
 from .. import Illust
+from ...data.pixiv_repo.enums import ImageVariant
 
 
 class IllustMessagesModel(BaseModel):
@@ -15,12 +16,13 @@ class IllustMessagesModel(BaseModel):
     async def from_illusts(illusts: Sequence[Illust], *,
                            header: Optional[str] = None,
                            number: Optional[int] = None,
+                           variant: ImageVariant = ImageVariant.large,
                            block_r18: bool = False,
                            block_r18g: bool = False) -> Optional["IllustMessagesModel"]:
         tasks = [
             create_task(
                 IllustMessageModel.from_illust(x, number=number + i if number is not None else None,
-                                               block_r18=block_r18, block_r18g=block_r18g)
+                                               variant=variant, block_r18=block_r18, block_r18g=block_r18g)
             ) for i, x in enumerate(illusts)
         ]
         await gather(*tasks)
@@ -39,11 +41,12 @@ class IllustMessagesModel(BaseModel):
                           header: Optional[str] = None,
                           number: Optional[int] = None,
                           max_page: Optional[int] = 2 ** 31 - 1,
+                          variant: ImageVariant = ImageVariant.large,
                           block_r18: bool = False,
                           block_r18g: bool = False) -> Optional["IllustMessagesModel"]:
         tasks = [
             create_task(
-                IllustMessageModel.from_illust(illust, page=i, number=number,
+                IllustMessageModel.from_illust(illust, page=i, number=number, variant=variant,
                                                block_r18=block_r18, block_r18g=block_r18g)
             ) for i in range(min(illust.page_count, max_page))
         ]
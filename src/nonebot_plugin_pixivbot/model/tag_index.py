@@ -0,0 +1,58 @@
+import sys
+from typing import Dict, Iterable, Tuple, Union
+
+from cachetools import LRUCache
+
+from .tag import Tag
+
+
+class TagIndex:
+    """
+    被查询过的标签（屏蔽标签、R-18、R-18G等）的字典，每个标签对应一个bit。
+    插画的标签位集只包含字典中的标签，因此位集的长度只与被查询的标签数有关
+    """
+
+    def __init__(self):
+        self._bits: Dict[str, int] = {}
+        # 查询的标签组合 -> 掩码。字典只增不减，标签一旦加入其bit就不会改变，因此掩码不会失效
+        self._masks = LRUCache[Tuple[str, ...], int](maxsize=256)
+
+    @property
+    def version(self) -> int:
+        # 字典只增不减，大小即版本号
+        return len(self._bits)
+
+    def mask(self, tags: Iterable[Union[str, Tag]]) -> int:
+        """
+        返回tags对应的掩码，未在字典中的标签会被加入
+        """
+        key = tuple(tag.name if isinstance(tag, Tag) else tag for tag in tags)
+        m = self._masks.get(key, None)
+        if m is not None:
+            return m
+
+        m = 0
+        for name in key:
+            bit = self._bits.get(name, None)
+            if bit is None:
+                bit = 1 << len(self._bits)
+                self._bits[sys.intern(name)] = bit
+            m |= bit
+        self._masks[key] = m
+        return m
+
+    def bits_of(self, tags: Iterable[Tag]) -> int:
+        """
+        返回插画标签（及其翻译）的位集
+        """
+        m = 0
+        for tag in tags:
+            m |= self._bits.get(tag.name, 0)
+            if tag.translated_name:
+                m |= self._bits.get(tag.translated_name, 0)
+        return m
+
+
+tag_index = TagIndex()
+
+__all__ = ("TagIndex", "tag_index")
@@ -1,2 +1,3 @@
 from . import scheduler
 from . import watchman
+from . import ranking_rollover
@@ -0,0 +1,152 @@
+import time
+from asyncio import create_task, gather
+from datetime import datetime, timezone
+from typing import Dict, List, Callable, Awaitable, Any
+
+from apscheduler.triggers.interval import IntervalTrigger
+from nonebot import logger
+from nonebot_plugin_apscheduler import scheduler as apscheduler
+
+from ..config import Config
+from ..data.pixiv_repo.models import PixivRepoMetadata
+from ..data.pixiv_repo.remote_repo import RemotePixivRepo
+from ..global_context import context
+from ..model import WatchTask, Illust
+from ..utils.request_priority import RequestPriority, request_priority
+
+conf = context.require(Config)
+
+# 检查哪些画师到了轮询时间的间隔（单位：秒）
+_TICK = 60
+# 轮询间隔 = 画师的活跃程度（最近一次投稿距今的时间与投稿间隔的中位数中的较小者） / _ACTIVITY_DIVISOR
+_ACTIVITY_DIVISOR = 16
+
+
+class _ArtistState:
+    __slots__ = ("user_id", "tasks", "interval", "next_poll_time", "polling")
+
+    def __init__(self, user_id: int, interval: float, next_poll_time: float):
+        self.user_id = user_id
+        self.tasks: Dict[str, WatchTask] = {}
+        self.interval = interval
+        self.next_poll_time = next_poll_time
+        self.polling = False
+
+
+class ArtistPoller:
+    """
+    按画师合并user_illusts类型的WatchTask：每个画师每次只查询一次第一页，再分发给订阅了该画师的所有task。
+    每个画师的轮询间隔根据其投稿记录在[pixiv_watch_interval, pixiv_watch_max_interval]之间调整
+    """
+
+    job_id = "watchman artist_poller"
+
+    def __init__(self, on_new_illusts: Callable[[WatchTask, List[Illust]], Awaitable[Any]]):
+        self.on_new_illusts = on_new_illusts
+        self._artists: Dict[int, _ArtistState] = {}
+        self._polling_tasks = set()
+
+    @property
+    def _min_interval(self) -> float:
+        return conf.pixiv_watch_interval
+
+    @property
+    def _max_interval(self) -> float:
+        return max(conf.pixiv_watch_interval, conf.pixiv_watch_max_interval)
+
+    def add(self, job_id: str, task: WatchTask):
+        user_id = task.kwargs["user_id"]
+        state = self._artists.get(user_id, None)
+        if state is None:
+            # 与原先的trigger一样按user_id错开各画师的首次轮询
+            state = _ArtistState(user_id, self._min_interval,
+                                 time.time() + user_id % self._min_interval)
+            self._artists[user_id] = state
+
+        state.tasks[job_id] = task
+        logger.debug(f"[artist_poller] added \"{job_id}\" (user {user_id}, {len(state.tasks)} tasks)")
+
+        if apscheduler.get_job(self.job_id) is None:
+            apscheduler.add_job(self._tick, id=self.job_id, trigger=IntervalTrigger(seconds=_TICK))
+            logger.success(f"[artist_poller] added job \"{self.job_id}\"")
+
+    def remove(self, job_id: str, task: WatchTask):
+        user_id = task.kwargs["user_id"]
+        state = self._artists.get(user_id, None)
+        if state is None:
+            return
+
+        state.tasks.pop(job_id, None)
+        logger.debug(f"[artist_poller] removed \"{job_id}\" (user {user_id}, {len(state.tasks)} tasks)")
+
+        if len(state.tasks) == 0:
+            del self._artists[user_id]
+
+    async def _tick(self):
+        now = time.time()
+        for state in self._artists.values():
+            if not state.polling and state.next_poll_time <= now:
+                state.polling = True
+                # 不在tick内等待，避免一次慢查询使后续tick被跳过
+                with request_priority(RequestPriority.background):
+                    task = create_task(self._poll(state))
+                self._polling_tasks.add(task)
+                task.add_done_callback(self._polling_tasks.discard)
+
+    @staticmethod
+    async def _fetch_first_page(user_id: int) -> List[Illust]:
+        illusts = []
+        # 只需要第一页，不预加载下一页
+        async for x in context.require(RemotePixivRepo).user_illusts(user_id, prefetch=False):
+            if isinstance(x, PixivRepoMetadata):
+                # 第一个metadata（pages=0）在加载前给出，之后的metadata表示已加载完一页
+                if x.pages:
+                    break
+            else:
+                illusts.append(x)
+        return list(await gather(*[x.get() for x in illusts]))
+
+    def _estimate_interval(self, create_dates: List[datetime]) -> float:
+        if len(create_dates) == 0:
+            return self._max_interval
+
+        create_dates = sorted(create_dates, reverse=True)
+        activity = (datetime.now(timezone.utc) - create_dates[0]).total_seconds()
+
+        if len(create_dates) >= 2:
+            gaps = sorted((a - b).total_seconds() for a, b in zip(create_dates, create_dates[1:]))
+            activity = min(activity, gaps[len(gaps) // 2])
+
+        return min(max(activity / _ACTIVITY_DIVISOR, self._min_interval), self._max_interval)
+
+    async def _poll(self, state: _ArtistState):
+        try:
+            illusts = await self._fetch_first_page(state.user_id)
+            state.interval = self._estimate_interval([x.create_date for x in illusts])
+
+            # 轮询期间可能有task被移除
+            tasks = list(state.tasks.values())
+            if len(tasks) == 0:
+                return
+
+            since = min(t.checkpoint for t in tasks)
+            illusts = [x for x in illusts if x.create_date > since]
+            logger.debug(f"[artist_poller] polled user {state.user_id}: {len(illusts)} new illusts, "
+                         f"next poll in {state.interval:.0f}s")
+
+            if len(illusts) == 0:
+                return
+
+            illusts.sort(key=lambda x: x.create_date, reverse=True)
+            await gather(*[
+                self.on_new_illusts(t, [x for x in illusts if x.create_date > t.checkpoint])
+                for t in tasks if illusts[0].create_date > t.checkpoint
+            ])
+        except Exception as e:
+            logger.opt(exception=e).error(f"[artist_poller] error occurred when polling user {state.user_id}")
+        finally:
+            state.next_poll_time = time.time() + state.interval
+            state.polling = False
+
+
+__all__ = ("ArtistPoller",)
@@ -0,0 +1,93 @@
+import operator
+from typing import Sequence, Union
+
+import numpy as np
+
+from nonebot_plugin_pixivbot.data.pixiv_repo import LazyIllust
+from nonebot_plugin_pixivbot.model import Illust, IllustSummary
+
+FLAG_R18 = 1
+FLAG_R18G = 2
+FLAG_AI = 4
+FLAG_MISSING = 8  # 没有插画信息（既没有加载Illust也没有IllustSummary）
+
+
+def illust_flags(summary: Union[Illust, IllustSummary, None]) -> int:
+    """
+    :return: 插画的FLAG_*的按位或
+    """
+    if summary is None:
+        return FLAG_MISSING
+
+    f = 0
+    if summary.has_tag("R-18"):
+        f |= FLAG_R18
+    if summary.has_tag("R-18G"):
+        f |= FLAG_R18G
+    if summary.illust_ai_type != 0:
+        f |= FLAG_AI
+    return f
+
+
+class IllustColumns:
+    """
+    插画列表的列式表示，随机抽取与R-18过滤直接在这些数组上进行向量运算
+    """
+
+    def __init__(self, illusts: Sequence[LazyIllust],
+                 bookmarks: np.ndarray, views: np.ndarray, create_timestamps: np.ndarray, flags: np.ndarray):
+        self.illusts = illusts
+        self.bookmarks = bookmarks
+        self.views = views
+        self.create_timestamps = create_timestamps
+        self.flags = flags
+
+    @classmethod
+    def build(cls, illusts: Sequence[LazyIllust]) -> "IllustColumns":
+        n = len(illusts)
+        bookmarks = np.zeros(n, dtype=np.int64)
+        views = np.zeros(n, dtype=np.int64)
+        create_timestamps = np.zeros(n, dtype=np.float64)
+        flags = np.zeros(n, dtype=np.uint8)
+
+        for i, x in enumerate(illusts):
+            s = x.summary
+            if s is None:
+                flags[i] = FLAG_MISSING
+                continue
+
+            bookmarks[i] = s.total_bookmarks
+            views[i] = s.total_view
+            if isinstance(s, IllustSummary):
+                create_timestamps[i] = s.create_timestamp
+            else:
+                create_timestamps[i] = s.create_date.timestamp()
+
+            flags[i] = illust_flags(s)
+
+        return cls(illusts, bookmarks, views, create_timestamps, flags)
+
+    def __len__(self):
+        return len(self.illusts)
+
+    def matches(self, illusts: Sequence[LazyIllust]) -> bool:
+        """
+        判断是否由同一个列表（同样的LazyIllust对象）构建
+        """
+        return len(illusts) == len(self.illusts) and all(map(operator.is_, illusts, self.illusts))
+
+    def exclude(self, flags: int) -> np.ndarray:
+        """
+        :param flags: 要排除的FLAG_*的按位或
+        :return: 保留的下标
+        """
+        if flags == 0:
+            return np.arange(len(self))
+        return np.flatnonzero((self.flags & flags) == 0)
+
+    @property
+    def missing(self) -> np.ndarray:
+        return (self.flags & FLAG_MISSING) != 0
+
+
+__all__ = ("IllustColumns", "illust_flags", "FLAG_R18", "FLAG_R18G", "FLAG_AI", "FLAG_MISSING")
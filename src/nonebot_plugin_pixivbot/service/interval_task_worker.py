@@ -46,14 +46,14 @@ class IntervalTaskWorker(ABC, Generic[T]):
         return f'{cls.tag} {item.subscriber.get_id(SessionIdType.GROUP)} {item.code}'
 
     @abstractmethod
-    async def _handle_trigger(self, item: T):
+    async def _handle_trigger(self, item: T, **kwargs):
         ...
 
-    async def _on_trigger(self, item: T):
+    async def _on_trigger(self, item: T, **kwargs):
         logger.info(f"[{self.tag}] triggered \"{item}\"")
 
         try:
-            await self._handle_trigger(item)
+            await self._handle_trigger(item, **kwargs)
         except ActionFailed as e:
             logger.opt(exception=e).error(f"[{self.tag}] action failed when handling task \"{item.code}\"")
 
@@ -1,76 +1,191 @@
-from typing import List, Union, Tuple, Iterable, Sequence
+from asyncio import gather, create_task, Task
+from datetime import date
+from typing import List, Union, Tuple, Sequence, Hashable, AsyncGenerator, Dict, Optional
 
+from cachetools import LRUCache
 from nonebot import logger
 
 from nonebot_plugin_pixivbot.config import Config
 from nonebot_plugin_pixivbot.data.local_tag import LocalTagRepo
 from nonebot_plugin_pixivbot.data.pixiv_repo import LazyIllust, PixivRepo
+from nonebot_plugin_pixivbot.data.pixiv_repo.models import PixivRepoMetadata
 from nonebot_plugin_pixivbot.enums import RandomIllustMethod, RankingMode
 from nonebot_plugin_pixivbot.global_context import context
 from nonebot_plugin_pixivbot.model import Illust, User
-from nonebot_plugin_pixivbot.service.roulette import roulette
+from nonebot_plugin_pixivbot.service.illust_columns import IllustColumns, FLAG_R18, FLAG_R18G, FLAG_MISSING
+from nonebot_plugin_pixivbot.service.roulette import roulette, stream_roulette
+from nonebot_plugin_pixivbot.utils.coros import aclosing
 from nonebot_plugin_pixivbot.utils.errors import BadRequestError, QueryError
+from nonebot_plugin_pixivbot.utils.request_priority import RequestPriority, request_priority
 
 conf = context.require(Config)
 repo = context.require(PixivRepo)
 local_tags = context.require(LocalTagRepo)
 
 
+class _ProgressiveLoad:
+    __slots__ = ("task", "pages")
+
+    def __init__(self):
+        self.task: Task = None
+        self.pages = 0  # 后台已加载的页数（含前台加载的部分）
+
+
 @context.register_singleton()
 class PixivService:
+    def __init__(self):
+        # 同一个缓存列表（shared_agen重放出的是同样的LazyIllust对象）只构建一次列式表示
+        self._columns_cache = LRUCache[Hashable, IllustColumns](maxsize=64)
+        # 正在后台加载剩余部分的列表
+        self._progressive_loads: Dict[Hashable, _ProgressiveLoad] = {}
+        # 已完整加载（写入本地缓存）的列表，之后的请求不再只读取前几页
+        self._completed_loads = LRUCache[Hashable, bool](maxsize=1024)
 
     @staticmethod
-    def _handle_r18(illusts: Iterable[LazyIllust],
-                    exclude_r18: bool = False,
-                    exclude_r18g: bool = False) -> Iterable[LazyIllust]:
+    def _handle_r18(exclude_r18: bool = False,
+                    exclude_r18g: bool = False) -> int:
+        # 返回要排除的FLAG_*
         if not exclude_r18 and not exclude_r18g:
-            return illusts
-        else:
-            def _():
-                for x in illusts:
-                    if not x.loaded:
-                        continue
-                    if x.content.has_tag("R-18") and exclude_r18:
-                        continue
-                    if x.content.has_tag("R-18G") and exclude_r18g:
-                        continue
-                    yield x
+            return 0
+
+        flags = FLAG_MISSING
+        if exclude_r18:
+            flags |= FLAG_R18
+        if exclude_r18g:
+            flags |= FLAG_R18G
+        return flags
 
-            return _()
+    def _get_columns(self, key: Hashable, illusts: Sequence[LazyIllust]) -> IllustColumns:
+        columns = self._columns_cache.get(key, None)
+        if columns is None or not columns.matches(illusts):
+            columns = IllustColumns.build(illusts)
+            self._columns_cache[key] = columns
+        return columns
 
-    async def _choice_and_load(self, illusts: Sequence[LazyIllust], random_method: RandomIllustMethod, count: int) \
-            -> List[Illust]:
+    async def _choice_and_load(self, key: Hashable, illusts: Sequence[LazyIllust],
+                               random_method: RandomIllustMethod, count: int,
+                               exclude_flags: int = 0) -> List[Illust]:
         if count <= 0:
             raise BadRequestError("不合法的请求数量")
         if count > conf.pixiv_max_item_per_query:
             raise BadRequestError("数量超过单次请求上限")
-        if count > len(illusts):
+
+        columns = self._get_columns(key, illusts)
+        indices = columns.exclude(exclude_flags)
+        if count > len(indices):
             raise QueryError("别看了，没有的。")
 
-        winners = roulette(illusts, random_method, count)
+        winners = roulette(illusts, random_method, count, columns=columns, indices=indices)
         logger.info(f"[pixiv_service] choice {[x.id for x in winners]}")
-        return [await x.get() for x in winners]
-
-    async def illust_ranking(self, mode: RankingMode, range: Tuple[int, int]) -> List[Illust]:
-        # range 下标从1开始 闭区间
-        i = 1
-        li = []
-        async for x in repo.illust_ranking(mode):
-            if i > range[1]:
-                break
-            elif i >= range[0]:
-                li.append(await x.get())
-            i += 1
-        return li
+        # 并发get，由LazyIllust合并为一次批量查询
+        return list(await gather(*[x.get() for x in winners]))
+
+    async def _choice_and_load_stream(self, agen: AsyncGenerator[LazyIllust, None],
+                                      random_method: RandomIllustMethod, count: int,
+                                      exclude_flags: int = 0) -> List[Illust]:
+        if count <= 0:
+            raise BadRequestError("不合法的请求数量")
+        if count > conf.pixiv_max_item_per_query:
+            raise BadRequestError("数量超过单次请求上限")
+
+        async with aclosing(agen):
+            winners, n = await stream_roulette(agen, random_method, count, exclude_flags)
+        if count > n:
+            raise QueryError("别看了，没有的。")
+
+        logger.info(f"[pixiv_service] choice {[x.id for x in winners]} (streaming from {n} illusts)")
+        return list(await gather(*[x.get() for x in winners]))
+
+    async def _random(self, key: Hashable, agen: AsyncGenerator[LazyIllust, None],
+                      random_method: RandomIllustMethod, count: int,
+                      exclude_flags: int = 0) -> List[Illust]:
+        if conf.pixiv_random_streaming_sampling:
+            return await self._choice_and_load_stream(agen, random_method, count, exclude_flags)
+        else:
+            illusts = [x async for x in agen]
+            return await self._choice_and_load(key, illusts, random_method, count, exclude_flags)
+
+    async def _progressively(self, key: Hashable,
+                             agen: AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]) \
+            -> AsyncGenerator[LazyIllust, None]:
+        """
+        只产出列表的前pixiv_random_progressive_pages页（若后台已加载了更多则产出到后台已加载的位置），
+        剩余部分在后台继续加载（写入本地缓存），之后的请求即可从完整的列表中抽取。
+        注意：列表加载完整之前的抽选结果偏向前几页（用户插画中较新的作品、书签中较新收藏的作品）
+
+        :param key: 列表的标识
+        :param agen: 列表的agen（需产出PixivRepoMetadata用于按页计数，经过滤后每页的数量不定），由本方法负责关闭
+        """
+        if conf.pixiv_random_progressive_pages <= 0 or key in self._completed_loads:
+            async with aclosing(agen):
+                async for x in agen:
+                    if not isinstance(x, PixivRepoMetadata):
+                        yield x
+            return
+
+        load = self._progressive_loads.get(key, None)
+        limit = conf.pixiv_random_progressive_pages
+        if load is not None:
+            limit = max(limit, load.pages)
+
+        pages = 0
+        try:
+            async for x in agen:
+                if isinstance(x, PixivRepoMetadata):
+                    # 本地缓存的部分只在开头与末尾各有一个metadata，pages为累计的页数
+                    pages = x.pages
+                    if pages >= limit:
+                        break
+                else:
+                    yield x
+            else:
+                # 已加载完整的列表
+                self._completed_loads[key] = True
+                return
+        except BaseException:
+            await agen.aclose()
+            raise
+
+        if load is not None:
+            # 已有后台任务在加载同一个列表（共享同一个shared_agen），不再重复加载
+            await agen.aclose()
+        else:
+            load = _ProgressiveLoad()
+            load.pages = pages
+            self._progressive_loads[key] = load
+            with request_priority(RequestPriority.background):
+                load.task = create_task(self._load_rest(key, load, agen))
+
+        logger.info(f"[pixiv_service] {key}: answer from the first {pages} pages, "
+                    f"the rest is loading in background")
+
+    async def _load_rest(self, key: Hashable, load: _ProgressiveLoad,
+                         agen: AsyncGenerator[Union[LazyIllust, PixivRepoMetadata], None]):
+        try:
+            async for x in agen:
+                if isinstance(x, PixivRepoMetadata):
+                    load.pages = x.pages
+            self._completed_loads[key] = True
+            logger.info(f"[pixiv_service] {key}: loaded {load.pages} pages in background")
+        except Exception as e:
+            logger.opt(exception=e).warning(f"[pixiv_service] {key}: error occurred when loading in background")
+        finally:
+            await agen.aclose()
+            if self._progressive_loads.get(key, None) is load:
+                del self._progressive_loads[key]
+
+    async def illust_ranking(self, mode: RankingMode, range: Tuple[int, int],
+                             date: Optional[date] = None) -> List[Illust]:
+        # range 下标从1开始 闭区间，只加载这一段所在的页；date为None时取已发布的最新一期
+        li = [x async for x in repo.illust_ranking_range(mode, range, date)]
+        return list(await gather(*[x.get() for x in li]))
 
     async def illust_detail(self, illust: int) -> Illust:
         async for x in repo.illust_detail(illust):
             return x
 
-    async def random_illust(self, word: str,
-                            *, count: int = 1,
-                            exclude_r18: bool = False,
-                            exclude_r18g: bool = False) -> List[Illust]:
+    @staticmethod
+    async def _translate_word(word: str) -> str:
         if conf.pixiv_tag_translation_enabled:
             # 只有原word不是标签时获取翻译（例子：唐可可）
             tag = await local_tags.find_by_name(word)
@@ -79,10 +194,17 @@ class PixivService:
                 if tag:
                     logger.info(f"[pixiv_service] found translation {word} -> {tag.name}")
                     word = tag.name
+        return word
 
-        illusts = [x async for x in repo.search_illust(word)]
-        illusts = self._handle_r18(illusts, exclude_r18, exclude_r18g)
-        return await self._choice_and_load(list(illusts), conf.pixiv_random_illust_method, count)
+    async def random_illust(self, word: str,
+                            *, count: int = 1,
+                            exclude_r18: bool = False,
+                            exclude_r18g: bool = False) -> List[Illust]:
+        word = await self._translate_word(word)
+
+        return await self._random(("search_illust", word), repo.search_illust(word),
+                                  conf.pixiv_random_illust_method, count,
+                                  self._handle_r18(exclude_r18, exclude_r18g))
 
     async def get_user(self, user: Union[str, int]) -> User:
         if isinstance(user, str):
@@ -100,24 +222,26 @@ class PixivService:
                                  exclude_r18g: bool = False) -> Tuple[User, List[Illust]]:
         user = await self.get_user(user)
 
-        illusts = [x async for x in repo.user_illusts(user.id)]
-        illusts = self._handle_r18(illusts, exclude_r18, exclude_r18g)
-        illust = await self._choice_and_load(list(illusts), conf.pixiv_random_user_illust_method, count)
+        key = ("user_illusts", user.id)
+        illust = await self._random(key, self._progressively(key, repo.user_illusts(user.id, with_metadata=True)),
+                                    conf.pixiv_random_user_illust_method, count,
+                                    self._handle_r18(exclude_r18, exclude_r18g))
         return user, illust
 
     async def random_recommended_illust(self, *, count: int = 1,
                                         exclude_r18: bool = False,
                                         exclude_r18g: bool = False) -> List[Illust]:
-        illusts = [x async for x in repo.recommended_illusts()]
-        return await self._choice_and_load(illusts, conf.pixiv_random_recommended_illust_method, count)
+        return await self._random(("recommended_illusts",), repo.recommended_illusts(),
+                                  conf.pixiv_random_recommended_illust_method, count)
 
     async def random_bookmark(self, pixiv_user_id: int = 0,
                               *, count: int = 1,
                               exclude_r18: bool = False,
                               exclude_r18g: bool = False) -> List[Illust]:
-        illusts = [x async for x in repo.user_bookmarks(pixiv_user_id)]
-        illusts = self._handle_r18(illusts, exclude_r18, exclude_r18g)
-        return await self._choice_and_load(list(illusts), conf.pixiv_random_bookmark_method, count)
+        key = ("user_bookmarks", pixiv_user_id)
+        return await self._random(key, self._progressively(key, repo.user_bookmarks(pixiv_user_id, with_metadata=True)),
+                                  conf.pixiv_random_bookmark_method, count,
+                                  self._handle_r18(exclude_r18, exclude_r18g))
 
     async def random_related_illust(self, illust_id: int,
                                     *, count: int = 1,
@@ -126,9 +250,32 @@ class PixivService:
         if illust_id == 0:
             raise BadRequestError("你还没有发送过请求")
 
-        illusts = [x async for x in repo.related_illusts(illust_id)]
-        illusts = self._handle_r18(illusts, exclude_r18, exclude_r18g)
-        return await self._choice_and_load(list(illusts), conf.pixiv_random_related_illust_method, count)
+        return await self._random(("related_illusts", illust_id), repo.related_illusts(illust_id),
+                                  conf.pixiv_random_related_illust_method, count,
+                                  self._handle_r18(exclude_r18, exclude_r18g))
+
+    # ================ prewarm ================
+    # 在定时推送触发前加载随机抽取所用的列表（经过shared_agen_mgr，触发时直接重放），并构建列式表示
+    async def prewarm_random_illust(self, word: str):
+        word = await self._translate_word(word)
+        illusts = [x async for x in repo.search_illust(word)]
+        self._get_columns(("search_illust", word), illusts)
+
+    async def prewarm_random_user_illust(self, user: Union[str, int]):
+        user = await self.get_user(user)
+        illusts = [x async for x in repo.user_illusts(user.id)]
+        self._get_columns(("user_illusts", user.id), illusts)
+        # 已加载完整的列表，之后的抽选不再只从前几页中抽取
+        self._completed_loads[("user_illusts", user.id)] = True
+
+    async def prewarm_random_recommended_illust(self):
+        illusts = [x async for x in repo.recommended_illusts()]
+        self._get_columns(("recommended_illusts",), illusts)
+
+    async def prewarm_random_bookmark(self, pixiv_user_id: int = 0):
+        illusts = [x async for x in repo.user_bookmarks(pixiv_user_id)]
+        self._get_columns(("user_bookmarks", pixiv_user_id), illusts)
+        self._completed_loads[("user_bookmarks", pixiv_user_id)] = True
 
 
 __all__ = ("PixivService",)
@@ -91,11 +91,19 @@ class Postman:
 
             await self._post(msg, session, event)
 
+    def is_forward_message(self, session: Session, n_messages: int) -> bool:
+        """
+        判断post_illusts是否会以合并转发消息的形式发送
+        :param session: 会话
+        :param n_messages: 消息条数
+        """
+        return not (session.bot_type != "OneBot V11" or
+                    conf.pixiv_send_forward_message == 'never' or
+                    conf.pixiv_send_forward_message == 'auto' and n_messages == 1)
+
     async def post_illusts(self, model: IllustMessagesModel, session: Session, event: Optional[Event] = None):
         async with self._feedback_on_action_failed():
-            if (session.bot_type != "OneBot V11" or
-                    conf.pixiv_send_forward_message == 'never' or
-                    conf.pixiv_send_forward_message == 'auto' and len(model.messages) == 1):
+            if not self.is_forward_message(session, len(model.messages)):
                 for x in model.flat():
                     await self.post_illust(x, session, event)
             else:
@@ -0,0 +1,65 @@
+from asyncio import gather
+from datetime import date
+from functools import partial
+
+import pytz
+from apscheduler.triggers.cron import CronTrigger
+from nonebot import logger
+from nonebot_plugin_apscheduler import scheduler as apscheduler
+
+from ..config import Config
+from ..data.pixiv_repo import PixivRepo
+from ..enums import RankingMode
+from ..global_context import context
+from ..utils.lifecycler import on_startup
+from ..utils.ranking_date import latest_ranking_date
+from ..utils.request_priority import RequestPriority, request_priority
+
+conf = context.require(Config)
+
+
+@context.register_eager_singleton()
+class RankingRollover:
+    """
+    每天Pixiv发布新一期榜单后，在后台并发获取所有类型的榜单（写入本地缓存），
+    之后当天的榜单查询不再请求远端
+    """
+
+    job_id = "pixivbot_ranking_rollover"
+
+    def __init__(self):
+        if conf.pixiv_ranking_query_enabled and conf.pixiv_ranking_rollover_fetch:
+            rollover = conf.pixiv_ranking_rollover_time
+            on_startup(replay=True)(
+                partial(
+                    apscheduler.add_job,
+                    self.fetch_all,
+                    id=self.job_id,
+                    trigger=CronTrigger(hour=rollover.hour, minute=rollover.minute,
+                                        timezone=pytz.timezone("Asia/Tokyo")),
+                    max_instances=1
+                )
+            )
+
+    @staticmethod
+    async def _fetch(mode: RankingMode, d: date) -> int:
+        cnt = 0
+        async for _ in context.require(PixivRepo).illust_ranking(mode, d):
+            cnt += 1
+        return cnt
+
+    async def fetch_all(self):
+        d = latest_ranking_date(conf.pixiv_ranking_rollover_time)
+        logger.info(f"[ranking_rollover] fetching all rankings of {d}")
+
+        with request_priority(RequestPriority.background):
+            results = await gather(*[self._fetch(mode, d) for mode in RankingMode], return_exceptions=True)
+
+        for mode, result in zip(RankingMode, results):
+            if isinstance(result, BaseException):
+                logger.opt(exception=result).warning(f"[ranking_rollover] failed to fetch {mode.name} ranking of {d}")
+            else:
+                logger.success(f"[ranking_rollover] fetched {mode.name} ranking of {d} ({result} illusts)")
+
+
+__all__ = ("RankingRollover",)
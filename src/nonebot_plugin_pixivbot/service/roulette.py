@@ -1,67 +1,46 @@
+import heapq
+import math
+import random
+import sys
 from time import time
-from typing import Sequence
+from typing import Sequence, Optional, AsyncIterable, List, Tuple
 
 import numpy as np
 
 from nonebot_plugin_pixivbot.data.pixiv_repo import LazyIllust
 from nonebot_plugin_pixivbot.enums import RandomIllustMethod
+from nonebot_plugin_pixivbot.model import IllustSummary
+from .illust_columns import IllustColumns, illust_flags
 
 
-def uniform(illusts: Sequence[LazyIllust]) -> np.ndarray:
+def uniform(columns: IllustColumns, indices: np.ndarray) -> np.ndarray:
     # 概率相等
-    n = len(illusts)
+    n = len(indices)
     return np.ones(n) / n
 
 
-def bookmark_proportion(illusts: Sequence[LazyIllust]) -> np.ndarray:
+def bookmark_proportion(columns: IllustColumns, indices: np.ndarray) -> np.ndarray:
     # 概率正比于书签数
-    n = len(illusts)
-    p = np.zeros(n)
-
-    for i, x in enumerate(illusts):
-        if x.loaded:
-            p[i] = x.content.total_bookmarks + 10  # 加10平滑
-        else:
-            p[i] = 10
-
-    p = np.array(p)
+    p = np.where(columns.missing[indices], 0, columns.bookmarks[indices]) + 10  # 加10平滑
     return p / np.sum(p)
 
 
-def view_proportion(illusts: Sequence[LazyIllust]) -> np.ndarray:
+def view_proportion(columns: IllustColumns, indices: np.ndarray) -> np.ndarray:
     # 概率正比于查看人数
-    n = len(illusts)
-    p = np.zeros(n)
-
-    for i, x in enumerate(illusts):
-        if x.loaded:
-            p[i] = x.content.total_view + 10  # 加10平滑
-        else:
-            p[i] = 10
-
-    p = np.array(p)
+    p = np.where(columns.missing[indices], 0, columns.views[indices]) + 10  # 加10平滑
     return p / np.sum(p)
 
 
-def timedelta_proportion(illusts: Sequence[LazyIllust]) -> np.ndarray:
+def timedelta_proportion(columns: IllustColumns, indices: np.ndarray) -> np.ndarray:
     # 概率正比于 exp(归一化后的画像发布时间差)
-    n = len(illusts)
-    p = np.zeros(n)
-
-    now = time()
-    min_p = 0
-    for i, x in enumerate(illusts):
-        if x.loaded:
-            p[i] = x.create_date.timestamp() - now
-            if p[i] < min_p:
-                min_p = p[i]
-        else:
-            p[i] = float("-inf")
+    missing = columns.missing[indices]
+    p = columns.create_timestamps[indices] - time()
 
+    min_p = min(np.min(p, initial=0, where=~missing), 0)
     if min_p == 0:
-        return uniform(illusts)
+        return uniform(columns, indices)
     else:
-        p = p / -min_p  # 归一化
+        p = np.where(missing, float("-inf"), p / -min_p)  # 归一化
         p = np.exp(p)
         return p / np.sum(p)
 
@@ -74,13 +53,156 @@ p_gen = {
 }
 
 
-def roulette(illusts: Sequence[LazyIllust], random_method: RandomIllustMethod, k: int) -> Sequence[LazyIllust]:
-    n = len(illusts)
-    p = p_gen[random_method](illusts)
-
+def roulette(illusts: Sequence[LazyIllust], random_method: RandomIllustMethod, k: int,
+             *, columns: Optional[IllustColumns] = None,
+             indices: Optional[np.ndarray] = None) -> Sequence[LazyIllust]:
+    """
+    :param illusts: 插画列表
+    :param random_method: 随机方法
+    :param k: 抽取数量
+    :param columns: illusts的列式表示，不提供时现场构建
+    :param indices: 参与抽取的下标（例如经过R-18过滤），不提供时为全部
+    """
+    if columns is None:
+        columns = IllustColumns.build(illusts)
+    if indices is None:
+        indices = np.arange(len(illusts))
+
+    n = len(indices)
     if n <= k:
-        return illusts
+        return [illusts[i] for i in indices]
+
+    p = p_gen[random_method](columns, indices)
 
     rng = np.random.default_rng()
     winners = rng.choice(n, k, False, p)
-    return [illusts[c] for c in winners]
+    return [illusts[indices[c]] for c in winners]
+
+
+# ================ 流式抽取 ================
+# 只遍历一次agen，不构建列表，内存为O(k)（timedelta_proportion为期望O(k log n)）
+
+def _weight(random_method: RandomIllustMethod, x: LazyIllust) -> float:
+    if random_method == RandomIllustMethod.uniform:
+        return 1.0
+
+    s = x.summary
+    if s is None:
+        return 10.0  # 与bookmark_proportion、view_proportion相同，缺失信息的插画按0计再加10平滑
+    elif random_method == RandomIllustMethod.bookmark_proportion:
+        return s.total_bookmarks + 10.0
+    else:
+        return s.total_view + 10.0
+
+
+def _log_random() -> float:
+    # log(U)，U~(0, 1]
+    return math.log(1.0 - random.random())
+
+
+async def _weighted_reservoir(illusts: AsyncIterable[LazyIllust], random_method: RandomIllustMethod, k: int,
+                              exclude_flags: int) -> Tuple[List[LazyIllust], int]:
+    # A-ExpJ（Efraimidis & Spirakis）：每项的key为U^(1/w)，保留key最大的k项；
+    # 水库满后按阈值直接算出下一个会进入水库的位置，跳过中间的项。为避免下溢，key取对数
+    heap = []  # (log key, 序号, 插画)，堆顶为水库中key最小的项
+    n = 0
+    skip = 0.0  # 还要跳过的权重
+
+    async for x in illusts:
+        if exclude_flags != 0 and illust_flags(x.summary) & exclude_flags != 0:
+            continue
+
+        n += 1
+        w = _weight(random_method, x)
+        if len(heap) < k:
+            heapq.heappush(heap, (_log_random() / w, n, x))
+            if len(heap) == k:
+                skip = _log_random() / heap[0][0] if heap[0][0] < 0 else math.inf
+            continue
+
+        skip -= w
+        if skip > 0:
+            continue
+
+        # 该项必然进入水库，其key服从(T^w, 1)上的均匀分布再开w次方（T^w下溢为0时取最小的正浮点数，避免log(0)）
+        t_w = max(math.exp(heap[0][0] * w), sys.float_info.min)
+        log_key = math.log(random.uniform(t_w, 1.0)) / w
+        heapq.heapreplace(heap, (log_key, n, x))
+        skip = _log_random() / heap[0][0] if heap[0][0] < 0 else math.inf
+
+    heap.sort(reverse=True)
+    return [x for _, _, x in heap], n
+
+
+def _create_timestamp(x: LazyIllust) -> Optional[float]:
+    s = x.summary
+    if s is None:
+        return None
+    elif isinstance(s, IllustSummary):
+        return s.create_timestamp
+    else:
+        return s.create_date.timestamp()
+
+
+async def _timedelta_skyline(illusts: AsyncIterable[LazyIllust], k: int,
+                             exclude_flags: int) -> Tuple[List[LazyIllust], int]:
+    # Gumbel-top-k：key为log(p)+Gumbel噪声的前k项即为按p的不放回抽样。
+    # 这里log(p) = -age/D，而归一化系数D（最早的发布时间差）要遍历完才知道，
+    # 因此保留所有“Gumbel噪声不低于它且发布时间不早于它的项”少于k个的候选（k-skyline），
+    # 无论D取何值，被k个候选支配的项都不可能进入前k
+    now = time()
+    candidates = []  # [Gumbel噪声, 发布时间差, 被支配次数, 插画]
+    max_age = 0.0
+    n = 0
+
+    async for x in illusts:
+        if exclude_flags != 0 and illust_flags(x.summary) & exclude_flags != 0:
+            continue
+
+        n += 1
+        ts = _create_timestamp(x)
+        age = now - ts if ts is not None else math.inf  # 缺失信息的插画概率为0，只在不足k项时补齐
+        if age != math.inf:
+            max_age = max(max_age, age)
+
+        g = -math.log(random.expovariate(1.0))  # Gumbel噪声
+        dominated = 0
+        for c in candidates:
+            if c[0] >= g and c[1] <= age:
+                dominated += 1
+        if dominated >= k:
+            continue
+
+        for c in candidates:
+            if g >= c[0] and age <= c[1]:
+                c[2] += 1
+        candidates = [c for c in candidates if c[2] < k]
+        candidates.append([g, age, dominated, x])
+
+    def key(c):
+        if c[1] == math.inf:
+            return -math.inf, c[0]
+        elif max_age == 0:
+            return c[0], c[0]
+        else:
+            return c[0] - c[1] / max_age, c[0]
+
+    candidates.sort(key=key, reverse=True)
+    return [c[3] for c in candidates[:k]], n
+
+
+async def stream_roulette(illusts: AsyncIterable[LazyIllust], random_method: RandomIllustMethod, k: int,
+                          exclude_flags: int = 0) -> Tuple[List[LazyIllust], int]:
+    """
+    流式地从illusts中按random_method不放回地抽取k个，只遍历一次且不保留整个列表
+
+    :param illusts: 插画的异步迭代器
+    :param random_method: 随机方法
+    :param k: 抽取数量
+    :param exclude_flags: 要排除的FLAG_*的按位或
+    :return: (抽中的插画, 参与抽取的插画数)
+    """
+    if random_method == RandomIllustMethod.timedelta_proportion:
+        return await _timedelta_skyline(illusts, k, exclude_flags)
+    else:
+        return await _weighted_reservoir(illusts, random_method, k, exclude_flags)
@@ -9,18 +9,24 @@ import pytz
 from apscheduler.triggers.base import BaseTrigger
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
+from nonebot import logger
+from nonebot_plugin_apscheduler import scheduler as apscheduler
 from nonebot_plugin_session import Session
 
 from .interval_task_worker import IntervalTaskWorker
+from ..config import Config
 from ..data.subscription import SubscriptionRepo
 from ..global_context import context
 from ..model import Subscription
 from ..model.subscription import ScheduleType, IntervalSchedule, CronSchedule
 from ..utils.errors import BadRequestError
+from ..utils.request_priority import RequestPriority, request_priority
 
 if TYPE_CHECKING:
     from nonebot_plugin_pixivbot.handler.base import Handler
 
+conf = context.require(Config)
+
 # === interval schedule ===
 reg_interval_schedule_start_only = re.compile(r'(\d+):(\d+)')
 reg_interval_schedule_interval_only = re.compile(r'(\d+):(\d+)\*x')
@@ -90,6 +96,27 @@ def parse_schedule(raw_schedule: str) -> Union[IntervalSchedule, CronSchedule]:
     return schedule
 
 
+class LeadTrigger(BaseTrigger):
+    """
+    比原trigger提前lead触发
+    """
+
+    def __init__(self, trigger: BaseTrigger, lead: timedelta):
+        self.trigger = trigger
+        self.lead = lead
+
+    def get_next_fire_time(self, previous_fire_time: Optional[datetime], now: datetime) -> Optional[datetime]:
+        if previous_fire_time is not None:
+            previous_fire_time = previous_fire_time + self.lead
+        next_fire_time = self.trigger.get_next_fire_time(previous_fire_time, now + self.lead)
+        if next_fire_time is not None:
+            next_fire_time = next_fire_time - self.lead
+        return next_fire_time
+
+    def __str__(self):
+        return f"{self.trigger} (lead {self.lead})"
+
+
 @context.register_eager_singleton()
 class Scheduler(IntervalTaskWorker[Subscription]):
     tag = "scheduler"
@@ -118,6 +145,42 @@ class Scheduler(IntervalTaskWorker[Subscription]):
         handler_type = self._get_handler_type(item.type)
         await handler_type(item.subscriber, silently=True).handle_with_parsed_args(**item.kwargs)
 
+    async def _on_prewarm(self, item: Subscription):
+        logger.debug(f"[{self.tag}] prewarming \"{item}\"")
+
+        try:
+            handler_type = self._get_handler_type(item.type)
+            with request_priority(RequestPriority.background):
+                await handler_type(item.subscriber, silently=True).prewarm(**item.kwargs)
+        except Exception as e:
+            # 预加载失败不影响正式触发
+            logger.opt(exception=e).warning(f"[{self.tag}] error occurred when prewarming \"{item.code}\"")
+
+    @classmethod
+    def _make_prewarm_job_id(cls, item: Subscription):
+        return cls._make_job_id(item) + " prewarm"
+
+    def _add_job(self, item: Subscription):
+        super()._add_job(item)
+
+        if conf.pixiv_schedule_prewarm_lead_time <= 0:
+            return
+
+        job_id = self._make_prewarm_job_id(item)
+        if apscheduler.get_job(job_id) is None:
+            trigger = LeadTrigger(self._make_job_trigger(item),
+                                  timedelta(seconds=conf.pixiv_schedule_prewarm_lead_time))
+            apscheduler.add_job(self._on_prewarm, id=job_id, trigger=trigger, args=[item])
+            logger.debug(f"[{self.tag}] added job \"{job_id}\"")
+
+    def _remove_job(self, item: Subscription):
+        super()._remove_job(item)
+
+        job_id = self._make_prewarm_job_id(item)
+        if apscheduler.get_job(job_id) is not None:
+            apscheduler.remove_job(job_id)
+            logger.debug(f"[{self.tag}] removed job \"{job_id}\"")
+
     def _make_job_trigger(self, item: Subscription) -> BaseTrigger:
         if isinstance(item.schedule, IntervalSchedule):
             offset_hour, offset_minute, hours, minutes = item.schedule
@@ -4,6 +4,7 @@ from typing import Dict, Any, overload, Type, TYPE_CHECKING
 from apscheduler.triggers.interval import IntervalTrigger
 from nonebot_plugin_session import Session
 
+from .artist_poller import ArtistPoller
 from .interval_task_worker import IntervalTaskWorker
 from ..config import Config
 from ..data.watch_task import WatchTaskRepo
@@ -25,6 +26,11 @@ class Watchman(IntervalTaskWorker[WatchTask]):
         WatchType.following_illusts: lambda item: hash(item.subscriber.id1),
     }
 
+    def __init__(self):
+        # user_illusts类型的task不单独添加job，而是由ArtistPoller按画师合并轮询
+        self._poller = ArtistPoller(lambda item, illusts: self._on_trigger(item, illusts=illusts))
+        super().__init__()
+
     @property
     def repo(self) -> WatchTaskRepo:
         return context.require(WatchTaskRepo)
@@ -38,11 +44,11 @@ class Watchman(IntervalTaskWorker[WatchTask]):
         elif type == WatchType.following_illusts:
             return WatchFollowingIllustsHandler
 
-    async def _handle_trigger(self, item: WatchTask, manually: bool = False):
+    async def _handle_trigger(self, item: WatchTask, manually: bool = False, **kwargs):
         try:
             handler_type = self._get_handler_type(item.type)
             handler = handler_type(item.subscriber, silently=not manually, disable_interceptors=manually)
-            await handler.handle_with_parsed_args(task=item)
+            await handler.handle_with_parsed_args(task=item, **kwargs)
         finally:
             # 保存checkpoint，避免一次异常后下一次重复推送
             # 但是会存在丢失推送的问题
@@ -58,6 +64,18 @@ class Watchman(IntervalTaskWorker[WatchTask]):
         trigger = IntervalTrigger(seconds=conf.pixiv_watch_interval, start_date=yesterday)
         return trigger
 
+    def _add_job(self, item: WatchTask):
+        if item.type == WatchType.user_illusts:
+            self._poller.add(self._make_job_id(item), item)
+        else:
+            super()._add_job(item)
+
+    def _remove_job(self, item: WatchTask):
+        if item.type == WatchType.user_illusts:
+            self._poller.remove(self._make_job_id(item), item)
+        else:
+            super()._remove_job(item)
+
     async def _build_task(self, type_: WatchType,
                           kwargs: Dict[str, Any],
                           session: Session) -> WatchTask:
@@ -1,4 +1,6 @@
-from typing import Iterable, List
+from typing import Iterable, List, Sequence, TypeVar
+
+T = TypeVar("T")
 
 
 def as_unique(iterable: Iterable) -> List:
@@ -11,3 +13,8 @@ def as_unique(iterable: Iterable) -> List:
             s.add(x)
 
     return li
+
+
+def chunked(seq: Sequence[T], size: int) -> Iterable[Sequence[T]]:
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
@@ -1,5 +1,7 @@
+from contextlib import asynccontextmanager
 from functools import wraps
 from inspect import isawaitable
+from typing import AsyncGenerator, AsyncIterator
 
 
 def as_async(f):
@@ -11,3 +13,14 @@ def as_async(f):
         return x
 
     return wrapper
+
+
+@asynccontextmanager
+async def aclosing(agen: AsyncGenerator) -> AsyncIterator[AsyncGenerator]:
+    """
+    退出时关闭agen（contextlib.aclosing需要Python 3.10）
+    """
+    try:
+        yield agen
+    finally:
+        await agen.aclose()
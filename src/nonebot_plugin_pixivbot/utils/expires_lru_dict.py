@@ -87,7 +87,12 @@ class AsyncExpiresLruDict(Generic[_KT, _VT]):
     async def get(self, key: _KT) -> _VT:
         await self._collate(False)
         node = self._data.get(key, None)
-        return node.value if node else None
+        if node is None:
+            return None
+
+        # 命中时移到末尾，容量已满时淘汰最久未使用的
+        self._data.move_to_end(key)
+        return node.value
 
     async def len(self) -> int:
         await self._collate(False)
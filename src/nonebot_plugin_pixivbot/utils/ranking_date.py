@@ -0,0 +1,35 @@
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Optional
+
+# Pixiv排行榜按日本时间（UTC+9）划分日期
+JST = timezone(timedelta(hours=9))
+
+
+def latest_ranking_date(rollover: time, now: Optional[datetime] = None) -> date:
+    """
+    Pixiv每天在固定时间发布前一天的排行榜，发布后该期排行榜不再改变
+
+    :param rollover: 每天发布排行榜的时间（日本时间）
+    :param now: 当前时间，为None时取现在
+    :return: 已发布的最新一期排行榜的日期
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    now = now.astimezone(JST)
+
+    if now.time() >= rollover:
+        return now.date() - timedelta(days=1)
+    else:
+        return now.date() - timedelta(days=2)
+
+
+def parse_ranking_date(text: str) -> date:
+    """
+    解析yyyy-mm-dd或yyyymmdd格式的日期
+
+    :raise ValueError: 格式不正确
+    """
+    return datetime.strptime(text, "%Y-%m-%d" if "-" in text else "%Y%m%d").date()
+
+
+__all__ = ("JST", "latest_ranking_date", "parse_ranking_date")
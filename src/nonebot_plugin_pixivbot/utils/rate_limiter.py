@@ -0,0 +1,369 @@
+from asyncio import sleep, wait_for, TimeoutError, Future, CancelledError, get_running_loop
+from contextlib import asynccontextmanager
+from itertools import count
+from time import monotonic
+from typing import Optional, NamedTuple, AsyncIterator, List, Tuple
+
+from nonebot import logger
+
+from .errors import RateLimitError
+from .request_priority import current_priority
+
+# 每次成功的请求使速率增加的量（单位：次/秒）
+_ADDITIVE_INCREASE = 0.05
+# 遇到限流时速率乘以该系数
+_RATE_LIMITED_DECREASE = 0.5
+# 请求延迟明显升高时速率乘以该系数
+_SLOW_DECREASE = 0.9
+# 延迟超过平均延迟的多少倍视为明显升高
+_SLOW_FACTOR = 4.0
+# 两次降速之间的最小间隔（单位：秒），实际取该值与两倍平均延迟中的较大者，
+# 避免降速前已发出的同一批请求的失败使速率连续下降
+_MIN_DECREASE_COOLDOWN = 1.0
+# 延迟EWMA的平滑系数
+_LATENCY_ALPHA = 0.2
+
+
+class RateLimiterMetrics(NamedTuple):
+    rate: float  # 当前速率（次/秒）
+    tokens: float  # 当前可用的令牌数
+    queue_depth: int  # 正在等待配额的请求数
+    in_flight: int  # 正在进行的请求数
+    acquired: int  # 获得配额的请求数
+    timeouts: int  # 在截止时间前未获得配额的请求数
+    rate_limited: int  # 收到限流响应的次数
+    total_wait_time: float  # 所有请求等待配额的总时间（单位：秒）
+    max_wait_time: float  # 单个请求等待配额的最长时间（单位：秒）
+    latency: Optional[float]  # 请求延迟的EWMA（单位：秒）
+
+    @property
+    def mean_wait_time(self) -> float:
+        return self.total_wait_time / self.acquired if self.acquired > 0 else 0.0
+
+
+class PrioritySemaphore:
+    """
+    按优先级唤醒等待者的信号量：优先级数值小的先获得，同一优先级按到达顺序。
+    等待超过aging秒的等待者的优先级提升一级，避免低优先级的等待者被饿死
+    """
+
+    def __init__(self, value: int, aging: Optional[float] = None):
+        """
+        :param value: 初始值
+        :param aging: 等待者每等待多少秒优先级提升一级，为None时不提升
+        """
+        self._value = value
+        self.aging = aging
+        self._waiters: List[Tuple[int, int, float, Future]] = []  # (优先级, 到达序号, 到达时间, future)
+        self._seq = count()
+
+    def locked(self) -> bool:
+        return self._value == 0 or len(self._waiters) > 0
+
+    def _effective_priority(self, waiter: Tuple[int, int, float, Future], now: float) -> Tuple[int, int]:
+        priority, seq, arrived_at, _ = waiter
+        if self.aging:
+            priority = max(priority - int((now - arrived_at) / self.aging), 0)
+        return priority, seq
+
+    async def acquire(self, priority: int = 0):
+        if self._value > 0 and len(self._waiters) == 0:
+            self._value -= 1
+            return
+
+        fut = get_running_loop().create_future()
+        waiter = (priority, next(self._seq), monotonic(), fut)
+        self._waiters.append(waiter)
+        try:
+            await fut
+        except CancelledError:
+            if fut.done() and not fut.cancelled():
+                # 已经被唤醒（获得了信号量）后才被取消，转交给下一个等待者
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self):
+        # 等待者数量不多，每次线性扫描即可
+        now = monotonic()
+        while len(self._waiters) > 0:
+            waiter = min(self._waiters, key=lambda x: self._effective_priority(x, now))
+            self._waiters.remove(waiter)
+            fut = waiter[3]
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._value += 1
+
+
+class ConcurrencyLimiterMetrics(NamedTuple):
+    queue_depth: int  # 正在等待配额的请求数
+    in_flight: int  # 正在进行的请求数
+    acquired: int  # 获得配额的请求数
+    timeouts: int  # 在截止时间前未获得配额的请求数
+    total_wait_time: float  # 所有请求等待配额的总时间（单位：秒）
+    max_wait_time: float  # 单个请求等待配额的最长时间（单位：秒）
+
+    @property
+    def mean_wait_time(self) -> float:
+        return self.total_wait_time / self.acquired if self.acquired > 0 else 0.0
+
+
+class ConcurrencyLimiter:
+    """
+    只限制同时进行的请求数，用于不按次数限流的场景（如下载图片）
+    """
+
+    def __init__(self, max_concurrency: int, aging: Optional[float] = None):
+        """
+        :param max_concurrency: 同时进行的请求数上限
+        :param aging: 低优先级的请求每等待多少秒优先级提升一级，为None时不提升
+        """
+        self._sema = PrioritySemaphore(max_concurrency, aging)
+
+        self._waiting = 0
+        self._in_flight = 0
+        self._acquired = 0
+        self._timeouts = 0
+        self._total_wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    @property
+    def metrics(self) -> ConcurrencyLimiterMetrics:
+        return ConcurrencyLimiterMetrics(queue_depth=self._waiting, in_flight=self._in_flight,
+                                         acquired=self._acquired, timeouts=self._timeouts,
+                                         total_wait_time=self._total_wait_time,
+                                         max_wait_time=self._max_wait_time)
+
+    async def acquire(self, timeout: Optional[float] = None, priority: Optional[int] = None):
+        """
+        等待配额，超过timeout仍未获得则抛出RateLimitError
+
+        :param timeout: 最长等待时间（单位：秒），为None时一直等待
+        :param priority: 优先级，为None时使用当前上下文的优先级
+        """
+        if priority is None:
+            priority = current_priority()
+        begin = monotonic()
+
+        self._waiting += 1
+        try:
+            if timeout is None:
+                await self._sema.acquire(priority)
+            else:
+                await wait_for(self._sema.acquire(priority), timeout)
+        except TimeoutError:
+            self._timeouts += 1
+            raise RateLimitError()
+        finally:
+            self._waiting -= 1
+
+        wait_time = monotonic() - begin
+        self._acquired += 1
+        self._in_flight += 1
+        self._total_wait_time += wait_time
+        self._max_wait_time = max(self._max_wait_time, wait_time)
+
+    def release(self):
+        self._in_flight -= 1
+        self._sema.release()
+
+    @asynccontextmanager
+    async def limit(self, timeout: Optional[float] = None, priority: Optional[int] = None) -> AsyncIterator[None]:
+        """
+        获得配额后执行
+
+        :param timeout: 最长等待时间（单位：秒），为None时一直等待
+        :param priority: 优先级，为None时使用当前上下文的优先级
+        """
+        await self.acquire(timeout, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class AdaptiveRateLimiter:
+    """
+    令牌桶限流器，速率按AIMD调整：请求成功时加性增加，收到限流响应（或延迟明显升高）时乘性减少。
+    另外限制同时进行的请求数。排队的请求按优先级获得令牌与并发配额
+    """
+
+    def __init__(self, initial_rate: Optional[float],
+                 min_rate: float,
+                 max_rate: float,
+                 capacity: int,
+                 max_concurrency: int,
+                 aging: Optional[float] = None):
+        """
+        :param initial_rate: 初始速率（次/秒），为None时从最高速率开始（直到被限流才降速）
+        :param min_rate: 最低速率（次/秒）
+        :param max_rate: 最高速率（次/秒）
+        :param capacity: 令牌桶容量，即允许的突发请求数
+        :param max_concurrency: 同时进行的请求数上限
+        :param aging: 低优先级的请求每等待多少秒优先级提升一级，为None时不提升
+        """
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.capacity = capacity
+
+        if initial_rate is None:
+            initial_rate = max_rate
+        self._rate = min(max(initial_rate, min_rate), max_rate)
+        self._tokens = float(capacity)
+        self._last_refill = monotonic()
+        self._last_decrease = float("-inf")
+
+        self._lock = PrioritySemaphore(1, aging)  # 保证按优先级与到达顺序分配令牌
+        self._sema = PrioritySemaphore(max_concurrency, aging)
+
+        self._waiting = 0
+        self._in_flight = 0
+        self._acquired = 0
+        self._timeouts = 0
+        self._rate_limited = 0
+        self._total_wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._latency: Optional[float] = None
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @property
+    def metrics(self) -> RateLimiterMetrics:
+        self._refill()
+        return RateLimiterMetrics(rate=self._rate, tokens=self._tokens,
+                                  queue_depth=self._waiting, in_flight=self._in_flight,
+                                  acquired=self._acquired, timeouts=self._timeouts,
+                                  rate_limited=self._rate_limited,
+                                  total_wait_time=self._total_wait_time, max_wait_time=self._max_wait_time,
+                                  latency=self._latency)
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(self._tokens + (now - self._last_refill) * self._rate, self.capacity)
+        self._last_refill = now
+
+    async def _wait(self, aw, deadline: Optional[float]):
+        if deadline is None:
+            await aw
+        else:
+            try:
+                await wait_for(aw, max(deadline - monotonic(), 0))
+            except TimeoutError:
+                raise RateLimitError()
+
+    async def _take_token(self, priority: int, deadline: Optional[float]):
+        await self._wait(self._lock.acquire(priority), deadline)
+        try:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                delay = (1 - self._tokens) / self._rate
+                if deadline is not None and monotonic() + delay > deadline:
+                    raise RateLimitError()
+                # 速率可能在等待期间改变，醒来后重新计算
+                await sleep(delay)
+        finally:
+            self._lock.release()
+
+    async def acquire(self, timeout: Optional[float] = None, priority: Optional[int] = None):
+        """
+        等待配额，超过timeout仍未获得则抛出RateLimitError
+
+        :param timeout: 最长等待时间（单位：秒），为None时一直等待
+        :param priority: 优先级，为None时使用当前上下文的优先级
+        """
+        if priority is None:
+            priority = current_priority()
+        begin = monotonic()
+        deadline = begin + timeout if timeout is not None else None
+
+        self._waiting += 1
+        try:
+            await self._take_token(priority, deadline)
+            try:
+                await self._wait(self._sema.acquire(priority), deadline)
+            except BaseException:
+                # 没有获得并发配额（超时或被取消），归还已取得的令牌
+                self._refund_token()
+                raise
+        except RateLimitError:
+            self._timeouts += 1
+            raise
+        finally:
+            self._waiting -= 1
+
+        wait_time = monotonic() - begin
+        self._acquired += 1
+        self._in_flight += 1
+        self._total_wait_time += wait_time
+        self._max_wait_time = max(self._max_wait_time, wait_time)
+
+    def release(self):
+        self._in_flight -= 1
+        self._sema.release()
+
+    def _refund_token(self):
+        self._refill()
+        self._tokens = min(self._tokens + 1, self.capacity)
+
+    def _decrease(self, factor: float, reason: str):
+        now = monotonic()
+        cooldown = max(_MIN_DECREASE_COOLDOWN, 2 * (self._latency or 0.0))
+        if now - self._last_decrease < cooldown:
+            return
+        self._last_decrease = now
+
+        self._refill()
+        old_rate = self._rate
+        self._rate = max(self._rate * factor, self.min_rate)
+        # 丢弃积攒的令牌，之后的请求按新的速率发出
+        self._tokens = min(self._tokens, 0.0)
+        logger.info(f"[rate_limiter] {reason}, rate decreased: {old_rate:.2f}/s -> {self._rate:.2f}/s "
+                    f"(queue_depth: {self._waiting}, in_flight: {self._in_flight})")
+
+    def on_success(self, latency: float):
+        if self._latency is not None and latency > self._latency * _SLOW_FACTOR:
+            self._decrease(_SLOW_DECREASE, f"slow response ({latency:.2f}s)")
+        else:
+            self._refill()
+            self._rate = min(self._rate + _ADDITIVE_INCREASE, self.max_rate)
+
+        if self._latency is None:
+            self._latency = latency
+        else:
+            self._latency = _LATENCY_ALPHA * latency + (1 - _LATENCY_ALPHA) * self._latency
+
+    def on_rate_limited(self):
+        self._rate_limited += 1
+        self._decrease(_RATE_LIMITED_DECREASE, "got rate limited")
+
+    @asynccontextmanager
+    async def limit(self, timeout: Optional[float] = None, priority: Optional[int] = None) -> AsyncIterator[None]:
+        """
+        获得配额后执行，并根据执行结果调整速率（抛出RateLimitError视为收到限流响应）
+
+        :param timeout: 最长等待时间（单位：秒），为None时一直等待
+        :param priority: 优先级，为None时使用当前上下文的优先级
+        """
+        await self.acquire(timeout, priority)
+        begin = monotonic()
+        try:
+            yield
+        except RateLimitError:
+            self.on_rate_limited()
+            raise
+        else:
+            self.on_success(monotonic() - begin)
+        finally:
+            self.release()
+
+
+__all__ = ("AdaptiveRateLimiter", "RateLimiterMetrics", "ConcurrencyLimiter", "ConcurrencyLimiterMetrics",
+           "PrioritySemaphore")
@@ -0,0 +1,38 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Iterator
+
+
+class RequestPriority(IntEnum):
+    """
+    请求的优先级，值越小越优先
+    """
+    interactive = 0  # 用户发出的指令
+    background = 1  # 定时推送、订阅轮询、预加载、后台刷新缓存等
+
+
+_current_priority: ContextVar[RequestPriority] = ContextVar("pixivbot_request_priority",
+                                                            default=RequestPriority.interactive)
+
+
+def current_priority() -> RequestPriority:
+    return _current_priority.get()
+
+
+@contextmanager
+def request_priority(priority: RequestPriority) -> Iterator[None]:
+    """
+    在上下文内（包括其中创建的Task）发出的请求使用指定的优先级。
+
+    优先级只随上下文传递：多个请求共享的工作（合并的illust_detail批量查询、shared_agen）
+    需要自行取各请求方中最高的优先级，见_IllustDetailBatcher与SharedAsyncGeneratorManager._AgenHolder
+    """
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+__all__ = ("RequestPriority", "current_priority", "request_priority")
@@ -1,14 +1,18 @@
 import time
 from abc import ABC, abstractmethod
-from asyncio import Lock
+from asyncio import Condition
+from collections import deque, Counter
 from contextlib import AbstractAsyncContextManager, asynccontextmanager
 from types import TracebackType
-from typing import Any, Generic, TypeVar, AsyncGenerator, List, Type, Optional, AsyncContextManager
+from typing import Any, Generic, TypeVar, AsyncGenerator, List, Type, Optional, AsyncContextManager, Hashable, \
+    Dict, Union, Tuple
 
 from cachetools import TLRUCache
 from nonebot import logger
 
 from nonebot_plugin_pixivbot.data.pixiv_repo.enums import CacheStrategy
+from nonebot_plugin_pixivbot.utils.request_priority import RequestPriority, current_priority, request_priority
+from nonebot_plugin_pixivbot.utils.sized_lru_cache import SizedLruCache, SizedLruCacheUsage
 
 T_ID = TypeVar("T_ID")
 T_ITEM = TypeVar("T_ITEM")
@@ -17,18 +21,42 @@ T_ITEM = TypeVar("T_ITEM")
 class SharedAsyncGeneratorManager(ABC, Generic[T_ID, T_ITEM]):
     log_tag = "shared_agen"
 
+    # 按字节数限制容量的缓存类别 -> 容量上限（单位：字节）
+    # 属于这些类别的已停止的agen各自缓存在按字节数LRU淘汰的缓存中，其余的缓存在按项数限制的缓存中
+    memory_budgets: Dict[Hashable, int] = {}
+
     class _AgenHolder(AbstractAsyncContextManager):
+        """
+        共享origin的各个消费者。同一时刻只有一个消费者从origin取下一项，其余消费者等待Condition广播。
+
+        默认保留origin产生的所有项，之后的消费者从头重放；bounded模式下只保留还有消费者未读到的项，
+        另外保存每一项经manager.snapshot_item转换后的紧凑快照，用于之后的消费者重放。
+
+        origin在取下一项的消费者的上下文中运行，取下一项时使用所有正在读取的消费者中最高的优先级，
+        因此后台任务创建的agen有用户指令加入后，之后的请求按用户指令的优先级发出
+        """
+
         def __init__(self, origin: AsyncGenerator[T_ITEM, None],
                      identifier: T_ID,
-                     manager: "SharedAsyncGeneratorManager"):
+                     manager: "SharedAsyncGeneratorManager",
+                     bounded: bool = False):
             super().__init__()
             self._origin = origin
             self._stopped = False  # whether origin has raised a StopIteration
-            self._got_items = []  # items got from origin, used to replay
+            self._snapshot: Union[List[T_ITEM], Tuple[T_ITEM, ...]] = []  # items got from origin, used to replay
             self._got = 0  # count of items got from origin
-            self._mutex = Lock()  # to solve race
+            self._fetching = False  # whether a consumer is fetching from origin
+            self._cond = Condition()  # notified when a new item was got or origin stopped
+            self._waiting = 0  # count of consumers waiting on _cond
             self._consumers = 0  # count of consumer
 
+            # bounded模式下未被所有消费者读过的原始项，_buffer[0]是第_base项
+            self._bounded = bounded
+            self._buffer = deque()
+            self._base = 0
+            self._positions = Counter()  # 位置 -> 位于该位置的消费者数
+            self._priorities = Counter()  # 优先级 -> 正在读取的消费者数
+
             self._identifier = identifier
             self._manager = manager
 
@@ -36,43 +64,107 @@ class SharedAsyncGeneratorManager(ABC, Generic[T_ID, T_ITEM]):
         def consumers(self) -> int:
             return self._consumers
 
-        async def _generator(self) -> AsyncGenerator[T_ITEM, None]:
-            cur = 0
-            while True:
-                if cur < self._got:
-                    yield self._got_items[cur]
-                    cur += 1
-                else:
-                    if self._stopped:
-                        break
-
-                    async with self._mutex:
-                        if self._stopped:
-                            break
-
-                        if cur == self._got:
-                            try:
-                                new_data = await self._origin.__anext__()
-                            except StopAsyncIteration:
-                                self._stopped = True
-                                await self._manager.on_agen_stop(self._identifier, self._got_items)
-                                break
-                            except Exception as e:
-                                await self._manager.on_agen_error(self._identifier, e)
-                                raise e
-
-                            await self._manager.on_agen_next(self._identifier, new_data)
-
-                            self._got_items.append(new_data)
-                            self._got += 1
+        @property
+        def buffered(self) -> int:
+            # 当前持有的原始项数（不含快照）
+            return len(self._buffer) if self._bounded else len(self._snapshot)
 
-                        yield self._got_items[cur]
+        @property
+        def nbytes(self) -> int:
+            # 只计算bytes类型的项，其余的项相比之下可以忽略
+            return sum(len(x) for x in self._snapshot if isinstance(x, (bytes, bytearray, memoryview)))
+
+        def _item_at(self, pos: int) -> T_ITEM:
+            if self._bounded and 0 <= pos - self._base < len(self._buffer):
+                return self._buffer[pos - self._base]
+            return self._snapshot[pos]
+
+        def _move(self, old_pos: Optional[int], new_pos: Optional[int]):
+            if old_pos is not None:
+                self._positions[old_pos] -= 1
+                if self._positions[old_pos] == 0:
+                    del self._positions[old_pos]
+            if new_pos is not None:
+                self._positions[new_pos] += 1
+
+            if self._bounded:
+                # 丢弃所有消费者都已读过的项（从快照重放的消费者不需要这些原始项）
+                while len(self._buffer) > 0 and self._base not in self._positions:
+                    self._buffer.popleft()
+                    self._base += 1
+
+        def _append(self, item: T_ITEM):
+            if self._bounded:
+                self._buffer.append(item)
+                self._snapshot.append(self._manager.snapshot_item(self._identifier, item))
+            else:
+                self._snapshot.append(item)
+            self._got += 1
+
+        async def _fetch(self) -> bool:
+            """
+            从origin取下一项
+
+            :return: origin是否已停止
+            """
+            self._fetching = True
+            try:
+                try:
+                    with request_priority(min(self._priorities, default=current_priority())):
+                        new_data = await self._origin.__anext__()
+                except StopAsyncIteration:
+                    self._stopped = True
+                    # 停止后只保留紧凑的快照
+                    self._snapshot = tuple(self._snapshot)
+                    await self._manager.on_agen_stop(self._identifier, self._snapshot)
+                    return True
+                except Exception as e:
+                    await self._manager.on_agen_error(self._identifier, e)
+                    raise e
+
+                await self._manager.on_agen_next(self._identifier, new_data)
+                self._append(new_data)
+                return False
+            finally:
+                self._fetching = False
+                # 没有消费者在等待时不必获取锁，单个消费者时省去每项一次的加锁
+                if self._waiting > 0:
+                    async with self._cond:
+                        self._cond.notify_all()
+
+        async def _generator(self, priority: RequestPriority) -> AsyncGenerator[T_ITEM, None]:
+            cur = 0
+            self._move(None, cur)
+            self._priorities[priority] += 1
+            try:
+                while True:
+                    if cur < self._got:
+                        item = self._item_at(cur)
+                        self._move(cur, cur + 1)
                         cur += 1
+                        yield item
+                    elif self._stopped:
+                        break
+                    elif self._fetching:
+                        self._waiting += 1
+                        try:
+                            async with self._cond:
+                                await self._cond.wait_for(
+                                    lambda: cur < self._got or self._stopped or not self._fetching)
+                        finally:
+                            self._waiting -= 1
+                    elif await self._fetch():
+                        break
+            finally:
+                self._move(cur, None)
+                self._priorities[priority] -= 1
+                if self._priorities[priority] == 0:
+                    del self._priorities[priority]
 
         async def __aenter__(self) -> AsyncGenerator[T_ITEM, None]:
             self._consumers += 1
             await self._manager._on_consumers_changed(self._identifier, self, self._consumers)
-            return self._generator()
+            return self._generator(current_priority())
 
         async def __aexit__(self, exc_type: Optional[Type[BaseException]],
                             exc_value: Optional[BaseException],
@@ -90,6 +182,47 @@ class SharedAsyncGeneratorManager(ABC, Generic[T_ID, T_ITEM]):
         self._stopped_holders = TLRUCache[T_ID, self._AgenHolder](maxsize=2048,
                                                                   ttu=lambda k, v, now: self._expires_time[k],
                                                                   timer=time.time)
+        self._budgeted_holders = {
+            k: SizedLruCache[T_ID, self._AgenHolder](budget,
+                                                     ttu=lambda k, v, now: self._expires_time[k],
+                                                     getsizeof=lambda v: v.nbytes,
+                                                     timer=time.time)
+            for k, budget in self.memory_budgets.items()
+        }
+
+    def bounded(self, identifier: T_ID) -> bool:
+        """
+        :return: identifier对应的agen是否使用bounded模式（只保留还有消费者未读到的原始项）
+        """
+        return False
+
+    def snapshot_item(self, identifier: T_ID, item: T_ITEM) -> T_ITEM:
+        """
+        bounded模式下将项转换为保存在快照中的紧凑形式，不能修改原来的项（其他消费者可能还未读到）
+        """
+        return item
+
+    def budget_key(self, identifier: T_ID) -> Optional[Hashable]:
+        """
+        :return: identifier所属的按字节数限制容量的缓存类别，为None时使用按项数限制的缓存
+        """
+        return None
+
+    def _stopped_cache(self, identifier: T_ID) -> Union[TLRUCache, SizedLruCache]:
+        key = self.budget_key(identifier)
+        if key is not None and key in self._budgeted_holders:
+            return self._budgeted_holders[key]
+        return self._stopped_holders
+
+    def is_cached(self, identifier: T_ID) -> bool:
+        return identifier in self._stopped_cache(identifier)
+
+    @property
+    def memory_usage(self) -> Dict[Hashable, SizedLruCacheUsage]:
+        """
+        各个按字节数限制容量的缓存的使用情况
+        """
+        return {k: v.usage for k, v in self._budgeted_holders.items()}
 
     @abstractmethod
     def agen(self, identifier: T_ID,
@@ -106,8 +239,15 @@ class SharedAsyncGeneratorManager(ABC, Generic[T_ID, T_ITEM]):
         if identifier in self._running_holders:
             holder = self._running_holders.pop(identifier)
             if identifier in self._expires_time:
-                self._stopped_holders[identifier] = holder
-                logger.debug(f"[{self.log_tag}] {identifier} was stopped and cached")
+                cache = self._stopped_cache(identifier)
+                cache[identifier] = holder
+                if isinstance(cache, SizedLruCache):
+                    usage = cache.usage
+                    logger.debug(f"[{self.log_tag}] {identifier} was stopped and cached "
+                                 f"({holder.nbytes} bytes, {usage.used}/{usage.budget} bytes used, "
+                                 f"{usage.evictions} evicted)")
+                else:
+                    logger.debug(f"[{self.log_tag}] {identifier} was stopped and cached")
             else:
                 logger.debug(f"[{self.log_tag}] {identifier} was stopped but not cached")
 
@@ -128,9 +268,10 @@ class SharedAsyncGeneratorManager(ABC, Generic[T_ID, T_ITEM]):
                          "(the origin agen hasn't stopped when all consumers exited)")
 
     async def invalidate(self, identifier: T_ID):
-        if identifier in self._stopped_holders:
+        cache = self._stopped_cache(identifier)
+        if identifier in cache:
             logger.debug(f"[{self.log_tag}] {identifier} was invalidated from cached state")
-            del self._stopped_holders[identifier]
+            del cache[identifier]
         elif identifier in self._running_holders:
             logger.debug(f"[{self.log_tag}] {identifier} was invalidated from running state")
             holder = self._running_holders.pop(identifier)
@@ -143,12 +284,16 @@ class SharedAsyncGeneratorManager(ABC, Generic[T_ID, T_ITEM]):
             return
 
     async def invalidate_all(self):
-        keys = {*self._stopped_holders.keys(), *self._running_holders.keys()}
+        keys = {*self._stopped_holders.keys(), *self._running_holders.keys(),
+                *(k for cache in self._budgeted_holders.values() for k in cache.keys())}
         for k in keys:
             await self.invalidate(k)
 
     def get_expires_time(self, identifier: T_ID) -> Optional[float]:
-        if identifier in self._stopped_holders:
+        cache = self._stopped_cache(identifier)
+        if isinstance(cache, SizedLruCache) and identifier in cache:
+            return cache.expires_of(identifier)
+        elif identifier in self._stopped_holders:
             t = self._stopped_holders.__getitem(identifier).expires
             return t
         elif identifier in self._running_holders:
@@ -165,12 +310,13 @@ class SharedAsyncGeneratorManager(ABC, Generic[T_ID, T_ITEM]):
                          "(due to a past expires time was set)")
             return
 
-        if identifier in self._stopped_holders:
-            holder = self._stopped_holders.pop(identifier)
+        cache = self._stopped_cache(identifier)
+        if identifier in cache:
+            holder = cache.pop(identifier)
 
             if expires_time > now:
                 self._expires_time[identifier] = expires_time
-                self._stopped_holders[identifier] = holder
+                cache[identifier] = holder
                 del self._expires_time[identifier]
 
                 logger.debug(f"[{self.log_tag}] {identifier} will expires at {expires_time}")
@@ -187,12 +333,12 @@ class SharedAsyncGeneratorManager(ABC, Generic[T_ID, T_ITEM]):
         if cache_strategy == CacheStrategy.FORCE_EXPIRATION:
             await self.invalidate(identifier)
 
-        holder = self._stopped_holders.get(identifier, None)
+        holder = self._stopped_cache(identifier).get(identifier, None)
         if holder is None:
             holder = self._running_holders.get(identifier, None)
             if holder is None:
                 origin = self.agen(identifier, cache_strategy, **kwargs)
-                holder = self._AgenHolder(origin, identifier, self)
+                holder = self._AgenHolder(origin, identifier, self, self.bounded(identifier))
                 logger.debug(f"[{self.log_tag}] {identifier} was created")
                 self._running_holders[identifier] = holder
 
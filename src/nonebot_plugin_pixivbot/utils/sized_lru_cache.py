@@ -0,0 +1,115 @@
+import time
+from collections import OrderedDict
+from typing import TypeVar, Generic, Callable, Optional, Tuple, Iterator, NamedTuple
+
+_KT = TypeVar("_KT")
+_VT = TypeVar("_VT")
+
+
+class SizedLruCacheUsage(NamedTuple):
+    used: int  # 已使用的容量
+    budget: int  # 容量上限
+    entries: int  # 缓存项数
+    evictions: int  # 因容量不足被淘汰的缓存项数
+
+
+class SizedLruCache(Generic[_KT, _VT]):
+    """
+    按大小（如字节数）而非项数限制容量的LRU缓存，每项有各自的过期时间。
+    容量不足时先清除已过期的项，再按LRU淘汰；单项大小超过容量上限时不缓存
+    """
+
+    def __init__(self, budget: int,
+                 ttu: Callable[[_KT, _VT, float], float],
+                 getsizeof: Callable[[_VT], int],
+                 timer: Callable[[], float] = time.time):
+        """
+        :param budget: 容量上限
+        :param ttu: 根据(key, value, 当前时间)计算过期时间
+        :param getsizeof: 计算value的大小
+        :param timer: 计时器
+        """
+        self.budget = budget
+        self.ttu = ttu
+        self.getsizeof = getsizeof
+        self.timer = timer
+
+        self.used = 0
+        self.evictions = 0
+        self._data = OrderedDict[_KT, Tuple[_VT, float, int]]()  # key -> (value, 过期时间, 大小)
+
+    @property
+    def usage(self) -> SizedLruCacheUsage:
+        self.expire()
+        return SizedLruCacheUsage(used=self.used, budget=self.budget,
+                                  entries=len(self._data), evictions=self.evictions)
+
+    def _pop(self, key: _KT) -> _VT:
+        value, _, size = self._data.pop(key)
+        self.used -= size
+        return value
+
+    def _check_expired(self, key: _KT) -> bool:
+        node = self._data.get(key, None)
+        if node is not None and node[1] <= self.timer():
+            self._pop(key)
+            return True
+        return False
+
+    def expire(self):
+        now = self.timer()
+        for key in [k for k, (_, expires, _) in self._data.items() if expires <= now]:
+            self._pop(key)
+
+    def __contains__(self, key: _KT) -> bool:
+        return key in self._data and not self._check_expired(key)
+
+    def __getitem__(self, key: _KT) -> _VT:
+        if self._check_expired(key):
+            raise KeyError(key)
+        value = self._data[key][0]
+        self._data.move_to_end(key)
+        return value
+
+    def get(self, key: _KT, default: Optional[_VT] = None) -> Optional[_VT]:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def expires_of(self, key: _KT) -> Optional[float]:
+        if key in self:
+            return self._data[key][1]
+        return None
+
+    def __setitem__(self, key: _KT, value: _VT):
+        if key in self._data:
+            self._pop(key)
+
+        size = self.getsizeof(value)
+        if size > self.budget:
+            return
+
+        if self.used + size > self.budget:
+            self.expire()
+        while self.used + size > self.budget:
+            self._pop(next(iter(self._data)))
+            self.evictions += 1
+
+        self._data[key] = (value, self.ttu(key, value, self.timer()), size)
+        self.used += size
+
+    def __delitem__(self, key: _KT):
+        self._pop(key)
+
+    def pop(self, key: _KT) -> _VT:
+        return self._pop(key)
+
+    def keys(self) -> Iterator[_KT]:
+        return iter(list(self._data.keys()))
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+__all__ = ("SizedLruCache", "SizedLruCacheUsage")
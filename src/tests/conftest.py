@@ -1,7 +1,10 @@
 import pytest
+from nonebug import NONEBOT_INIT_KWARGS
 
 
-@pytest.fixture(autouse=True)
-def conf_env(monkeypatch):
-    monkeypatch.setenv("PIXIV_REFRESH_TOKEN", "123")
-    monkeypatch.setenv("SUPERUSERS", "[\"test:123456\"]")
+def pytest_configure(config: pytest.Config) -> None:
+    # nonebot只读取声明过的环境变量，配置项需要在nonebot.init时传入
+    config.stash[NONEBOT_INIT_KWARGS] = {
+        "pixiv_refresh_token": "123",
+        "superusers": {"test:123456"},
+    }
@@ -0,0 +1,43 @@
+from asyncio import create_task, sleep
+
+import pytest
+
+from tests import MyTest
+
+
+class TestPixivAccountPool(MyTest):
+    @pytest.fixture
+    def pool(self):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.account_pool import PixivAccountPool
+
+        return PixivAccountPool(["token0", "token1"], None)
+
+    @staticmethod
+    def login(account, user_id: int):
+        # 模拟_refresh成功
+        account.user_id = user_id
+        account.ready = True
+        account._ready_event.set()
+
+    @pytest.mark.asyncio
+    async def test_owner_of_waits_for_login(self, pool):
+        # 账号登录完成前查询，等待登录后再查找
+        task = create_task(pool.owner_of(222))
+        await sleep(0.01)
+        assert not task.done()
+
+        self.login(pool.accounts[0], 111)
+        self.login(pool.accounts[1], 222)
+        assert await task is pool.accounts[1]
+        assert await pool.owner_of(333) is None
+
+    @pytest.mark.asyncio
+    async def test_owner_of_timeout(self, pool, monkeypatch):
+        from nonebot_plugin_pixivbot.data.pixiv_repo import account_pool
+
+        monkeypatch.setattr(account_pool._conf, "pixiv_query_timeout", 0.05)
+
+        # 一直未登录的账号视为不在池中
+        self.login(pool.accounts[0], 111)
+        assert await pool.owner_of(111) is pool.accounts[0]
+        assert await pool.owner_of(222) is None
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+import pytest
+
+from tests import MyTest
+
+
+class TestFilePixivRepo(MyTest):
+    @pytest.mark.asyncio
+    async def test_clean_ranking(self, tmp_path, monkeypatch):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.local_repo import file
+        from nonebot_plugin_pixivbot.utils.ranking_date import latest_ranking_date
+
+        monkeypatch.setattr(file.conf, "pixiv_ranking_cache_retention_days", 7)
+        repo = file.FilePixivRepo.__new__(file.FilePixivRepo)
+        repo.root = tmp_path
+
+        latest = latest_ranking_date(file.conf.pixiv_ranking_rollover_time)
+        ranking_root = tmp_path / "illust_ranking"
+        for days in [0, 7, 8, 30]:
+            (ranking_root / (latest - timedelta(days=days)).isoformat() / "day").mkdir(parents=True)
+        # 旧版本按mode缓存的榜单不受影响
+        (ranking_root / "day").mkdir()
+
+        await repo.clean_expired()
+
+        # 只保留最近7期
+        assert sorted(x.name for x in ranking_root.iterdir()) == sorted([
+            latest.isoformat(), (latest - timedelta(days=7)).isoformat(), "day"
+        ])
@@ -0,0 +1,162 @@
+from asyncio import create_task, gather, sleep, wait_for
+from types import SimpleNamespace
+
+import pytest
+
+from tests import MyTest
+
+
+class FakeIllustDetailSource:
+    """
+    模拟PixivRepo.illust_details：记录每次调用的illust_ids，不返回missing中的插画，
+    failing中的插画获取失败（记录在errors中）
+    """
+
+    def __init__(self, missing=(), failing=(), error=None):
+        self.missing = set(missing)
+        self.failing = set(failing)
+        self.error = error
+        self.calls = []
+        self.priorities = []
+
+    async def illust_details(self, illust_ids, errors=None):
+        from nonebot_plugin_pixivbot.utils.request_priority import current_priority
+
+        self.calls.append(sorted(illust_ids))
+        self.priorities.append(current_priority())
+        await sleep(0.05)
+        if self.error is not None:
+            raise self.error
+        for illust_id in illust_ids:
+            if illust_id in self.failing:
+                errors[illust_id] = RuntimeError(f"failed to get {illust_id}")
+            elif illust_id not in self.missing:
+                yield SimpleNamespace(id=illust_id)
+
+
+class TestIllustDetailBatcher(MyTest):
+    @pytest.fixture
+    def src_factory(self, monkeypatch):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.lazy_illust import LazyIllust, _IllustDetailBatcher
+
+        def factory(**kwargs):
+            src = FakeIllustDetailSource(**kwargs)
+            monkeypatch.setattr(LazyIllust, "src", src)
+            monkeypatch.setattr(LazyIllust, "_batcher", _IllustDetailBatcher())
+            return src
+
+        return factory
+
+    @pytest.mark.asyncio
+    async def test_batch(self, src_factory):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.lazy_illust import LazyIllust
+
+        src = src_factory(missing={3})
+        illusts = [LazyIllust(i) for i in [1, 2, 3, 1]]
+        result = await gather(*[x.get() for x in illusts])
+
+        # 窗口内的查询（包括重复的id）合并为一次调用
+        assert src.calls == [[1, 2, 3]]
+        assert [x.id if x is not None else None for x in result] == [1, 2, None, 1]
+        assert illusts[0].loaded and not illusts[2].loaded
+
+        # 下一个窗口的查询是新的一次调用
+        await LazyIllust(4).get()
+        assert src.calls == [[1, 2, 3], [4]]
+
+    @pytest.mark.asyncio
+    async def test_error(self, src_factory):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.lazy_illust import LazyIllust
+
+        src_factory(error=RuntimeError("boom"))
+        result = await gather(LazyIllust(1).get(), LazyIllust(2).get(), return_exceptions=True)
+        assert all(isinstance(x, RuntimeError) for x in result)
+
+    @pytest.mark.asyncio
+    async def test_error_of_one(self, src_factory):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.lazy_illust import LazyIllust
+
+        src_factory(missing={3}, failing={2})
+        result = await gather(LazyIllust(1).get(), LazyIllust(2).get(), LazyIllust(3).get(),
+                              return_exceptions=True)
+
+        # 只有获取失败的插画的调用者得到异常，查不到的插画仍返回None
+        assert result[0].id == 1
+        assert isinstance(result[1], RuntimeError)
+        assert result[2] is None
+
+    @pytest.mark.asyncio
+    async def test_caller_cancelled(self, src_factory):
+        from asyncio import TimeoutError
+
+        from nonebot_plugin_pixivbot.data.pixiv_repo.lazy_illust import LazyIllust
+
+        src = src_factory()
+        other = create_task(LazyIllust(1).get())
+
+        # 同一批次中某个调用者超时，不影响其他调用者
+        with pytest.raises(TimeoutError):
+            await wait_for(LazyIllust(1).get(), 0.01)
+
+        assert (await other).id == 1
+        assert src.calls == [[1]]
+
+    @pytest.mark.asyncio
+    async def test_priority(self, src_factory):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.lazy_illust import LazyIllust
+        from nonebot_plugin_pixivbot.utils.request_priority import RequestPriority, request_priority
+
+        src = src_factory()
+
+        async def background_get(illust_id):
+            with request_priority(RequestPriority.background):
+                return await LazyIllust(illust_id).get()
+
+        # 后台任务开启的批次有用户指令加入后，以用户指令的优先级发出
+        await gather(background_get(1), LazyIllust(2).get())
+        await background_get(3)
+        assert src.priorities == [RequestPriority.interactive, RequestPriority.background]
+
+    @pytest.mark.asyncio
+    async def test_window_error(self, src_factory, monkeypatch):
+        from nonebot_plugin_pixivbot.data.pixiv_repo import lazy_illust
+        from nonebot_plugin_pixivbot.data.pixiv_repo.lazy_illust import LazyIllust
+
+        src = src_factory()
+
+        def broken_window():
+            raise RuntimeError("no config")
+
+        # 取得窗口时出错，该批次的调用者得到异常而不是一直等待
+        monkeypatch.setattr(lazy_illust, "_get_batch_window", broken_window)
+        result = await wait_for(gather(LazyIllust(1).get(), LazyIllust(2).get(), return_exceptions=True), 1)
+        assert all(isinstance(x, RuntimeError) for x in result)
+
+        # 之后的get()开启新的批次
+        monkeypatch.undo()
+        src = src_factory()
+        assert (await wait_for(LazyIllust(3).get(), 1)).id == 3
+        assert src.calls == [[3]]
+
+    @pytest.mark.asyncio
+    async def test_flush_cancelled(self, src_factory):
+        from asyncio import wait
+
+        from nonebot_plugin_pixivbot.data.pixiv_repo.lazy_illust import LazyIllust
+
+        src = src_factory()
+
+        # 取消flush（例如关闭时），无论flush是否已开始等待窗口，该批次的调用者都被取消
+        for started in [False, True]:
+            waiting = create_task(LazyIllust(1).get())
+            await sleep(0)
+            if started:
+                await sleep(0.001)
+
+            for task in list(LazyIllust._batcher._flushing):
+                task.cancel()
+            await wait({waiting}, timeout=1)
+            assert waiting.cancelled()
+
+        assert (await wait_for(LazyIllust(2).get(), 1)).id == 2
+        assert src.calls == [[2]]
@@ -0,0 +1,170 @@
+from asyncio import sleep, create_task
+
+import pytest
+
+from tests import MyTest
+
+
+class TestManyMediator(MyTest):
+    @pytest.fixture
+    def mediator(self):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.errors import NoSuchItemError
+        from nonebot_plugin_pixivbot.data.pixiv_repo.mediator import ManyMediator
+        from nonebot_plugin_pixivbot.data.pixiv_repo.models import PixivRepoMetadata
+
+        # 模拟本地缓存：cache["items"]为None表示没有缓存
+        cache = {"items": [1, 2, 3], "metadata": PixivRepoMetadata(pages=1)}
+        # 模拟远端的两页（过滤后）
+        pages = [[1, 2], [11, 12]]
+        calls = []
+
+        async def cache_factory(kwargs):
+            if cache["items"] is None:
+                raise NoSuchItemError()
+            yield cache["metadata"].copy(update={"pages": 0})
+            for x in cache["items"]:
+                yield x
+            yield cache["metadata"]
+
+        async def remote_factory(kwargs, max_page):
+            for p in range(2):
+                await sleep(0.05)
+                for x in pages[p]:
+                    yield x
+                yield PixivRepoMetadata(pages=p + 1, next_qs={"page": p + 2} if p < 1 else None)
+
+        async def cache_invalidator(kwargs):
+            calls.append("invalidate")
+            cache["items"] = None
+
+        async def cache_appender(kwargs, data, meta):
+            calls.append("append")
+            cache["items"] = (cache["items"] or []) + data
+            cache["metadata"] = meta
+
+        async def cache_replacer(kwargs, data, meta):
+            calls.append("replace")
+            cache["items"] = list(data)
+            cache["metadata"] = meta
+
+        mediator = ManyMediator("test", cache_factory, remote_factory, cache_invalidator, cache_appender,
+                                cache_replacer=cache_replacer)
+        mediator.cache = cache
+        mediator.pages = pages
+        mediator.calls = calls
+        return mediator
+
+    @pytest.mark.asyncio
+    async def test_revalidate(self, mediator):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.models import PixivRepoMetadata
+
+        async def revalidate():
+            return [x async for x in mediator.revalidate({})]
+
+        task = create_task(revalidate())
+        await sleep(0.07)
+
+        # 刷新过程中读到的仍是旧的缓存
+        items = [x async for x in mediator.mediate({}) if not isinstance(x, PixivRepoMetadata)]
+        assert items == [1, 2, 3]
+
+        result = await task
+        assert len(result) == 1 and result[0].pages == 2
+
+        # 一次替换完成，不经过invalidate与append
+        assert mediator.calls == ["replace"]
+        assert mediator.cache["items"] == [1, 2, 11, 12]
+
+    @pytest.mark.asyncio
+    async def test_append_complete_only(self, mediator):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.models import PixivRepoMetadata
+
+        mediator.append_complete_only = True
+        mediator.cache["items"] = None
+
+        # 只加载了前几页时不写入缓存
+        items = [x async for x in mediator.mediate({}, max_page=1) if not isinstance(x, PixivRepoMetadata)]
+        assert items == [1, 2]
+        assert mediator.calls == [] and mediator.cache["items"] is None
+
+        # 加载完整后一次写入
+        items = [x async for x in mediator.mediate({}) if not isinstance(x, PixivRepoMetadata)]
+        assert items == [1, 2, 11, 12]
+        assert mediator.calls == ["append"]
+        assert mediator.cache["items"] == [1, 2, 11, 12] and mediator.cache["metadata"].pages == 2
+
+    @pytest.mark.asyncio
+    async def test_append_complete_only_filtered_last_page(self, mediator):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.models import PixivRepoMetadata
+
+        compacted = []
+        mediator.append_complete_only = True
+        mediator.item_compactor = compacted.append
+        mediator.cache["items"] = None
+        # 最后一页的条目全部被过滤掉
+        mediator.pages[1] = []
+
+        items = [x async for x in mediator.mediate({}) if not isinstance(x, PixivRepoMetadata)]
+        assert items == [1, 2]
+
+        # 仍然以最后一页的metadata写入，写入后压缩
+        assert mediator.calls == ["append"]
+        assert mediator.cache["items"] == [1, 2] and mediator.cache["metadata"].pages == 2
+        assert mediator.cache["metadata"].next_qs is None
+        assert compacted == [1, 2]
+
+    @pytest.mark.asyncio
+    async def test_append_complete_only_cached(self, mediator):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.models import PixivRepoMetadata
+
+        mediator.append_complete_only = True
+        # 因max_item截断的完整列表仍有next_qs
+        mediator.cache["metadata"] = PixivRepoMetadata(pages=1, next_qs={"page": 2})
+
+        # 缓存的列表是完整的，不再从远端追加
+        items = [x async for x in mediator.mediate({}) if not isinstance(x, PixivRepoMetadata)]
+        assert items == [1, 2, 3]
+        assert mediator.calls == []
+
+
+class TestAppendMediator(MyTest):
+    @pytest.mark.asyncio
+    async def test_peek_without_prefetch(self):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.errors import CacheExpiredError
+        from nonebot_plugin_pixivbot.data.pixiv_repo.mediator import AppendMediator
+        from nonebot_plugin_pixivbot.data.pixiv_repo.models import PixivRepoMetadata
+
+        # 模拟已过期的本地缓存，远端第一页中的2已在缓存中
+        cache = {"items": [2, 3], "metadata": PixivRepoMetadata(pages=1), "expired": True}
+        remote_calls = []
+
+        async def cache_factory(kwargs):
+            if cache["expired"]:
+                raise CacheExpiredError(cache["metadata"])
+            yield cache["metadata"].copy(update={"pages": 0})
+            for x in cache["items"]:
+                yield x
+            yield cache["metadata"]
+
+        async def remote_factory(kwargs, max_page):
+            remote_calls.append(max_page)
+            for p in range(3):
+                yield p + 1
+                yield p + 2
+                yield PixivRepoMetadata(pages=p + 1)
+
+        async def front_cache_appender(kwargs, data, meta):
+            new_items = [x for x in data if x not in cache["items"]]
+            cache["items"] = new_items + cache["items"]
+            cache["expired"] = False
+            return len(new_items) < len(data)
+
+        async def noop(*args):
+            pass
+
+        mediator = AppendMediator("test", cache_factory, remote_factory, noop, noop, front_cache_appender)
+        items = [x async for x in mediator.mediate({}) if not isinstance(x, PixivRepoMetadata)]
+
+        assert items == [1, 2, 3]
+        # 查看新增项时不预先加载下一页
+        assert remote_calls == [1]
@@ -0,0 +1,217 @@
+from asyncio import sleep
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from tests import MyTest
+
+BEGIN = datetime(2024, 5, 1, tzinfo=timezone.utc)
+
+
+def fake_illust(illust_id: int, hours: int):
+    return SimpleNamespace(id=illust_id, create_date=BEGIN + timedelta(hours=hours))
+
+
+class TestUserFollowingIllusts(MyTest):
+    @pytest.fixture
+    def repo(self, monkeypatch):
+        from nonebot_plugin_pixivbot.data.pixiv_repo import mediator_repo
+        from nonebot_plugin_pixivbot.data.pixiv_repo.lazy_illust import LazyIllust
+
+        # 画师u的插画发布时间为 u, u+3, u+6, ...（小时），前三张在预览中
+        illusts = {u: [fake_illust(u * 100 + k, u + 3 * k) for k in range(6)][::-1] for u in range(3)}
+
+        class FakeRemote:
+            async def user_following_with_preview(self, user_id: int):
+                for u in range(3):
+                    yield SimpleNamespace(user=SimpleNamespace(id=u), illusts=illusts[u][:3])
+
+        monkeypatch.setattr(mediator_repo, "remote", FakeRemote())
+
+        repo = mediator_repo.MediatorPixivRepo()
+        repo.closed = []
+
+        async def user_illusts(user_id: int, cache_strategy=None):
+            try:
+                for x in illusts[user_id]:
+                    await sleep(0.05)
+                    yield LazyIllust(x.id, x)
+            finally:
+                repo.closed.append(user_id)
+
+        repo.user_illusts = user_illusts
+        return repo
+
+    @pytest.mark.asyncio
+    async def test_merge(self, repo):
+        result = [x async for x in repo.user_following_illusts(0)]
+
+        # 按发布时间从新到旧合并，且不重复
+        dates = [x.create_date for x in result]
+        assert dates == sorted(dates, reverse=True)
+        assert len({x.id for x in result}) == len(result) == 18
+
+    @pytest.mark.asyncio
+    async def test_checkpoint(self, repo):
+        checkpoint = BEGIN + timedelta(hours=11)
+        result = [x async for x in repo.user_following_illusts(0, checkpoint=checkpoint)]
+        assert [x.create_date for x in result] == [BEGIN + timedelta(hours=h) for h in [17, 16, 15, 14, 13, 12]]
+
+    @pytest.mark.asyncio
+    async def test_stop_early(self, repo):
+        gen = repo.user_following_illusts(0)
+        got = []
+        async for x in gen:
+            got.append(x)
+            # 等待预取进入user_illusts后再停止
+            await sleep(0.01)
+            if len(got) == 12:
+                break
+
+        # 关闭时预取仍在运行，不应抛出RuntimeError
+        await gen.aclose()
+        assert len(got) == 12
+        assert sorted(repo.closed) == [0, 1, 2]
+
+
+class TestIllustDetails(MyTest):
+    @pytest.fixture
+    def repo(self, monkeypatch):
+        from nonebot_plugin_pixivbot.data.pixiv_repo import mediator_repo
+
+        class FakeLocal:
+            async def illust_details(self, illust_ids):
+                # 1命中本地缓存
+                if 1 in illust_ids:
+                    yield fake_illust(1, 0)
+
+        monkeypatch.setattr(mediator_repo, "local", FakeLocal())
+
+        repo = mediator_repo.MediatorPixivRepo()
+
+        async def illust_detail_or_none(illust_id: int, cache_strategy):
+            # 2从远端取得，3远端也查不到，4获取失败
+            if illust_id == 4:
+                raise RuntimeError("boom")
+            return fake_illust(illust_id, 0) if illust_id == 2 else None
+
+        repo._illust_detail_or_none = illust_detail_or_none
+        return repo
+
+    @pytest.mark.asyncio
+    async def test_errors(self, repo):
+        errors = {}
+        result = [x async for x in repo.illust_details([1, 2, 3, 4], errors=errors)]
+
+        # 传入errors时异常按illust_id记录，不抛出
+        assert sorted(x.id for x in result) == [1, 2]
+        assert list(errors.keys()) == [4]
+        assert isinstance(errors[4], RuntimeError)
+
+    @pytest.mark.asyncio
+    async def test_raise(self, repo):
+        result = []
+        with pytest.raises(RuntimeError):
+            async for x in repo.illust_details([1, 2, 3, 4]):
+                result.append(x)
+
+        # 否则在返回所有成功项后抛出
+        assert sorted(x.id for x in result) == [1, 2]
+
+
+class TestIllustRankingRange(MyTest):
+    @pytest.fixture
+    def repo(self, monkeypatch):
+        from contextlib import asynccontextmanager
+
+        from nonebot_plugin_pixivbot.data.pixiv_repo import mediator_repo
+        from nonebot_plugin_pixivbot.data.pixiv_repo.errors import NoSuchItemError
+        from nonebot_plugin_pixivbot.data.pixiv_repo.lazy_illust import LazyIllust
+        from nonebot_plugin_pixivbot.data.pixiv_repo.models import PixivRepoMetadata
+
+        # 第i名的插画id为i；本地缓存了前cached名，complete为False表示达到pixiv_ranking_fetch_item后截断（仍有下一页）
+        state = SimpleNamespace(cached=None, complete=True, remote_calls=[])
+
+        class FakeLocal:
+            async def illust_ranking(self, mode, date, *, offset=0, limit=None):
+                if state.cached is None:
+                    raise NoSuchItemError()
+                end = state.cached if limit is None else min(state.cached, offset + limit)
+                yield PixivRepoMetadata(pages=0)
+                for i in range(offset, end):
+                    yield LazyIllust(i + 1)
+                yield PixivRepoMetadata(pages=(state.cached - 1) // 30 + 1,
+                                        next_qs=None if state.complete else {"offset": state.cached})
+
+        monkeypatch.setattr(mediator_repo, "local", FakeLocal())
+        monkeypatch.setattr(mediator_repo.conf, "pixiv_ranking_fetch_item", 150)
+
+        repo = mediator_repo.MediatorPixivRepo()
+        repo.state = state
+
+        # 远端每页30项，之间有PixivRepoMetadata
+        @asynccontextmanager
+        async def get(identifier, cache_strategy=None, **kwargs):
+            state.remote_calls.append(identifier)
+
+            async def gen():
+                yield PixivRepoMetadata(pages=0)
+                for i in range(150):
+                    yield LazyIllust(i + 1)
+                    if (i + 1) % 30 == 0:
+                        yield PixivRepoMetadata(pages=(i + 1) // 30)
+
+            yield gen()
+
+        monkeypatch.setattr(repo.shared_agen_mgr, "get", get)
+        return repo
+
+    @staticmethod
+    async def ranks(repo, start, end):
+        return [x.id async for x in repo.illust_ranking_range("day", (start, end), "2024-05-01")]
+
+    @pytest.mark.asyncio
+    async def test_local_slice(self, repo):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.mediator_repo import MediatorPixivRepo
+        from nonebot_plugin_pixivbot.enums import RankingMode
+
+        repo.state.cached = 50
+
+        async def local_range(start, end):
+            illusts = await MediatorPixivRepo._local_illust_ranking_range(RankingMode.day, "2024-05-01", (start, end))
+            return None if illusts is None else [x.id for x in illusts]
+
+        assert await local_range(1, 1) == [1]
+        assert await local_range(30, 31) == [30, 31]
+        assert await local_range(50, 50) == [50]
+        # 排行榜只有50项时，取到末尾为止
+        assert await local_range(45, 55) == [45, 46, 47, 48, 49, 50]
+
+        # 本地缓存的排行榜总是完整的，即使还有下一页（部分插画被过滤）也不从远端补足
+        repo.state.complete = False
+        assert await local_range(45, 55) == [45, 46, 47, 48, 49, 50]
+        assert await local_range(51, 55) == []
+
+        repo.state.cached = None
+        assert await local_range(1, 10) is None
+
+    @pytest.mark.asyncio
+    async def test_range(self, repo):
+        repo.state.cached = 50
+        assert await self.ranks(repo, 11, 20) == list(range(11, 21))
+
+        # 本地缓存不足这一段时只返回已有的部分，不从远端追加
+        repo.state.complete = False
+        assert await self.ranks(repo, 45, 61) == list(range(45, 51))
+        assert repo.state.remote_calls == []
+
+        # 没有本地缓存时从远端加载，只加载到这一段所在的页
+        repo.state.cached = None
+        assert await self.ranks(repo, 29, 61) == list(range(29, 62))
+        assert repo.state.remote_calls[-1].kwargs["max_page"] == 3
+
+        # 超过pixiv_ranking_fetch_item的部分被截去
+        assert await self.ranks(repo, 140, 200) == list(range(140, 151))
+        assert "max_page" not in repo.state.remote_calls[-1].kwargs
+        assert await self.ranks(repo, 151, 200) == []
@@ -0,0 +1,112 @@
+import shutil
+
+import pytest
+from pydantic import BaseModel
+
+from tests import MyTest
+
+
+class Item(BaseModel):
+    id: int
+
+
+def page(*ids):
+    return [Item(id=i) for i in ids], list(ids)
+
+
+class TestSegmentedListFile(MyTest):
+    @pytest.fixture
+    def lst(self, tmp_path):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.local_repo.segmented_list import SegmentedListFile
+
+        return SegmentedListFile(tmp_path / "list")
+
+    @pytest.fixture
+    def metadata(self):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.models import PixivRepoMetadata
+
+        return PixivRepoMetadata(pages=1)
+
+    @staticmethod
+    async def read_ids(lst, offset=0, limit=None):
+        header = await lst.read_header()
+        return [x.id async for x in lst.read(header, Item, offset, limit)]
+
+    @pytest.mark.asyncio
+    async def test_append_and_read(self, lst, metadata):
+        assert not await lst.append(*page(3, 4), metadata)
+        assert not await lst.append(*page(5, 6), metadata)
+        # 追加到开头，跳过已存在的条目
+        assert await lst.append(*page(1, 2, 3), metadata, append_at_begin=True)
+
+        assert await self.read_ids(lst) == [2, 1, 3, 4, 5, 6]
+        assert await self.read_ids(lst, offset=3) == [4, 5, 6]
+        assert await self.read_ids(lst, offset=1, limit=3) == [1, 3, 4]
+        assert await lst.read_keys() == {1, 2, 3, 4, 5, 6}
+
+    @pytest.mark.asyncio
+    async def test_keys_read_once(self, lst, metadata, monkeypatch):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.local_repo import segmented_list
+
+        await lst.append(*page(0), metadata)
+
+        opened = []
+        origin_open = segmented_list.aiofiles.open
+
+        def recording_open(file, mode='r', *args, **kwargs):
+            opened.append((file, mode))
+            return origin_open(file, mode, *args, **kwargs)
+
+        monkeypatch.setattr(segmented_list.aiofiles, "open", recording_open)
+
+        for i in range(1, 10):
+            assert not await lst.append(*page(i), metadata)
+        assert await lst.append(*page(5), metadata)
+
+        # 已有的键在内存中增量维护，追加时不再读取keys.jsonl
+        assert (lst.keys_file, 'r') not in opened
+
+        # 列表在外部被删除后不再使用内存中的键
+        shutil.rmtree(lst.path)
+        assert not await lst.append(*page(5), metadata)
+        assert await self.read_ids(lst) == [5]
+
+    @pytest.mark.asyncio
+    async def test_replace(self, lst, metadata):
+        for i in range(3):
+            await lst.append(*page(2 * i, 2 * i + 1), metadata)
+
+        header = await lst.read_header()
+        await lst.replace(*page(7, 8, 9, 8), metadata)
+
+        assert await self.read_ids(lst) == [7, 8, 9]
+        assert await lst.read_keys() == {7, 8, 9}
+        assert not await lst.append(*page(0), metadata)
+        assert await lst.append(*page(9), metadata)
+        # 旧的分段已被删除
+        assert not any((lst.path / seg.name).exists() for seg in header.segments)
+
+    @pytest.mark.asyncio
+    async def test_compact(self, lst, metadata):
+        for i in range(40):
+            await lst.append(*page(i), metadata)
+
+        header = await lst.read_header()
+        assert len(header.segments) < 40
+        assert await self.read_ids(lst) == list(range(40))
+
+    @pytest.mark.asyncio
+    async def test_read_while_compacting(self, lst, metadata):
+        for i in range(10):
+            await lst.append(*page(2 * i, 2 * i + 1), metadata)
+
+        header = await lst.read_header()
+        reader = lst.read(header, Item)
+        ids = [(await reader.__anext__()).id for _ in range(3)]
+
+        # 读取期间分段被合并（旧的分段被删除）
+        await lst.compact()
+        assert len((await lst.read_header()).segments) == 1
+
+        ids += [x.id async for x in reader]
+        assert ids == list(range(20))
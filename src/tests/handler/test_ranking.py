@@ -0,0 +1,31 @@
+from datetime import date, timedelta
+
+import pytest
+
+from tests import MyTest
+
+
+class TestRankingHandler(MyTest):
+    def test_subscription_date(self):
+        from nonebot_plugin_pixivbot.handler.common.ranking import RankingHandler
+
+        # 订阅的参数经JSON保存后，日期为isoformat字符串
+        assert RankingHandler._normalize_date("2024-05-01") == date(2024, 5, 1)
+        assert RankingHandler._normalize_date(date(2024, 5, 1)) == date(2024, 5, 1)
+        assert RankingHandler._normalize_date(None) is None
+
+    def test_validate_date(self):
+        from nonebot_plugin_pixivbot.config import Config
+        from nonebot_plugin_pixivbot.handler.common.ranking import RankingHandler
+        from nonebot_plugin_pixivbot.global_context import context
+        from nonebot_plugin_pixivbot.utils.errors import BadRequestError
+        from nonebot_plugin_pixivbot.utils.ranking_date import latest_ranking_date
+
+        handler = RankingHandler.__new__(RankingHandler)
+        latest = latest_ranking_date(context.require(Config).pixiv_ranking_rollover_time)
+
+        handler.validate_date(RankingHandler._normalize_date(latest.isoformat()))
+        with pytest.raises(BadRequestError):
+            handler.validate_date(RankingHandler._normalize_date((latest + timedelta(days=1)).isoformat()))
+        with pytest.raises(BadRequestError):
+            RankingHandler._normalize_date("2024-13-01")
@@ -0,0 +1,108 @@
+import pytest
+
+from tests import MyTest
+
+
+class FakeIllustList:
+    """
+    模拟带PixivRepoMetadata的插画列表：第p页（从1开始）有sizes[p-1]项（过滤后每页的数量不定）
+    """
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.loaded_pages = 0
+
+    @property
+    def items(self):
+        return list(range(sum(self.sizes)))
+
+    async def agen(self):
+        from nonebot_plugin_pixivbot.data.pixiv_repo.models import PixivRepoMetadata
+
+        yield PixivRepoMetadata(pages=0)
+        i = 0
+        for p, size in enumerate(self.sizes):
+            for _ in range(size):
+                yield i
+                i += 1
+            self.loaded_pages = p + 1
+            yield PixivRepoMetadata(pages=p + 1)
+
+
+class TestProgressively(MyTest):
+    @pytest.fixture
+    def service(self, monkeypatch):
+        from nonebot_plugin_pixivbot.service import pixiv_service
+        from nonebot_plugin_pixivbot.service.pixiv_service import PixivService
+
+        monkeypatch.setattr(pixiv_service.conf, "pixiv_random_progressive_pages", 2)
+        return PixivService()
+
+    @pytest.mark.asyncio
+    async def test_count_pages(self, service):
+        lst = FakeIllustList([1, 0, 3, 2, 5])
+
+        # 按页而不是按项数计数，前两页过滤后只有1项
+        got = [x async for x in service._progressively("key", lst.agen())]
+        assert got == [0]
+
+        # 后台加载剩余部分
+        await service._progressive_loads["key"].task
+        assert lst.loaded_pages == 5
+        assert "key" not in service._progressive_loads
+
+    @pytest.mark.asyncio
+    async def test_completed(self, service):
+        lst = FakeIllustList([3] * 5)
+
+        got = [x async for x in service._progressively("key", lst.agen())]
+        assert got == lst.items[:6]
+        await service._progressive_loads["key"].task
+
+        # 后台加载完成后，之后的请求从完整的列表中抽取
+        got = [x async for x in service._progressively("key", lst.agen())]
+        assert got == lst.items
+
+    @pytest.mark.asyncio
+    async def test_loading(self, service):
+        from asyncio import sleep
+
+        lst = FakeIllustList([3] * 5)
+
+        async def slow_agen():
+            async for x in lst.agen():
+                yield x
+                await sleep(0.01)
+
+        got = [x async for x in service._progressively("key", slow_agen())]
+        assert got == lst.items[:6]
+        await sleep(0.05)
+
+        # 后台加载途中的请求产出到后台已加载的位置，不重复发起后台加载
+        load = service._progressive_loads["key"]
+        got = [x async for x in service._progressively("key", lst.agen())]
+        assert len(got) == 3 * load.pages and load.pages > 2
+        assert service._progressive_loads["key"] is load
+        await load.task
+
+    @pytest.mark.asyncio
+    async def test_prewarm(self, service, monkeypatch):
+        from types import SimpleNamespace
+
+        from nonebot_plugin_pixivbot.service import pixiv_service
+
+        lst = FakeIllustList([3] * 5)
+
+        async def user_bookmarks(pixiv_user_id):
+            async for x in lst.agen():
+                if isinstance(x, int):
+                    yield x
+
+        monkeypatch.setattr(pixiv_service, "repo", SimpleNamespace(user_bookmarks=user_bookmarks))
+        monkeypatch.setattr(service, "_get_columns", lambda key, illusts: None)
+
+        # 预热加载了完整的列表，之后的请求直接从完整的列表中抽取
+        await service.prewarm_random_bookmark(0)
+        got = [x async for x in service._progressively(("user_bookmarks", 0), lst.agen())]
+        assert got == lst.items
+        assert ("user_bookmarks", 0) not in service._progressive_loads
@@ -0,0 +1,71 @@
+import random
+from collections import Counter
+
+import pytest
+
+from tests import MyTest
+
+DAY = 24 * 60 * 60
+
+
+class TestStreamRoulette(MyTest):
+    @pytest.fixture
+    def illusts(self):
+        from time import time
+
+        from nonebot_plugin_pixivbot.data.pixiv_repo import LazyIllust
+        from nonebot_plugin_pixivbot.model import IllustSummary
+
+        now = time()
+        data = [(100, 1000, 1), (500, 300, 2), (20, 5000, 4), (1000, 800, 8), (0, 50, 16), (300, 2000, 32)]
+        return [LazyIllust.from_summary(IllustSummary(i, bookmarks, views, now - days * DAY, frozenset()))
+                for i, (bookmarks, views, days) in enumerate(data)]
+
+    @staticmethod
+    async def aiter(illusts):
+        for x in illusts:
+            yield x
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("method", ["uniform", "bookmark_proportion", "view_proportion", "timedelta_proportion"])
+    async def test_distribution(self, illusts, method, monkeypatch):
+        import numpy as np
+
+        from nonebot_plugin_pixivbot.enums import RandomIllustMethod
+        from nonebot_plugin_pixivbot.service.roulette import roulette, stream_roulette
+
+        random_method = RandomIllustMethod(method)
+        random.seed(0)
+        rng = np.random.default_rng(0)
+        monkeypatch.setattr(np.random, "default_rng", lambda *args: rng)
+
+        trials = 4000
+        k = 2
+        expected = Counter()
+        actual = Counter()
+        for _ in range(trials):
+            expected.update(x.id for x in roulette(illusts, random_method, k))
+
+            winners, n = await stream_roulette(self.aiter(illusts), random_method, k)
+            assert n == len(illusts)
+            assert len({x.id for x in winners}) == k
+            actual.update(x.id for x in winners)
+
+        # 流式抽取中每一项被抽中的频率与roulette()一致
+        for x in illusts:
+            assert abs(actual[x.id] - expected[x.id]) / trials < 0.05, (x.id, actual, expected)
+
+    @pytest.mark.asyncio
+    async def test_key_underflow(self, monkeypatch):
+        from nonebot_plugin_pixivbot.data.pixiv_repo import LazyIllust
+        from nonebot_plugin_pixivbot.enums import RandomIllustMethod
+        from nonebot_plugin_pixivbot.model import IllustSummary
+        from nonebot_plugin_pixivbot.service import roulette
+
+        # 水库中是权重很小的项时，权重极大的项的T^w下溢为0，random.uniform取到下界也不应出现log(0)
+        monkeypatch.setattr(roulette.random, "uniform", lambda a, b: a)
+        illusts = [LazyIllust.from_summary(IllustSummary(i, 0 if i < 2 else 10 ** 9, 0, 0, frozenset()))
+                   for i in range(20)]
+
+        winners, n = await roulette.stream_roulette(self.aiter(illusts), RandomIllustMethod.bookmark_proportion, 2)
+        assert n == 20 and len(winners) == 2
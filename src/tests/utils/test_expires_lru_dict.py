@@ -46,6 +46,25 @@ class TestExpiresLruDict(MyTest):
         for i in range(1, 11):
             assert await lru.get(i) == i
 
+    @pytest.mark.asyncio
+    async def test_lru_order(self, lru):
+        expires = datetime.now(timezone.utc) + timedelta(seconds=30)
+        for i in range(10):
+            await lru.add(i, i, expires)
+
+        # 0和1最近被访问过，容量已满时依次淘汰2和3
+        assert await lru.get(0) == 0
+        assert await lru.get(1) == 1
+        await lru.add(10, 10, expires)
+        await lru.add(11, 11, expires)
+
+        assert await lru.get(2) is None
+        assert await lru.get(3) is None
+        for i in [0, 1, *range(4, 12)]:
+            assert await lru.get(i) == i
+        assert lru.on_cleanup.call_args_list[0].args == (2, 2)
+        assert lru.on_cleanup.call_args_list[1].args == (3, 3)
+
     @pytest.mark.asyncio
     async def test_expires_lru(self, lru):
         now = datetime.now(timezone.utc)
@@ -0,0 +1,27 @@
+from datetime import date, datetime, time, timezone
+
+import pytest
+
+from tests import MyTest
+
+
+class TestRankingDate(MyTest):
+    def test_latest_ranking_date(self):
+        from nonebot_plugin_pixivbot.utils.ranking_date import latest_ranking_date
+
+        rollover = time(12, 30)
+        # 日本时间2024-05-02 12:29，前一天的榜单还未发布
+        assert latest_ranking_date(rollover, datetime(2024, 5, 2, 3, 29, tzinfo=timezone.utc)) == date(2024, 4, 30)
+        # 日本时间2024-05-02 12:30
+        assert latest_ranking_date(rollover, datetime(2024, 5, 2, 3, 30, tzinfo=timezone.utc)) == date(2024, 5, 1)
+        # UTC仍是前一天，日本时间已是2024-05-02 08:00
+        assert latest_ranking_date(rollover, datetime(2024, 5, 1, 23, 0, tzinfo=timezone.utc)) == date(2024, 4, 30)
+
+    def test_parse_ranking_date(self):
+        from nonebot_plugin_pixivbot.utils.ranking_date import parse_ranking_date
+
+        assert parse_ranking_date("2024-05-01") == date(2024, 5, 1)
+        assert parse_ranking_date("2024-5-1") == date(2024, 5, 1)
+        assert parse_ranking_date("20240501") == date(2024, 5, 1)
+        with pytest.raises(ValueError):
+            parse_ranking_date("2024-13-01")
@@ -0,0 +1,203 @@
+from asyncio import sleep, create_task, gather
+from collections import deque
+from time import monotonic
+
+import pytest
+
+from tests import MyTest
+
+
+class FakePixivAPI:
+    """
+    模拟Pixiv API：任意1秒内最多处理capacity个请求，超出的返回Rate Limit错误
+    """
+
+    def __init__(self, capacity: int, latency: float):
+        self.capacity = capacity
+        self.latency = latency
+        self.history = deque()
+        self.log = []  # (时间, 是否被限流)
+
+    async def call(self) -> dict:
+        await sleep(self.latency)
+
+        now = monotonic()
+        while len(self.history) > 0 and now - self.history[0] >= 1.0:
+            self.history.popleft()
+
+        if len(self.history) >= self.capacity:
+            self.log.append((now, True))
+            return {"error": {"user_message": "", "message": "Rate Limit", "reason": ""}}
+
+        self.history.append(now)
+        self.log.append((now, False))
+        return {"illusts": []}
+
+
+class TestAdaptiveRateLimiter(MyTest):
+    @pytest.mark.asyncio
+    async def test_adapts_to_fake_api(self):
+        from nonebot_plugin_pixivbot.utils.errors import RateLimitError
+        from nonebot_plugin_pixivbot.utils.rate_limiter import AdaptiveRateLimiter
+
+        api = FakePixivAPI(capacity=20, latency=0.01)
+        limiter = AdaptiveRateLimiter(initial_rate=60, min_rate=1, max_rate=100, capacity=5, max_concurrency=8)
+
+        begin = monotonic()
+        duration = 5.0
+
+        async def client():
+            while monotonic() - begin < duration:
+                try:
+                    async with limiter.limit(timeout=1.0):
+                        raw = await api.call()
+                        if "error" in raw:
+                            raise RateLimitError()
+                except RateLimitError:
+                    pass
+
+        await gather(*[create_task(client()) for _ in range(30)])
+
+        metrics = limiter.metrics
+        assert metrics.rate_limited > 0
+        assert limiter.rate < 60
+
+        def limited_ratio(lo: float, hi: float) -> float:
+            window = [limited for t, limited in api.log if lo <= t - begin < hi]
+            return sum(window) / len(window)
+
+        # 速率下降后被限流的比例应明显减少
+        assert limited_ratio(duration - 2, duration) < limited_ratio(0, 1.5)
+
+    @pytest.mark.asyncio
+    async def test_deadline(self):
+        from nonebot_plugin_pixivbot.utils.errors import RateLimitError
+        from nonebot_plugin_pixivbot.utils.rate_limiter import AdaptiveRateLimiter
+
+        limiter = AdaptiveRateLimiter(initial_rate=0.5, min_rate=0.1, max_rate=1, capacity=1, max_concurrency=1)
+
+        await limiter.acquire(timeout=0.1)
+        limiter.release()
+
+        # 下一个令牌要2秒后才有，不应等到那时才失败
+        begin = monotonic()
+        with pytest.raises(RateLimitError):
+            await limiter.acquire(timeout=0.1)
+        assert monotonic() - begin < 0.5
+        assert limiter.metrics.timeouts == 1
+
+        # 没有截止时间时一直等到获得配额
+        await limiter.acquire()
+        limiter.release()
+        assert limiter.metrics.acquired == 2
+        assert limiter.metrics.max_wait_time > 1.0
+
+    @pytest.mark.asyncio
+    async def test_refund_token_on_timeout(self):
+        from nonebot_plugin_pixivbot.utils.errors import RateLimitError
+        from nonebot_plugin_pixivbot.utils.rate_limiter import AdaptiveRateLimiter
+
+        limiter = AdaptiveRateLimiter(initial_rate=0.1, min_rate=0.1, max_rate=1, capacity=2, max_concurrency=1)
+
+        await limiter.acquire()
+
+        # 拿到了令牌但等不到并发配额，超时后令牌应归还
+        with pytest.raises(RateLimitError):
+            await limiter.acquire(timeout=0.05)
+        assert limiter.metrics.tokens >= 1
+
+        limiter.release()
+        begin = monotonic()
+        await limiter.acquire(timeout=0.1)
+        limiter.release()
+        assert monotonic() - begin < 0.1
+
+    @pytest.mark.asyncio
+    async def test_queue_depth(self):
+        from nonebot_plugin_pixivbot.utils.rate_limiter import AdaptiveRateLimiter
+
+        limiter = AdaptiveRateLimiter(initial_rate=5, min_rate=1, max_rate=10, capacity=1, max_concurrency=4)
+
+        async def request():
+            async with limiter.limit():
+                pass
+
+        tasks = [create_task(request()) for _ in range(4)]
+        await sleep(0.05)
+        assert limiter.metrics.queue_depth >= 2
+
+        await gather(*tasks)
+        assert limiter.metrics.queue_depth == 0
+        assert limiter.metrics.acquired == 4
+        assert limiter.metrics.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_concurrency_limiter(self):
+        from nonebot_plugin_pixivbot.utils.errors import RateLimitError
+        from nonebot_plugin_pixivbot.utils.rate_limiter import ConcurrencyLimiter
+
+        limiter = ConcurrencyLimiter(max_concurrency=2)
+
+        async def download():
+            async with limiter.limit():
+                await sleep(0.2)
+
+        tasks = [create_task(download()) for _ in range(2)]
+        await sleep(0.05)
+        assert limiter.metrics.in_flight == 2
+
+        # 池已满时超时失败
+        with pytest.raises(RateLimitError):
+            await limiter.acquire(timeout=0.05)
+        assert limiter.metrics.timeouts == 1
+
+        await gather(*tasks)
+        assert limiter.metrics.in_flight == 0
+        assert limiter.metrics.acquired == 2
+
+    @pytest.mark.asyncio
+    async def test_priority(self):
+        from nonebot_plugin_pixivbot.utils.rate_limiter import PrioritySemaphore
+
+        sema = PrioritySemaphore(1, aging=0.2)
+        await sema.acquire()
+
+        order = []
+
+        async def request(name: str, priority: int):
+            await sema.acquire(priority)
+            order.append(name)
+            sema.release()
+
+        tasks = [create_task(request("background", 1))]
+        await sleep(0.01)
+        tasks.append(create_task(request("interactive", 0)))
+        await sleep(0.01)
+
+        # 后到的高优先级请求先获得
+        sema.release()
+        await gather(*tasks)
+        assert order == ["interactive", "background"]
+
+        # 等待超过aging的低优先级请求不会被之后到达的高优先级请求饿死
+        order.clear()
+        await sema.acquire()
+        tasks = [create_task(request("background", 1))]
+        await sleep(0.3)
+        tasks.append(create_task(request("interactive", 0)))
+        await sleep(0.01)
+
+        sema.release()
+        await gather(*tasks)
+        assert order == ["background", "interactive"]
+
+    @pytest.mark.asyncio
+    async def test_default_initial_rate(self):
+        from nonebot_plugin_pixivbot.utils.rate_limiter import AdaptiveRateLimiter
+
+        # 未指定初始速率时从最高速率开始，直到被限流才降速
+        limiter = AdaptiveRateLimiter(initial_rate=None, min_rate=0.1, max_rate=10, capacity=1, max_concurrency=1)
+        assert limiter.rate == 10
+
+        limiter.on_rate_limited()
+        assert limiter.rate == 5
@@ -1,220 +1,177 @@
-# from asyncio import sleep, create_task, gather
-# from datetime import datetime, timedelta, timezone
-# from typing import AsyncGenerator
-# from unittest.mock import MagicMock, AsyncMock, call
-#
-# import pytest
-#
-# from tests import MyTest
-#
-#
-# class TestSharedAsyncGeneratorContextManager(MyTest):
-#     @pytest.fixture
-#     def origin_agen(self):
-#         cnt = 0
-#
-#         async def agen():
-#             nonlocal cnt
-#             for i in range(10):
-#                 await sleep(0.1)
-#                 yield cnt
-#                 cnt += 1
-#
-#         return agen()
-#
-#     @pytest.fixture
-#     def origin_agen_raises(self):
-#         cnt = 0
-#
-#         async def agen():
-#             nonlocal cnt
-#             for i in range(10):
-#                 await sleep(0.1)
-#                 yield cnt
-#                 cnt += 1
-#             raise RuntimeError()
-#
-#         return agen()
-#
-#     @pytest.fixture
-#     def ctx_mgr_factory(self):
-#         from nonebot_plugin_pixivbot.utils.shared_agen import SharedAsyncGeneratorHolder
-#
-#         def factory(origin_agen):
-#             on_each = AsyncMock()
-#             on_stop = AsyncMock()
-#             on_error = AsyncMock()
-#             on_consumers_changed = MagicMock()
-#
-#             # noinspection PyTypeChecker
-#             return SharedAsyncGeneratorHolder(
-#                 origin_agen,
-#                 on_each=on_each,
-#                 on_stop=on_stop,
-#                 on_error=on_error,
-#                 on_consumers_changed=on_consumers_changed
-#             )
-#
-#         return factory
-#
-#     @pytest.mark.asyncio
-#     async def test_on_each_and_on_stop(self, ctx_mgr_factory, origin_agen):
-#         ctx_mgr = ctx_mgr_factory(origin_agen)
-#         with ctx_mgr as iter:
-#             items = [i async for i in iter]
-#
-#         # noinspection PyUnresolvedReferences
-#         ctx_mgr._on_each.assert_has_awaits([call(i) for i in range(10)])
-#         # noinspection PyUnresolvedReferences
-#         ctx_mgr._on_stop.assert_awaited_once_with([i for i in range(10)])
-#
-#     @pytest.mark.asyncio
-#     async def test_on_error(self, ctx_mgr_factory, origin_agen_raises):
-#         ctx_mgr = ctx_mgr_factory(origin_agen_raises)
-#         with pytest.raises(RuntimeError) as e:
-#             with ctx_mgr as iter:
-#                 items = [i async for i in iter]
-#
-#             # noinspection PyUnresolvedReferences
-#             ctx_mgr._on_error.assert_awaited_once_with(e)
-#
-#     @pytest.mark.asyncio
-#     async def test_single_consumer(self, ctx_mgr_factory, origin_agen):
-#         ctx_mgr = ctx_mgr_factory(origin_agen)
-#         with ctx_mgr as iter:
-#             items = [i async for i in iter]
-#
-#         assert items == [i for i in range(10)]
-#
-#         # noinspection PyTypeChecker
-#         on_consumers_changed: MagicMock = ctx_mgr._on_consumers_changed
-#         assert on_consumers_changed.call_args_list[0].args == (ctx_mgr, 1)
-#         assert on_consumers_changed.call_args_list[1].args == (ctx_mgr, 0)
-#
-#     @pytest.mark.asyncio
-#     async def test_multi_consumer(self, ctx_mgr_factory, origin_agen):
-#         ctx_mgr = ctx_mgr_factory(origin_agen)
-#
-#         async def consume():
-#             with ctx_mgr as iter:
-#                 items = [i async for i in iter]
-#
-#             assert items == [i for i in range(10)]
-#
-#         # consumer2 except to wait for all the 10 items together
-#         consumer1 = create_task(consume())
-#         await sleep(0.25)
-#
-#         # consumer2 except to get 2 generated items, then wait for the rest 8 items together
-#         consumer2 = create_task(consume())
-#
-#         # consumer3 begin collecting after the agen stopped
-#         await sleep(1.5)
-#         consumer3 = create_task(consume())
-#
-#         await gather(consumer1, consumer2, consumer3)
-#
-#         # noinspection PyTypeChecker
-#         on_consumers_changed: MagicMock = ctx_mgr._on_consumers_changed
-#         assert on_consumers_changed.call_args_list[0].args == (ctx_mgr, 1)
-#         assert on_consumers_changed.call_args_list[1].args == (ctx_mgr, 2)
-#         assert on_consumers_changed.call_args_list[2].args == (ctx_mgr, 1)
-#         assert on_consumers_changed.call_args_list[3].args == (ctx_mgr, 0)
-#         assert on_consumers_changed.call_args_list[4].args == (ctx_mgr, 1)
-#         assert on_consumers_changed.call_args_list[5].args == (ctx_mgr, 0)
-#
-#     @pytest.mark.asyncio
-#     async def test_close(self, ctx_mgr_factory, origin_agen):
-#         ctx_mgr = ctx_mgr_factory(origin_agen)
-#         with ctx_mgr as iter:
-#             await iter.__anext__()
-#             await iter.__anext__()
-#
-#         ctx_mgr.close()
-#
-#         with ctx_mgr as iter:
-#             await iter.__anext__()
-#             await iter.__anext__()
-#             with pytest.raises(StopAsyncIteration):
-#                 await iter.__anext__()
-#
-#
-# class TestSharedAsyncGeneratorManager(MyTest):
-#     @pytest.fixture
-#     def shared_agen_mgr(self):
-#         from nonebot_plugin_pixivbot.utils.shared_agen import SharedAsyncGeneratorManager
-#
-#         class SharedAsyncGeneratorManagerImpl(SharedAsyncGeneratorManager[int, int]):
-#             def agen(self, identifier: int, *args, **kwargs) -> AsyncGenerator[int, None]:
-#                 async def agen():
-#                     cnt = identifier
-#                     for i in range(10):
-#                         await sleep(0.1)
-#                         yield cnt
-#                         cnt += 1
-#
-#                 return agen()
-#
-#         impl = SharedAsyncGeneratorManagerImpl()
-#         impl.on_agen_next = AsyncMock()
-#         impl.on_agen_stop = AsyncMock()
-#         return impl
-#
-#     @pytest.mark.asyncio
-#     async def test_get(self, shared_agen_mgr):
-#         # except same
-#         inst = shared_agen_mgr.get(0)
-#         with inst as iter:
-#             inst2 = shared_agen_mgr.get(0)
-#             with inst2 as iter2:
-#                 assert inst == inst2
-#
-#         # prev inst was except to be destroyed
-#
-#         inst3 = shared_agen_mgr.get(0)
-#         assert inst != inst3
-#
-#     @pytest.mark.asyncio
-#     async def test_set_expires_time(self, shared_agen_mgr):
-#         inst = shared_agen_mgr.get(0)
-#         with inst as iter:
-#             await iter.__anext__()
-#             await iter.__anext__()
-#
-#             await shared_agen_mgr.set_expires_time(0, datetime.now(timezone.utc) + timedelta(seconds=1))
-#
-#         # prev inst was except to be saved
-#
-#         inst2 = shared_agen_mgr.get(0)
-#         assert inst == inst2
-#
-#         await sleep(1.5)
-#
-#         # prev inst was except to be removed
-#
-#         inst2 = shared_agen_mgr.get(0)
-#         assert inst != inst2
-#
-#     @pytest.mark.asyncio
-#     async def test_invalidate(self, shared_agen_mgr):
-#         inst = shared_agen_mgr.get(0)
-#         with inst as iter:
-#             await iter.__anext__()
-#             await iter.__anext__()
-#
-#             await shared_agen_mgr.set_expires_time(0, datetime.now(timezone.utc) + timedelta(seconds=1))
-#
-#         # prev inst was except to be saved
-#
-#         inst2 = shared_agen_mgr.get(0)
-#         assert inst == inst2
-#
-#         await shared_agen_mgr.invalidate(0)
-#
-#         # prev inst was except to be removed
-#
-#         inst2 = shared_agen_mgr.get(0)
-#         assert inst != inst2
-#
-#         # invalidate a non-existing key should not raise
-#         await shared_agen_mgr.invalidate(114514)
+import time
+from asyncio import sleep, create_task, gather
+
+import pytest
+
+from tests import MyTest
+
+
+class TestSharedAsyncGeneratorManager(MyTest):
+    @pytest.fixture
+    def mgr_factory(self):
+        from nonebot_plugin_pixivbot.utils.request_priority import current_priority
+        from nonebot_plugin_pixivbot.utils.shared_agen import SharedAsyncGeneratorManager
+
+        class SharedAsyncGeneratorManagerImpl(SharedAsyncGeneratorManager[int, int]):
+            """
+            identifier为i的agen依次产生i, i+1, ..., i+n-1，记录每个origin的创建、关闭以及产生每一项时的优先级
+            """
+
+            def __init__(self, n: int, bounded: bool):
+                super().__init__()
+                self.n = n
+                self._bounded = bounded
+                self.created = 0
+                self.closed = 0
+                self.priorities = []
+
+            def bounded(self, identifier: int) -> bool:
+                return self._bounded
+
+            def snapshot_item(self, identifier: int, item: int) -> int:
+                return -item
+
+            def agen(self, identifier: int, cache_strategy, **kwargs):
+                self.created += 1
+
+                async def agen():
+                    try:
+                        for i in range(self.n):
+                            await sleep(0.01)
+                            self.priorities.append(current_priority())
+                            yield identifier + i
+                    finally:
+                        self.closed += 1
+
+                return agen()
+
+        def factory(n: int = 10, bounded: bool = False):
+            return SharedAsyncGeneratorManagerImpl(n, bounded)
+
+        return factory
+
+    @pytest.mark.asyncio
+    async def test_fan_out(self, mgr_factory):
+        mgr = mgr_factory()
+
+        async def consume(delay: float):
+            await sleep(delay)
+            async with mgr.get(0) as gen:
+                return [x async for x in gen]
+
+        # 后加入的消费者先重放已产生的项，再与先加入的消费者一起等待之后的项
+        result = await gather(consume(0), consume(0), consume(0.035))
+        assert result == [list(range(10))] * 3
+        assert mgr.created == 1
+
+    @pytest.mark.asyncio
+    async def test_replay_cached(self, mgr_factory):
+        mgr = mgr_factory()
+
+        async with mgr.get(0) as gen:
+            await mgr.set_expires_time(0, time.time() + 10)
+            assert [x async for x in gen] == list(range(10))
+
+        # 停止后缓存的agen从头重放，不再创建origin
+        assert mgr.is_cached(0)
+        async with mgr.get(0) as gen:
+            assert [x async for x in gen] == list(range(10))
+        assert mgr.created == 1
+
+        # 失效后重新创建origin
+        await mgr.invalidate(0)
+        assert not mgr.is_cached(0)
+        async with mgr.get(0) as gen:
+            assert [x async for x in gen] == list(range(10))
+        assert mgr.created == 2
+
+    @pytest.mark.asyncio
+    async def test_early_exit(self, mgr_factory):
+        mgr = mgr_factory()
+
+        async with mgr.get(0) as gen:
+            await mgr.set_expires_time(0, time.time() + 10)
+            assert await gen.__anext__() == 0
+            assert await gen.__anext__() == 1
+
+        # origin未停止时所有消费者都已退出，origin被关闭且不会被缓存
+        assert mgr.closed == 1
+        assert not mgr.is_cached(0)
+
+        async with mgr.get(0) as gen:
+            assert [x async for x in gen] == list(range(10))
+        assert mgr.created == 2
+
+    @pytest.mark.asyncio
+    async def test_early_exit_one_of_many(self, mgr_factory):
+        mgr = mgr_factory()
+
+        async def consume(limit: int):
+            async with mgr.get(0) as gen:
+                result = []
+                async for x in gen:
+                    result.append(x)
+                    if len(result) == limit:
+                        break
+                return result
+
+        # 只有部分消费者提前退出时，其余消费者继续读到所有项
+        result = await gather(consume(3), consume(10))
+        assert result == [[0, 1, 2], list(range(10))]
+        assert mgr.created == 1
+        assert mgr.closed == 1
+
+    @pytest.mark.asyncio
+    async def test_bounded(self, mgr_factory):
+        mgr = mgr_factory(n=5, bounded=True)
+
+        async with mgr.get(0) as gen1:
+            await mgr.set_expires_time(0, time.time() + 10)
+            async with mgr.get(0) as gen2:
+                holder = mgr._running_holders[0]
+
+                assert await gen2.__anext__() == 0
+                assert [await gen1.__anext__() for _ in range(3)] == [0, 1, 2]
+                # 只保留gen2还未读到的原始项
+                assert holder.buffered == 2
+
+                assert [await gen2.__anext__() for _ in range(2)] == [1, 2]
+                assert holder.buffered == 0
+
+                assert [x async for x in gen1] == [3, 4]
+                assert [x async for x in gen2] == [3, 4]
+
+        # 之后的消费者从快照重放
+        async with mgr.get(0) as gen:
+            assert [x async for x in gen] == [0, -1, -2, -3, -4]
+        assert mgr.created == 1
+
+    @pytest.mark.asyncio
+    async def test_priority(self, mgr_factory):
+        from nonebot_plugin_pixivbot.utils.request_priority import RequestPriority, request_priority
+
+        mgr = mgr_factory(n=3)
+
+        async def background_consume():
+            with request_priority(RequestPriority.background):
+                async with mgr.get(0) as gen:
+                    result = [await gen.__anext__()]
+                    # 等待用户指令加入
+                    await sleep(0.05)
+                    return result + [x async for x in gen]
+
+        async def interactive_consume():
+            await sleep(0.02)
+            async with mgr.get(0) as gen:
+                result = [await gen.__anext__()]
+                # 之后的项由后台任务取得
+                await sleep(0.1)
+                return result + [x async for x in gen]
+
+        background = create_task(background_consume())
+        interactive = create_task(interactive_consume())
+        assert await background == await interactive == [0, 1, 2]
+
+        # 第一项由后台任务单独取得，用户指令加入后后台任务按用户指令的优先级取得之后的项
+        assert mgr.priorities == [RequestPriority.background, RequestPriority.interactive,
+                                  RequestPriority.interactive]
@@ -0,0 +1,54 @@
+import pytest
+
+from tests import MyTest
+
+
+class TestSizedLruCache(MyTest):
+    @pytest.fixture
+    def clock(self):
+        class Clock:
+            now = 0.0
+
+            def __call__(self):
+                return self.now
+
+        return Clock()
+
+    @pytest.fixture
+    def cache(self, clock):
+        from nonebot_plugin_pixivbot.utils.sized_lru_cache import SizedLruCache
+
+        return SizedLruCache(100, ttu=lambda k, v, now: now + 10, getsizeof=len, timer=clock)
+
+    def test_evict_lru(self, cache):
+        cache["a"] = b"x" * 40
+        cache["b"] = b"x" * 40
+        assert cache.get("a") is not None  # a变为最近使用
+
+        cache["c"] = b"x" * 40
+        assert "a" in cache
+        assert "b" not in cache
+        assert "c" in cache
+
+        usage = cache.usage
+        assert usage.used == 80
+        assert usage.entries == 2
+        assert usage.evictions == 1
+
+    def test_expire_before_evict(self, cache, clock):
+        cache["a"] = b"x" * 40
+        clock.now = 5
+        cache["b"] = b"x" * 40
+
+        clock.now = 12
+        assert "a" not in cache
+        cache["c"] = b"x" * 40
+        assert "b" in cache
+        assert cache.usage.evictions == 0
+
+    def test_oversize(self, cache):
+        cache["a"] = b"x" * 40
+        cache["b"] = b"x" * 101
+        assert "b" not in cache
+        assert "a" in cache
+        assert cache.usage.used == 40